@@ -0,0 +1,95 @@
+"""bet partitions
+
+Revision ID: 0a7f4e0a408f
+Revises: 2ced9d97c83d
+Create Date: 2026-10-18 14:05:51.604187
+
+"""
+import datetime
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '0a7f4e0a408f'
+down_revision = '2ced9d97c83d'
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ('ix_bet_event_id_wait', 'bet_legacy_event_id_idx'),
+    ('ix_bet_created_at_id', 'bet_legacy_created_at_id_idx'),
+    ('ix_bet_event_id_created_at_id', 'bet_legacy_event_id_created_at_id_idx'),
+]
+
+
+def create_indexes(table: str) -> None:
+    op.create_index('ix_bet_event_id_wait', table, ['event_id'], unique=False, postgresql_where=sa.text("state = 'WAIT'"))
+    op.create_index('ix_bet_created_at_id', table, ['created_at', 'id'], unique=False)
+    op.create_index('ix_bet_event_id_created_at_id', table, ['event_id', 'created_at', 'id'], unique=False)
+
+
+def next_month() -> int:
+    today = datetime.datetime.now(datetime.timezone.utc)
+    month = today.year * 12 + today.month
+    start = datetime.datetime(month // 12, month % 12 + 1, 1, tzinfo=datetime.timezone.utc)
+    return int(start.timestamp())
+
+
+def upgrade() -> None:
+    end = next_month()
+    # a validated constraint that implies the partition bound and NOT NULL
+    # lets SET NOT NULL and ATTACH skip scanning the table under ACCESS
+    # EXCLUSIVE. Validation only takes SHARE UPDATE EXCLUSIVE, bets are
+    # written meanwhile, so it is committed before the locking part
+    with op.get_context().autocommit_block():
+        op.execute(f'ALTER TABLE bet ADD CONSTRAINT bet_created_at_bound CHECK (created_at IS NOT NULL AND created_at < {end}) NOT VALID')
+        op.execute('ALTER TABLE bet VALIDATE CONSTRAINT bet_created_at_bound')
+
+    # the existing table becomes the partition of everything up to the end
+    # of this month, without copying it. Its indexes are renamed and reused
+    # by the partitioned ones, the app creates monthly partitions after it
+    op.rename_table('bet', 'bet_legacy')
+    for name, legacy_name in INDEXES:
+        op.execute(f'ALTER INDEX {name} RENAME TO {legacy_name}')
+    op.execute('ALTER TABLE bet_legacy RENAME CONSTRAINT bet_event_id_fkey TO bet_legacy_event_id_fkey')
+    op.drop_constraint('bet_pkey', 'bet_legacy', type_='primary')
+    op.alter_column('bet_legacy', 'created_at', existing_type=sa.Integer(), nullable=False)
+
+    op.create_table('bet',
+    sa.Column('id', sa.UUID(), nullable=False),
+    sa.Column('event_id', sa.UUID(), nullable=True),
+    sa.Column('amount', sa.Numeric(precision=10, scale=2), nullable=True),
+    sa.Column('coefficient', sa.Numeric(precision=4, scale=2), nullable=True),
+    sa.Column('created_at', sa.Integer(), nullable=False),
+    sa.Column('state', postgresql.ENUM('WAIT', 'WIN', 'LOSE', name='betstate', create_type=False), nullable=True),
+    sa.Column('payout', sa.Numeric(precision=12, scale=2), nullable=True),
+    sa.ForeignKeyConstraint(['event_id'], ['event.id'], ),
+    sa.PrimaryKeyConstraint('id', 'created_at'),
+    postgresql_partition_by='RANGE (created_at)'
+    )
+    create_indexes('bet')
+    op.execute(f'ALTER TABLE bet ATTACH PARTITION bet_legacy FOR VALUES FROM (MINVALUE) TO ({end})')
+    op.drop_constraint('bet_created_at_bound', 'bet_legacy', type_='check')
+    op.execute('CREATE TABLE bet_default PARTITION OF bet DEFAULT')
+
+
+def downgrade() -> None:
+    op.create_table('bet_flat',
+    sa.Column('id', sa.UUID(), nullable=False),
+    sa.Column('event_id', sa.UUID(), nullable=True),
+    sa.Column('amount', sa.Numeric(precision=10, scale=2), nullable=True),
+    sa.Column('coefficient', sa.Numeric(precision=4, scale=2), nullable=True),
+    sa.Column('created_at', sa.Integer(), nullable=True),
+    sa.Column('state', postgresql.ENUM('WAIT', 'WIN', 'LOSE', name='betstate', create_type=False), nullable=True),
+    sa.Column('payout', sa.Numeric(precision=12, scale=2), nullable=True),
+    )
+    op.execute('INSERT INTO bet_flat SELECT id, event_id, amount, coefficient, created_at, state, payout FROM bet')
+    # with all partitions, archived ones are gone
+    op.drop_table('bet')
+    op.rename_table('bet_flat', 'bet')
+    op.create_primary_key('bet_pkey', 'bet', ['id'])
+    op.create_foreign_key('bet_event_id_fkey', 'bet', 'event', ['event_id'], ['id'])
+    create_indexes('bet')
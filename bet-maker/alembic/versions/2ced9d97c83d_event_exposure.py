@@ -0,0 +1,41 @@
+"""event exposure
+
+Revision ID: 2ced9d97c83d
+Revises: 8d870835e8f1
+Create Date: 2026-10-18 12:40:02.118734
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2ced9d97c83d'
+down_revision = '8d870835e8f1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('event_exposure',
+    sa.Column('event_id', sa.UUID(), nullable=False),
+    sa.Column('staked', sa.Numeric(precision=16, scale=2), nullable=False),
+    sa.Column('bet_count', sa.Integer(), nullable=False),
+    sa.Column('potential_payout', sa.Numeric(precision=18, scale=2), nullable=False),
+    sa.Column('settled_count', sa.Integer(), nullable=False),
+    sa.Column('paid_out', sa.Numeric(precision=18, scale=2), nullable=False),
+    sa.ForeignKeyConstraint(['event_id'], ['event.id'], ),
+    sa.PrimaryKeyConstraint('event_id')
+    )
+    # existing bets, later ones are added with every bet
+    op.execute("""
+        INSERT INTO event_exposure
+        SELECT event_id, sum(amount), count(*), sum(round(amount * coefficient, 2)),
+               count(*) FILTER (WHERE state != 'WAIT'), coalesce(sum(payout), 0)
+        FROM bet
+        GROUP BY event_id
+    """)
+
+
+def downgrade() -> None:
+    op.drop_table('event_exposure')
@@ -0,0 +1,37 @@
+"""settlement
+
+Revision ID: 3c5e8f0a91d2
+Revises: 821890e7172f
+Create Date: 2026-10-18 12:05:41.218730
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '3c5e8f0a91d2'
+down_revision = '821890e7172f'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('bet', sa.Column('payout', sa.Numeric(precision=12, scale=2), nullable=True))
+    op.create_index('ix_bet_event_id_state', 'bet', ['event_id', 'state'], unique=False)
+    op.create_table('settlement',
+    sa.Column('event_id', sa.UUID(), nullable=False),
+    sa.Column('bet_state', postgresql.ENUM('WAIT', 'WIN', 'LOSE', name='betstate', create_type=False), nullable=True),
+    sa.Column('settled', sa.Integer(), nullable=True),
+    sa.Column('started_at', sa.Integer(), nullable=True),
+    sa.Column('finished_at', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['event_id'], ['event.id'], ),
+    sa.PrimaryKeyConstraint('event_id')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('settlement')
+    op.drop_index('ix_bet_event_id_state', table_name='bet')
+    op.drop_column('bet', 'payout')
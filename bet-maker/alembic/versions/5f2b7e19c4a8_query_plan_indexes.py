@@ -0,0 +1,32 @@
+"""query plan indexes
+
+Revision ID: 5f2b7e19c4a8
+Revises: a7d41c9e2b60
+Create Date: 2026-10-18 13:20:37.114052
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5f2b7e19c4a8'
+down_revision = 'a7d41c9e2b60'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # the primary key already indexes event.id
+    op.drop_index('ix_event_id', table_name='event')
+    op.create_index('ix_event_open_deadline', 'event', ['deadline'], unique=False, postgresql_where=sa.text("state = 'NEW'"))
+    # settlement only needs unsettled bets, the partial index shrinks as they are settled
+    op.drop_index('ix_bet_event_id_state', table_name='bet')
+    op.create_index('ix_bet_event_id_wait', 'bet', ['event_id'], unique=False, postgresql_where=sa.text("state = 'WAIT'"))
+
+
+def downgrade() -> None:
+    op.drop_index('ix_bet_event_id_wait', table_name='bet', postgresql_where=sa.text("state = 'WAIT'"))
+    op.create_index('ix_bet_event_id_state', 'bet', ['event_id', 'state'], unique=False)
+    op.drop_index('ix_event_open_deadline', table_name='event', postgresql_where=sa.text("state = 'NEW'"))
+    op.create_index('ix_event_id', 'event', ['id'], unique=False)
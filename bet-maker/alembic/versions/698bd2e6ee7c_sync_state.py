@@ -0,0 +1,29 @@
+"""sync state
+
+Revision ID: 698bd2e6ee7c
+Revises: 5f2b7e19c4a8
+Create Date: 2026-10-18 15:02:11.503614
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '698bd2e6ee7c'
+down_revision = '5f2b7e19c4a8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('sync_state',
+    sa.Column('source', sa.String(), nullable=False),
+    sa.Column('last_seq', sa.BigInteger(), nullable=True),
+    sa.Column('synced_at', sa.Integer(), nullable=True),
+    sa.PrimaryKeyConstraint('source')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('sync_state')
@@ -0,0 +1,25 @@
+"""event version
+
+Revision ID: 8d870835e8f1
+Revises: 698bd2e6ee7c
+Create Date: 2026-10-18 16:11:48.276090
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d870835e8f1'
+down_revision = '698bd2e6ee7c'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # existing rows get version 0, any versioned change is newer
+    op.add_column('event', sa.Column('version', sa.BigInteger(), server_default='0', nullable=False))
+
+
+def downgrade() -> None:
+    op.drop_column('event', 'version')
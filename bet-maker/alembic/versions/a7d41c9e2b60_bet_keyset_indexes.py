@@ -0,0 +1,26 @@
+"""bet keyset indexes
+
+Revision ID: a7d41c9e2b60
+Revises: 3c5e8f0a91d2
+Create Date: 2026-10-18 12:48:10.502917
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7d41c9e2b60'
+down_revision = '3c5e8f0a91d2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_bet_created_at_id', 'bet', ['created_at', 'id'], unique=False)
+    op.create_index('ix_bet_event_id_created_at_id', 'bet', ['event_id', 'created_at', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_bet_event_id_created_at_id', table_name='bet')
+    op.drop_index('ix_bet_created_at_id', table_name='bet')
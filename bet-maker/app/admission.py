@@ -0,0 +1,208 @@
+"""
+Admission control of the bet endpoints. On a spike, requests over the
+in-flight limit of the process wait in a short queue and the rest are
+rejected at once with 503 and Retry-After, instead of all of them queueing
+on the connection pool and timing out after doing useless work. Optional
+token buckets limit the rate of every client.
+"""
+
+import asyncio
+import collections
+import contextlib
+import time
+
+from fastapi import Request
+
+from app import metrics, services
+from app.services import utils
+from app.config import (
+    ADMISSION_MAX_INFLIGHT,
+    ADMISSION_MAX_QUEUE,
+    ADMISSION_QUEUE_TIMEOUT_MS,
+    ADMISSION_RETRY_AFTER_S,
+    BETS_GROUP_COMMIT_MAX_PENDING,
+    CLIENT_RATE_LIMIT,
+    CLIENT_RATE_BURST,
+)
+
+
+class AdmissionLimit:
+    """
+    At most max_inflight requests at a time, up to max_queue more wait for
+    a slot in arrival order, each for at most timeout seconds
+    """
+
+    def __init__(
+        self, max_inflight: int, max_queue: int, timeout: float, retry_after: float
+    ):
+        self.max_inflight = max_inflight
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self.inflight = 0
+        self._waiters: collections.deque[asyncio.Future] = collections.deque()
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self) -> None:
+        "Take a slot, raises utils.Overloaded when there is none in time"
+        if self.inflight < self.max_inflight and not self._waiters:
+            self.inflight += 1
+            return
+        if len(self._waiters) >= self.max_queue:
+            raise utils.Overloaded("Too many requests in progress", self.retry_after)
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            # a released slot is handed over to the waiter, see release
+            await asyncio.wait_for(waiter, self.timeout)
+        except asyncio.TimeoutError:
+            self._discard(waiter)
+            raise utils.Overloaded("Too many requests in progress", self.retry_after)
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # the slot was handed over just before the client went away
+                self.release()
+            else:
+                self._discard(waiter)
+            raise
+
+    def release(self) -> None:
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            # timed out waiters may still be in the queue
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.inflight -= 1
+
+    def _discard(self, waiter: asyncio.Future) -> None:
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+
+
+class ClientRateLimit:
+    """
+    Token bucket per client: rate requests per second with bursts of up to
+    burst. Only the max_clients seen last are kept, a client that was away
+    long enough has a full bucket anyway
+    """
+
+    def __init__(self, rate: float, burst: int, max_clients: int = 100_000):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        # client -> (tokens, time of the update), least recently seen first
+        self._buckets: collections.OrderedDict[str, tuple[float, float]] = (
+            collections.OrderedDict()
+        )
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def take(self, client: str, now: float) -> float:
+        "Take a token, returns 0 or seconds until the client has one"
+        tokens, updated = self._buckets.pop(client, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / self.rate
+        self._buckets[client] = (tokens, now)
+        if len(self._buckets) > self.max_clients:
+            self._buckets.popitem(last=False)
+        return wait
+
+
+limit = AdmissionLimit(
+    ADMISSION_MAX_INFLIGHT,
+    ADMISSION_MAX_QUEUE,
+    ADMISSION_QUEUE_TIMEOUT_MS / 1000,
+    ADMISSION_RETRY_AFTER_S,
+)
+rate_limit = (
+    ClientRateLimit(CLIENT_RATE_LIMIT, CLIENT_RATE_BURST) if CLIENT_RATE_LIMIT else None
+)
+
+metrics.registry.gauge(
+    "bets_admission_inflight", "Bet requests in progress", lambda: limit.inflight
+)
+metrics.registry.gauge(
+    "bets_admission_queue_depth",
+    "Bet requests waiting for a slot",
+    lambda: limit.queued,
+)
+admission_rejected = metrics.registry.counter(
+    "bets_admission_rejected_total", "Bet requests rejected with 503 under overload"
+)
+rate_limited = metrics.registry.counter(
+    "bets_rate_limited_total", "Bet requests rejected with 429 by client rate limits"
+)
+admission_wait = metrics.registry.histogram(
+    "bets_admission_wait_seconds", "Wait for a slot of admitted bet requests"
+)
+
+
+def client_key(request: Request) -> str:
+    client_id = request.headers.get("X-Client-Id")
+    if client_id:
+        return client_id
+    return request.client.host if request.client is not None else ""
+
+
+def check_rate(request: Request) -> None:
+    if rate_limit is not None:
+        wait = rate_limit.take(client_key(request), time.monotonic())
+        if wait:
+            rate_limited.inc()
+            raise utils.RateLimited("Rate limit exceeded", wait)
+
+
+@contextlib.asynccontextmanager
+async def slot():
+    "Место среди обрабатываемых запросов на время блока"
+    started = time.perf_counter()
+    try:
+        await limit.acquire()
+    except utils.Overloaded:
+        admission_rejected.inc()
+        raise
+    admission_wait.observe(time.perf_counter() - started)
+    try:
+        yield
+    finally:
+        limit.release()
+
+
+async def admit(request: Request):
+    """
+    Зависимость маршрутов ставок: лимит клиента, затем место среди
+    обрабатываемых запросов до конца запроса
+    """
+    check_rate(request)
+    async with slot():
+        yield
+
+
+async def admit_bet(request: Request):
+    """
+    Зависимость POST /bet. С групповой записью ставка ждет своей группы без
+    соединения с БД, поэтому вместо места среди обрабатываемых запросов
+    ограничена очередь записи (BETS_GROUP_COMMIT_MAX_PENDING), иначе в
+    группе было бы не больше ADMISSION_MAX_INFLIGHT ставок
+    """
+    check_rate(request)
+    writer = services.bets.writer
+    if writer is None:
+        async with slot():
+            yield
+        return
+    if writer.pending >= BETS_GROUP_COMMIT_MAX_PENDING:
+        admission_rejected.inc()
+        raise utils.Overloaded("Too many bets waiting to be written", limit.retry_after)
+    yield
@@ -1,7 +1,8 @@
+import re
 import uuid
 
-from sqlalchemy import Column, ForeignKey
-from sqlalchemy import Integer, Enum, Numeric
+from sqlalchemy import DDL, Column, ForeignKey, Index, event, text
+from sqlalchemy import Integer, BigInteger, Enum, Numeric, String
 from sqlalchemy.dialects import postgresql
 
 from app import schemas
@@ -12,10 +13,21 @@ class Event(Base):
     "Событие"
     __tablename__ = "event"
 
-    id = Column(postgresql.UUID(as_uuid=True), primary_key=True, index=True)
+    id = Column(postgresql.UUID(as_uuid=True), primary_key=True)
     coefficient = Column(Numeric(4, 2))
     deadline = Column(Integer)
     state = Column(Enum(schemas.EventState))
+    # line-provider seq of the last applied change
+    version = Column(BigInteger, nullable=False, default=0, server_default="0")
+
+    __table_args__ = (
+        # active events: open ones by deadline
+        Index(
+            "ix_event_open_deadline",
+            "deadline",
+            postgresql_where=text("state = 'NEW'"),
+        ),
+    )
 
 
 class Bet(Base):
@@ -26,5 +38,66 @@ class Bet(Base):
     event_id = Column(ForeignKey("event.id"))
     amount = Column(Numeric(10, 2))
     coefficient = Column(Numeric(4, 2))
-    created_at = Column(Integer)
+    # the partition key is a part of the primary key
+    created_at = Column(Integer, primary_key=True)
     state = Column(Enum(schemas.BetState))
+    payout = Column(Numeric(12, 2), nullable=True)
+
+    __table_args__ = (
+        # settlement takes unsettled bets of the event
+        Index(
+            "ix_bet_event_id_wait",
+            "event_id",
+            postgresql_where=text("state = 'WAIT'"),
+        ),
+        # keyset pagination of GET /bets, with and without event filter
+        Index("ix_bet_created_at_id", "created_at", "id"),
+        Index("ix_bet_event_id_created_at_id", "event_id", "created_at", "id"),
+        # monthly partitions, see services.partitions
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
+
+
+# partitions of bet: bet_pYYYYMM by month, bet_legacy is the table from
+# before partitioning, bet_default takes rows outside of them
+BET_PARTITION = re.compile(r"bet_(p\d{6}|legacy|default)")
+
+event.listen(
+    Bet.__table__,
+    "after_create",
+    DDL("CREATE TABLE bet_default PARTITION OF bet DEFAULT"),
+)
+
+
+class Settlement(Base):
+    "Расчет ставок по закрытому событию"
+    __tablename__ = "settlement"
+
+    event_id = Column(ForeignKey("event.id"), primary_key=True)
+    bet_state = Column(Enum(schemas.BetState))
+    settled = Column(Integer, default=0)
+    started_at = Column(Integer)
+    finished_at = Column(Integer, nullable=True)
+
+
+class EventExposure(Base):
+    "Обязательства по событию, обновляются вместе со ставками и их расчетом"
+    __tablename__ = "event_exposure"
+
+    event_id = Column(ForeignKey("event.id"), primary_key=True)
+    staked = Column(Numeric(16, 2), nullable=False, default=0)
+    bet_count = Column(Integer, nullable=False, default=0)
+    # owed if the event wins: sum of rounded amount * coefficient
+    potential_payout = Column(Numeric(18, 2), nullable=False, default=0)
+    settled_count = Column(Integer, nullable=False, default=0)
+    paid_out = Column(Numeric(18, 2), nullable=False, default=0)
+
+
+class SyncState(Base):
+    "Позиция синхронизации событий с источником"
+    __tablename__ = "sync_state"
+
+    source = Column(String, primary_key=True)
+    # seq of the last change loaded from the source
+    last_seq = Column(BigInteger, default=0)
+    synced_at = Column(Integer)
@@ -1,12 +1,144 @@
-from sqlalchemy.ext.asyncio import AsyncSession
+import asyncio
+
+import sqlalchemy as sa
+from loguru import logger
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
 from sqlalchemy.ext.asyncio import create_async_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.orm import Session, sessionmaker, declarative_base
 
-from app.config import DATABASE_URL
+from app import metrics
+from app.config import (
+    DATABASE_URL,
+    DATABASE_REPLICA_URL,
+    DB_POOL_SIZE,
+    DB_MAX_OVERFLOW,
+    DB_POOL_TIMEOUT_S,
+    DB_POOL_RECYCLE_S,
+    DB_COMMAND_TIMEOUT_S,
+    DB_STATEMENT_CACHE_SIZE,
+    DB_REPLICA_MAX_LAG_S,
+    DB_REPLICA_CHECK_S,
+)
 
 Base = declarative_base()
-engine = create_async_engine(DATABASE_URL, echo=False)
-async_session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=True)
+
+# seconds the replica is behind: 0 when it replayed all it received from a
+# streaming primary or is not a standby at all, NULL when unknown
+REPLICA_LAG = sa.text("""
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn()
+            AND EXISTS (SELECT FROM pg_stat_wal_receiver WHERE status = 'streaming')
+            THEN 0
+        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+    END
+    """)
+
+
+def create_engine(url: str) -> AsyncEngine:
+    "Движок с настройками пула и соединений из конфига"
+    connect_args = {
+        # the statement cache of SQLAlchemy and the one of asyncpg
+        "prepared_statement_cache_size": DB_STATEMENT_CACHE_SIZE,
+        "statement_cache_size": DB_STATEMENT_CACHE_SIZE,
+    }
+    if DB_COMMAND_TIMEOUT_S:
+        connect_args["command_timeout"] = DB_COMMAND_TIMEOUT_S
+    return create_async_engine(
+        url,
+        echo=False,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT_S,
+        pool_recycle=DB_POOL_RECYCLE_S,
+        connect_args=connect_args,
+    )
+
+
+class Replica:
+    """
+    Реплика для чтения. Отставание проверяется в фоне, пока оно неизвестно
+    или больше max_lag, чтения идут в основную БД
+    """
+
+    def __init__(self, engine: AsyncEngine, max_lag: float):
+        self.engine = engine
+        self.max_lag = max_lag
+        self.lag: float | None = None
+
+    @property
+    def usable(self) -> bool:
+        return self.lag is not None and self.lag <= self.max_lag
+
+    async def check(self) -> float | None:
+        try:
+            async with self.engine.connect() as conn:
+                lag = await conn.scalar(REPLICA_LAG)
+        except Exception as e:
+            logger.warning("replica is unreachable: {}", e)
+            lag = None
+        self.lag = float(lag) if lag is not None else None
+        return self.lag
+
+    async def run_checks(self, interval: float = DB_REPLICA_CHECK_S) -> None:
+        while True:
+            await self.check()
+            await asyncio.sleep(interval)
+
+
+engine = create_engine(DATABASE_URL)
+replica = (
+    Replica(create_engine(DATABASE_REPLICA_URL), DB_REPLICA_MAX_LAG_S)
+    if DATABASE_REPLICA_URL
+    else None
+)
+
+
+class RoutingSession(Session):
+    """
+    Сессия на основной БД или на реплике, реплика выбирается при создании
+    сессии (get_read_session). Запись всегда идет в основную БД
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if self.info.get("replica") and not self._flushing:
+            return replica.engine.sync_engine
+        return engine.sync_engine
+
+
+async_session = sessionmaker(
+    class_=AsyncSession, sync_session_class=RoutingSession, expire_on_commit=True
+)
+
+metrics.registry.gauge(
+    "db_pool_size", "Connections kept in the pool", lambda: engine.pool.size()
+)
+metrics.registry.gauge(
+    "db_pool_checked_out",
+    "Connections in use by sessions",
+    lambda: engine.pool.checkedout(),
+)
+metrics.registry.gauge(
+    "db_pool_overflow",
+    "Connections opened over the pool size",
+    lambda: engine.pool.overflow(),
+)
+if replica is not None:
+    metrics.registry.gauge(
+        "db_replica_pool_checked_out",
+        "Replica connections in use by sessions",
+        lambda: replica.engine.pool.checkedout(),
+    )
+    metrics.registry.gauge(
+        "db_replica_lag_seconds",
+        "Replay lag of the replica, -1 when unknown",
+        lambda: replica.lag if replica.lag is not None else -1,
+    )
+    metrics.registry.gauge(
+        "db_replica_usable",
+        "1 when reads go to the replica, 0 when to the primary",
+        lambda: int(replica.usable),
+    )
 
 
 async def get_session() -> AsyncSession:
@@ -14,7 +146,8 @@ async def get_session() -> AsyncSession:
         yield session
 
 
-async def init_models():
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.drop_all)
-        await conn.run_sync(Base.metadata.create_all)
+async def get_read_session() -> AsyncSession:
+    "Сессия только для чтения: на реплике, если она есть и не отстает"
+    use_replica = replica is not None and replica.usable
+    async with async_session(info={"replica": use_replica}) as session:
+        yield session
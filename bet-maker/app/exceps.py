@@ -1,9 +1,14 @@
+import math
+
 from starlette.responses import JSONResponse
 
 from app.services.utils import (
     NotInDB,
     ContainsInDB,
     ConflictError,
+    BadRequest,
+    Overloaded,
+    RateLimited,
 )
 
 
@@ -14,7 +19,21 @@ def get_default_error_handler(status_code: int):
     return default_error_handler
 
 
+def get_retry_error_handler(status_code: int):
+    def retry_error_handler(request, exc):
+        return JSONResponse(
+            {"detail": str(exc)},
+            status_code=status_code,
+            headers={"Retry-After": str(math.ceil(exc.retry_after))},
+        )
+
+    return retry_error_handler
+
+
 def init(app):
     app.add_exception_handler(NotInDB, get_default_error_handler(status_code=404))
     app.add_exception_handler(ContainsInDB, get_default_error_handler(status_code=409))
     app.add_exception_handler(ConflictError, get_default_error_handler(status_code=409))
+    app.add_exception_handler(BadRequest, get_default_error_handler(status_code=400))
+    app.add_exception_handler(Overloaded, get_retry_error_handler(status_code=503))
+    app.add_exception_handler(RateLimited, get_retry_error_handler(status_code=429))
@@ -1,14 +1,20 @@
 import asyncio
+import uuid
 
 import uvicorn
 import aio_pika
-from fastapi import FastAPI, Depends
+from fastapi import FastAPI, Depends, Query, Response
 from starlette.middleware.cors import CORSMiddleware
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app import services, schemas
-from app.db.session import get_session, init_models
-from app.config import RABBITMQ_URL
+from app import services, schemas, exceps, metrics, admission
+from app.db.session import async_session, get_session, get_read_session, replica
+from app.config import (
+    RABBITMQ_URL,
+    BETS_PAGE_SIZE,
+    BETS_PAGE_MAX_SIZE,
+    BETS_GROUP_COMMIT,
+)
 
 app = FastAPI(title="bet-maker")
 
@@ -19,32 +25,115 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(metrics.MetricsMiddleware)
+exceps.init(app)
 
 
 @app.on_event("startup")
 async def on_startup():
-    await init_models()
+    # the schema is created and upgraded by `alembic upgrade head` before start
+    if replica is not None:
+        # reads stay on the primary until the first lag check
+        app.state.replica = asyncio.create_task(replica.run_checks())
+    # partitions of bets for this and the next months, the maintenance loop
+    # creates them first thing and retries on errors. Until then bets go to
+    # the default partition
+    app.state.partitions = asyncio.create_task(services.partitions.run_maintenance())
+    # catch up with events changed in line-provider while we were down
+    await services.sync.resync()
+    if BETS_GROUP_COMMIT:
+        services.bets.start_writer()
+    # continue settlements interrupted by a restart
+    await services.settlement.resume_settlements()
+    app.state.settlement_sweeps = asyncio.create_task(services.settlement.run_sweeps())
     # check queue connect before listening
     connection = await aio_pika.connect_robust(RABBITMQ_URL)
-    # run event listening
-    asyncio.create_task(services.events.listen_events())
+    # run event listening, keep a reference so the task isn't garbage collected
+    app.state.events_listener = asyncio.create_task(services.events.listen_events())
+
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await services.bets.stop_writer()
+
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    return Response(metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
 
 
 @app.get("/events", response_model=list[schemas.Event], tags=["events"])
 async def get_events(db: AsyncSession = Depends(get_session)):
-    return await services.events.get_active_events(db)
+    # the primary: the events loaded on a cache miss fill the cache of bets
+    events = await services.events.get_active_events(db)
+    # rendered directly, response_model is only for the schema
+    return Response(services.render.events_json(events), media_type="application/json")
 
 
-@app.post("/bet", response_model=schemas.Bet, tags=["bets"])
-async def create_bet(
-    bet_create: schemas.BetCreate, db: AsyncSession = Depends(get_session)
+@app.get(
+    "/events/{event_id}/settlement", response_model=schemas.Settlement, tags=["events"]
+)
+async def get_settlement(
+    event_id: uuid.UUID, db: AsyncSession = Depends(get_read_session)
+):
+    return await services.settlement.get_settlement(db, event_id)
+
+
+@app.get(
+    "/events/{event_id}/exposure", response_model=schemas.Exposure, tags=["events"]
+)
+async def get_exposure(
+    event_id: uuid.UUID, db: AsyncSession = Depends(get_read_session)
 ):
-    return await services.bets.create_bet(db, bet_create)
+    return await services.exposure.get_exposure(db, event_id)
+
+
+@app.post(
+    "/bet",
+    response_model=schemas.Bet,
+    tags=["bets"],
+    dependencies=[Depends(admission.admit_bet)],
+)
+async def create_bet(bet_create: schemas.BetCreate):
+    # the group commit writer has its own sessions, a session is taken from
+    # the pool only without it
+    if services.bets.writer is not None:
+        return await services.bets.writer.create_bet(bet_create)
+    async with async_session() as db:
+        return await services.bets.create_bet(db, bet_create)
+
+
+@app.post(
+    "/bets/batch",
+    response_model=list[schemas.BetBatchItem],
+    tags=["bets"],
+    dependencies=[Depends(admission.admit)],
+)
+async def create_bets(
+    batch_create: schemas.BetBatchCreate, db: AsyncSession = Depends(get_session)
+):
+    return await services.bets.create_bets(db, batch_create.bets)
 
 
 @app.get("/bets", response_model=list[schemas.Bet], tags=["bets"])
-async def get_bets(db: AsyncSession = Depends(get_session)):
-    return await services.bets.get_bets(db)
+async def get_bets(
+    limit: int = Query(BETS_PAGE_SIZE, ge=1, le=BETS_PAGE_MAX_SIZE),
+    cursor: str | None = None,
+    event_id: uuid.UUID | None = None,
+    state: schemas.BetState | None = None,
+    created_from: int | None = None,
+    created_to: int | None = None,
+    db: AsyncSession = Depends(get_read_session),
+):
+    # next page is requested with the cursor from X-Next-Cursor header
+    after = services.bets.decode_cursor(cursor) if cursor else None
+    bets = await services.bets.get_bets(
+        db, limit, after, event_id, state, created_from, created_to
+    )
+    response = Response(services.render.bets_json(bets), media_type="application/json")
+    if len(bets) == limit:
+        response.headers["X-Next-Cursor"] = services.bets.encode_cursor(bets[-1])
+    return response
 
 
 if __name__ == "__main__":
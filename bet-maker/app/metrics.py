@@ -0,0 +1,209 @@
+"""
+Minimal Prometheus-style metrics without extra dependencies.
+The service runs in a single event loop, so counters and histograms are
+plain attribute updates without locks; text is rendered only on scrape.
+"""
+
+import bisect
+import time
+from typing import Callable
+
+# keep in sync with line-provider/metrics.py
+
+# seconds, from sub-millisecond handlers up to stuck requests
+LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+
+def _labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    __slots__ = ("name", "help", "value")
+    kind = "counter"
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self.value = 0
+
+    def inc(self, amount: int = 1) -> None:
+        self.value += amount
+
+    def samples(self):
+        yield self.name, "", self.value
+
+
+class Gauge:
+    "Value is read from the callback on scrape"
+
+    __slots__ = ("name", "help", "callback")
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, callback: Callable[[], float]):
+        self.name = name
+        self.help = help
+        self.callback = callback
+
+    def samples(self):
+        yield self.name, "", self.callback()
+
+
+class Histogram:
+    __slots__ = ("name", "help", "buckets", "counts", "sum", "count")
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        # the last slot is +Inf, counts are not cumulative until rendered
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self, label_names: tuple = (), label_values: tuple = ()):
+        cumulative = 0
+        for bound, count in zip(self.buckets + ("+Inf",), self.counts):
+            cumulative += count
+            le = _labels(label_names, label_values, f'le="{bound}"')
+            yield self.name + "_bucket", le, cumulative
+        labels = _labels(label_names, label_values)
+        yield self.name + "_sum", labels, self.sum
+        yield self.name + "_count", labels, self.count
+
+
+class HistogramFamily:
+    "Histograms by label values, a child is created on the first observation"
+
+    __slots__ = ("name", "help", "label_names", "buckets", "children")
+    kind = "histogram"
+
+    def __init__(
+        self, name: str, help: str, label_names: tuple, buckets=LATENCY_BUCKETS
+    ):
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self.buckets = buckets
+        self.children: dict[tuple, Histogram] = {}
+
+    def labels(self, *values) -> Histogram:
+        child = self.children.get(values)
+        if child is None:
+            child = self.children[values] = Histogram(
+                self.name, self.help, self.buckets
+            )
+        return child
+
+    def samples(self):
+        for values, child in self.children.items():
+            yield from child.samples(self.label_names, values)
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str) -> Counter:
+        return self.register(Counter(name, help))
+
+    def gauge(self, name: str, help: str, callback: Callable[[], float]) -> Gauge:
+        return self.register(Gauge(name, help, callback))
+
+    def histogram(self, name: str, help: str, buckets=LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, buckets))
+
+    def histogram_family(
+        self, name: str, help: str, label_names: tuple, buckets=LATENCY_BUCKETS
+    ) -> HistogramFamily:
+        return self.register(HistogramFamily(name, help, label_names, buckets))
+
+    def render(self) -> str:
+        "Prometheus text exposition format 0.0.4"
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {value}")
+        return "\n".join(lines) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+registry = Registry()
+request_latency = registry.histogram_family(
+    "http_request_duration_seconds",
+    "HTTP request latency by route template",
+    ("method", "route", "status"),
+)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording request latency by route template.
+    Starlette leaves the matched endpoint in the scope, it is mapped back to
+    the route path so that /event/<uuid> doesn't create a series per id
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._routes: dict | None = None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            request_latency.labels(
+                scope["method"], self._route(scope), status
+            ).observe(time.perf_counter() - started)
+
+    def _route(self, scope) -> str:
+        if self._routes is None:
+            self._routes = {
+                route.endpoint: route.path
+                for route in scope["app"].routes
+                if hasattr(route, "endpoint")
+            }
+        return self._routes.get(scope.get("endpoint"), "unmatched")
@@ -33,7 +33,46 @@ class Bet(BetBase):
     state: BetState
     coefficient: decimal.Decimal
     created_at: int
+    payout: decimal.Decimal | None
 
     class Config:
         orm_mode = True
         allow_population_by_field_name = True
+
+
+class BetBatchCreate(BaseModel):
+    bets: list[BetCreate] = Field(min_items=1, max_items=10_000)
+
+
+class BetBatchStatus(enum.Enum):
+    ACCEPTED = "accepted"
+    REJECTED = "rejected"
+
+
+class BetBatchItem(BaseModel):
+    status: BetBatchStatus
+    bet: Bet | None = None
+    reason: str | None = None
+
+
+class Settlement(BaseModel):
+    event_id: uuid.UUID
+    bet_state: BetState
+    settled: int
+    started_at: int
+    finished_at: int | None
+
+    class Config:
+        orm_mode = True
+
+
+class Exposure(BaseModel):
+    event_id: uuid.UUID
+    staked: decimal.Decimal
+    bet_count: int
+    potential_payout: decimal.Decimal
+    settled_count: int
+    paid_out: decimal.Decimal
+
+    class Config:
+        orm_mode = True
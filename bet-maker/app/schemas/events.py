@@ -16,6 +16,9 @@ class Event(BaseModel):
     coefficient: decimal.Decimal
     deadline: int
     state: EventState
+    # seq of the change in line-provider, older versions are not applied.
+    # 0 - message without version, it is always applied
+    version: int = 0
 
     class Config:
         orm_mode = True
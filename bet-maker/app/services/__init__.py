@@ -1 +1 @@
-from app.services import events, bets
+from app.services import events, bets, settlement, sync, render, exposure, partitions
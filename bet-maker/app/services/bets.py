@@ -1,56 +1,394 @@
 import uuid
+import base64
+import asyncio
+import time
 
 import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+from loguru import logger
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app import schemas, services
+from app import schemas, services, metrics
 from app.services import utils
-from app.db import models
+from app.db import models, session
+from app.config import BETS_GROUP_COMMIT_SIZE, BETS_GROUP_COMMIT_LINGER_MS
 
+# group commit writer of POST /bet, None when every request commits itself
+writer: "BetWriter | None" = None
 
-async def create_bet(db: AsyncSession, bet_create: schemas.BetCreate) -> models.Bet:
-    "Создать ставку"
-    # берем событие по которому делается ставка
-    event = await services.events.get_event_by_id(db, bet_create.event_id, must_be=True)
+group_commit_latency = metrics.registry.histogram(
+    "bets_group_commit_duration_seconds", "Write latency of a group of bets"
+)
+metrics.registry.gauge(
+    "bets_group_commit_queue_depth",
+    "Bets waiting for the group commit writer",
+    lambda: writer.pending if writer else 0,
+)
+
+
+def check_event_open(event: schemas.Event, now: int) -> None:
+    "Проверить, что на событие еще можно сделать ставку"
     # проверяем что дедлайн события еще не истек
-    if event.deadline <= utils.current_timestamp():
-        # TODO ConflictError
-        raise ValueError()
+    if event.deadline <= now:
+        raise utils.ConflictError("Event deadline has passed")
     # проверяем что результат события еще неизвестен, на всякий случай
     if event.state != schemas.EventState.NEW:
-        raise ValueError()
+        raise utils.ConflictError("Event already closed")
 
-    # сохраняем коэффициент: в случае если он измениться,
-    # нам надо знать какой он был на момент ставки
-    bet = models.Bet(
-        **bet_create.dict(),
-        coefficient=event.coefficient,
-        state=schemas.BetState.WAIT,
-        created_at=utils.current_timestamp()
-    )
-    db.add(bet)
+
+async def create_bet(db: AsyncSession, bet_create: schemas.BetCreate) -> schemas.Bet:
+    "Создать ставку"
+    [result] = await place_bets(db, [bet_create])
+    if isinstance(result, Exception):
+        raise result
     await db.commit()
-    await db.refresh(bet)
+    return result
 
-    return bet
 
+async def create_bets(
+    db: AsyncSession, bet_creates: list[schemas.BetCreate]
+) -> list[schemas.BetBatchItem]:
+    """
+    Создать пачку ставок одной транзакцией.
+    Возвращает результат по каждой ставке в порядке запроса
+    """
+    results = []
+    for result in await place_bets(db, bet_creates):
+        if isinstance(result, Exception):
+            results.append(
+                schemas.BetBatchItem(
+                    status=schemas.BetBatchStatus.REJECTED, reason=str(result)
+                )
+            )
+        else:
+            results.append(
+                schemas.BetBatchItem(status=schemas.BetBatchStatus.ACCEPTED, bet=result)
+            )
+    await db.commit()
+    return results
 
-async def get_bets(db: AsyncSession) -> list[models.Bet]:
-    "Получить список всех ставок"
-    stmt = sa.select(models.Bet)
-    result = await db.execute(stmt)
-    bets = result.scalars().all()
-    return bets
+
+async def place_bets(
+    db: AsyncSession, bet_creates: list[schemas.BetCreate]
+) -> list[schemas.Bet | utils.NotInDB | utils.ConflictError]:
+    """
+    Вставить ставки без коммита, результат по каждой в порядке запроса:
+    ставка или ошибка. Кэш событий процесса только отсеивает заведомо
+    неверные ставки, решает основная БД, см. insert_bets
+    """
+    events = await services.events.get_cached_events(
+        db, {bet_create.event_id for bet_create in bet_creates}
+    )
+    now = utils.current_timestamp()
+    results: list = [None] * len(bet_creates)
+    # (position in the request, id of the new bet, bet)
+    pending = []
+    for i, bet_create in enumerate(bet_creates):
+        event = events.get(bet_create.event_id)
+        try:
+            if event is None:
+                raise utils.NotInDB("Event", id=bet_create.event_id)
+            check_event_open(event, now)
+        except (utils.NotInDB, utils.ConflictError) as e:
+            results[i] = e
+            continue
+        pending.append((i, uuid.uuid4(), bet_create))
+    if not pending:
+        return results
+
+    inserted = await insert_bets(
+        db, [(bet_id, bet_create) for _, bet_id, bet_create in pending], now
+    )
+    # the last statement before commit, the exposure row lock is held shortly
+    await services.exposure.add_bets(
+        db, [(bet.event_id, bet.amount, bet.coefficient) for bet in inserted.values()]
+    )
+    stale = {bet_create.event_id for _, bet_id, bet_create in pending}
+    stale -= {bet.event_id for bet in inserted.values()}
+    if stale:
+        # the cache of this process is behind another consumer or a replica
+        stale = await services.events.refresh_events(db, stale)
+    for i, bet_id, bet_create in pending:
+        bet = inserted.get(bet_id)
+        if bet is not None:
+            results[i] = schemas.Bet(**bet._mapping)
+            continue
+        event = stale.get(bet_create.event_id)
+        try:
+            if event is None:
+                raise utils.NotInDB("Event", id=bet_create.event_id)
+            check_event_open(event, now)
+            # open now, but not when the insert read it: its deadline was
+            # moved by an update that committed in between
+            raise utils.ConflictError("Event changed while placing the bet, retry")
+        except (utils.NotInDB, utils.ConflictError) as e:
+            results[i] = e
+    return results
 
 
-async def update_bet_state_by_event(
-    db: AsyncSession, event_id: uuid.UUID, bet_state: schemas.BetState
-) -> None:
-    "Обновить статус ставки по событию, возвращает кол-во обновленных записей"
+async def insert_bets(
+    db: AsyncSession, bets: list[tuple[uuid.UUID, schemas.BetCreate]], now: int
+) -> dict[uuid.UUID, sa.Row]:
+    """
+    Вставить ставки (id, ставка) на открытые события одним запросом,
+    возвращает вставленные по id. Состояние, дедлайн и коэффициент события
+    берутся из основной БД под блокировкой FOR SHARE: событие, закрытое
+    обработчиком любого процесса, ставок больше не примет, а закрытие ждет
+    конца транзакции ставок
+    """
+    rows = (
+        sa.func.unnest(
+            services.events.array_param(
+                [bet_id for bet_id, _ in bets], postgresql.UUID(as_uuid=True)
+            ),
+            services.events.array_param(
+                [bet.event_id for _, bet in bets], postgresql.UUID(as_uuid=True)
+            ),
+            services.events.array_param(
+                [bet.amount for _, bet in bets], models.Bet.amount.type
+            ),
+        )
+        .table_valued("id", "event_id", "amount")
+        .render_derived()
+    )
+    event = models.Event
+    select = (
+        sa.select(
+            rows.c.id,
+            rows.c.event_id,
+            rows.c.amount,
+            # the coefficient at the time of the bet
+            event.coefficient,
+            sa.literal(now, sa.Integer),
+            sa.cast(sa.literal(schemas.BetState.WAIT.name), models.Bet.state.type),
+        )
+        .join(event, event.id == rows.c.event_id)
+        .where(event.state == schemas.EventState.NEW, event.deadline > now)
+        # the same lock order in every transaction
+        .order_by(event.id)
+        .with_for_update(read=True, of=event)
+    )
     stmt = (
-        sa.update(models.Bet)
-        .where(models.Bet.event_id == event_id)
-        .values({models.Bet.state: bet_state})
+        sa.insert(models.Bet)
+        .from_select(
+            ["id", "event_id", "amount", "coefficient", "created_at", "state"], select
+        )
+        .returning(*BET_COLUMNS)
     )
+    return {bet.id: bet for bet in await db.execute(stmt)}
+
+
+class BetWriter:
+    """
+    Групповая запись ставок: параллельные запросы ставятся в очередь, одна
+    задача пишет до batch_size ставок или linger секунд ожидания одной
+    транзакцией. Каждый запрос получает свою ставку или свою ошибку
+    """
+
+    def __init__(self, batch_size: int, linger: float):
+        self.batch_size = batch_size
+        self.linger = linger
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self._task: asyncio.Task | None = None
+
+    @property
+    def pending(self) -> int:
+        return self.queue.qsize()
+
+    async def create_bet(self, bet_create: schemas.BetCreate) -> schemas.Bet:
+        "Создать ставку в ближайшей группе"
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((bet_create, future))
+        return await future
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._work())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        while not self.queue.empty():
+            _, future = self.queue.get_nowait()
+            if not future.done():
+                future.set_exception(utils.Overloaded("Shutting down", 1))
+
+    async def _work(self) -> None:
+        while True:
+            batch = []
+            try:
+                batch = await services.events.collect_batch(
+                    self.queue, self.batch_size, self.linger
+                )
+                await self._write_batch(batch)
+            except asyncio.CancelledError:
+                for _, future in batch:
+                    fail(future, utils.Overloaded("Shutting down", 1))
+                raise
+            except Exception as e:
+                # the writer must outlive any error, its callers get it
+                logger.exception(e)
+                for _, future in batch:
+                    fail(future, e)
+
+    async def _write_batch(
+        self, batch: list[tuple[schemas.BetCreate, asyncio.Future]]
+    ) -> None:
+        # callers that went away don't get a bet
+        batch = [(bet, future) for bet, future in batch if not future.done()]
+        if not batch:
+            return
+        started = time.perf_counter()
+        try:
+            await self._write(batch)
+        except sa.exc.IntegrityError as e:
+            logger.exception(e)
+            # one bad bet must not fail the others, they are retried one
+            # by one
+            for item in batch:
+                if item[1].done():
+                    continue
+                try:
+                    await self._write([item])
+                except Exception as e:
+                    fail(item[1], e)
+        except Exception as e:
+            for _, future in batch:
+                fail(future, e)
+        group_commit_latency.observe(time.perf_counter() - started)
+
+    async def _write(self, batch: list[tuple[schemas.BetCreate, asyncio.Future]]):
+        async with session.async_session() as db:
+            results = await place_bets(db, [bet_create for bet_create, _ in batch])
+            await db.commit()
+        for (_, future), result in zip(batch, results):
+            if isinstance(result, Exception):
+                fail(future, result)
+            elif not future.done():
+                future.set_result(result)
+
+
+def fail(future: asyncio.Future, error: Exception) -> None:
+    if not future.done():
+        future.set_exception(error)
+
+
+def start_writer() -> None:
+    "Запустить групповую запись ставок для POST /bet"
+    global writer
+    writer = BetWriter(BETS_GROUP_COMMIT_SIZE, BETS_GROUP_COMMIT_LINGER_MS / 1000)
+    writer.start()
+
+
+async def stop_writer() -> None:
+    global writer
+    if writer is not None:
+        await writer.stop()
+        writer = None
+
+
+# columns of GET /bets in the order of the response fields, see render.bets_json
+BET_COLUMNS = (
+    models.Bet.event_id,
+    models.Bet.amount,
+    models.Bet.id,
+    models.Bet.state,
+    models.Bet.coefficient,
+    models.Bet.created_at,
+    models.Bet.payout,
+)
+
+
+def encode_cursor(bet: models.Bet | sa.Row) -> str:
+    "Курсор страницы: позиция последней ставки в порядке (created_at, id)"
+    return base64.urlsafe_b64encode(f"{bet.created_at}:{bet.id}".encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[int, uuid.UUID]:
+    try:
+        created_at, bet_id = base64.urlsafe_b64decode(cursor).decode().split(":")
+        return int(created_at), uuid.UUID(bet_id)
+    except ValueError:
+        raise utils.BadRequest("Invalid cursor")
+
+
+async def get_bets(
+    db: AsyncSession,
+    limit: int,
+    after: tuple[int, uuid.UUID] | None = None,
+    event_id: uuid.UUID | None = None,
+    state: schemas.BetState | None = None,
+    created_from: int | None = None,
+    created_to: int | None = None,
+) -> list[sa.Row]:
+    """
+    Получить страницу ставок в порядке (created_at, id) после позиции after.
+    created_from включительно, created_to не включительно.
+    Строки из колонок BET_COLUMNS, без ORM-объектов
+    """
+    stmt = sa.select(*BET_COLUMNS)
+    if after is not None:
+        stmt = stmt.where(
+            sa.tuple_(models.Bet.created_at, models.Bet.id) > after,
+            # the row comparison alone doesn't skip older partitions
+            models.Bet.created_at >= after[0],
+        )
+    if event_id is not None:
+        stmt = stmt.where(models.Bet.event_id == event_id)
+    if state is not None:
+        stmt = stmt.where(models.Bet.state == state)
+    if created_from is not None:
+        stmt = stmt.where(models.Bet.created_at >= created_from)
+    if created_to is not None:
+        stmt = stmt.where(models.Bet.created_at < created_to)
+    stmt = stmt.order_by(models.Bet.created_at, models.Bet.id).limit(limit)
     result = await db.execute(stmt)
-    await db.commit()
+    return result.all()
+
+
+def get_payout(bet_state: schemas.BetState):
+    "Выплата по ставке: сумма * коэффициент для выигрыша, 0 для проигрыша"
+    if bet_state == schemas.BetState.WIN:
+        return sa.func.round(models.Bet.amount * models.Bet.coefficient, 2)
+    return 0
+
+
+async def has_unsettled_bets(db: AsyncSession, event_id: uuid.UUID) -> bool:
+    "Есть ли у события нерассчитанные ставки, без блокировок"
+    stmt = sa.select(
+        sa.exists().where(
+            models.Bet.event_id == event_id,
+            models.Bet.state == schemas.BetState.WAIT,
+        )
+    )
+    return await db.scalar(stmt)
+
+
+async def settle_bets_chunk(
+    db: AsyncSession, event_id: uuid.UUID, bet_state: schemas.BetState, limit: int
+) -> int:
+    """
+    Рассчитать порцию нерассчитанных ставок события и учесть ее в
+    обязательствах события, возвращает кол-во рассчитанных записей
+    """
+    chunk = (
+        sa.select(models.Bet.id)
+        .where(
+            models.Bet.event_id == event_id,
+            models.Bet.state == schemas.BetState.WAIT,
+        )
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    settled = (
+        sa.update(models.Bet)
+        .where(models.Bet.id.in_(chunk))
+        .values({models.Bet.state: bet_state, models.Bet.payout: get_payout(bet_state)})
+        .returning(models.Bet.payout)
+        .cte("settled")
+    )
+    exposure = services.exposure.add_settled(event_id, settled).cte("exposure")
+    # one statement: the bets and the exposure change together
+    stmt = sa.select(sa.func.count()).select_from(settled).add_cte(exposure)
+    return (await db.execute(stmt)).scalar()
@@ -0,0 +1,125 @@
+import bisect
+import collections
+import time
+import uuid
+
+from app import metrics, schemas
+
+
+class EventCache:
+    """
+    Кэш событий в памяти процесса и готовый список активных событий.
+
+    Источник изменений - обработчик очереди событий (put), чтения из БД
+    только дополняют кэш (fill) и не перетирают более свежие данные.
+    Кэш может отставать от основной БД (несколько процессов делят очередь
+    событий), ставки проверяются по ней, см. services.bets.insert_bets, а
+    список активных событий перечитывается из нее раз в active_ttl секунд.
+    Вытесняются только закрытые события, открытые нужны для ставок.
+    """
+
+    def __init__(self, max_size: int, active_ttl: float = 1.0):
+        self.max_size = max_size
+        self.active_ttl = active_ttl
+        # kept by clear, they are exported as metrics
+        self.hits = metrics.Counter(
+            "events_cache_hits_total", "Event lookups served by the events cache"
+        )
+        self.misses = metrics.Counter(
+            "events_cache_misses_total", "Event lookups missed by the events cache"
+        )
+        self._reset()
+
+    def _reset(self) -> None:
+        self._events: dict[uuid.UUID, schemas.Event] = {}
+        # closed events in eviction order
+        self._closed: collections.OrderedDict[uuid.UUID, None] = (
+            collections.OrderedDict()
+        )
+        # monotonic time of the last load of open events from the DB, the
+        # active view is served from memory until it is active_ttl old
+        self._active_loaded_at: float | None = None
+        # open events sorted by deadline, None when it has to be rebuilt
+        self._active: list[schemas.Event] | None = None
+        self._active_deadlines: list[int] = []
+
+    def __len__(self) -> int:
+        return len(self._events)
+
+    def get(self, event_id: uuid.UUID) -> schemas.Event | None:
+        event = self._events.get(event_id)
+        if event is None:
+            self.misses.inc()
+        else:
+            self.hits.inc()
+        return event
+
+    def put(self, event: schemas.Event) -> None:
+        "Сохранить актуальное состояние события"
+        previous = self._events.get(event.id)
+        self._events[event.id] = event
+        if event.state != schemas.EventState.NEW:
+            self._closed[event.id] = None
+            self._closed.move_to_end(event.id)
+        if event.state == schemas.EventState.NEW or (
+            previous is not None and previous.state == schemas.EventState.NEW
+        ):
+            self._active = None
+        self._evict()
+
+    def fill(self, event: schemas.Event) -> None:
+        "Добавить прочитанное из БД событие, если в кэше его еще нет"
+        if event.id not in self._events:
+            self.put(event)
+
+    def refresh(self, event: schemas.Event) -> None:
+        "Заменить событие прочитанным из БД, если оно не старше закэшированного"
+        cached = self._events.get(event.id)
+        if cached is None or cached.version <= event.version:
+            self.put(event)
+
+    def load_active(self, events: list[schemas.Event]) -> None:
+        """
+        Заменить открытые события кэша всеми открытыми событиями из БД.
+        Открытые в кэше, но не в БД, закрыты или перенесены другим процессом,
+        они удаляются и при следующем чтении берутся из БД
+        """
+        loaded = {event.id for event in events}
+        stale = [
+            event_id
+            for event_id, event in self._events.items()
+            if event.state == schemas.EventState.NEW and event_id not in loaded
+        ]
+        for event_id in stale:
+            del self._events[event_id]
+        for event in events:
+            self.refresh(event)
+        self._active = None
+        self._active_loaded_at = time.monotonic()
+
+    @property
+    def active_expired(self) -> bool:
+        "Открытые события не загружены из БД или загружены active_ttl назад"
+        loaded_at = self._active_loaded_at
+        return loaded_at is None or time.monotonic() - loaded_at >= self.active_ttl
+
+    def active(self, now: int) -> list[schemas.Event]:
+        """
+        Открытые события с дедлайном не раньше now, отсортированные по дедлайну.
+        Полон после load_active, см. active_expired
+        """
+        if self._active is None:
+            self._active = sorted(
+                (e for e in self._events.values() if e.state == schemas.EventState.NEW),
+                key=lambda e: e.deadline,
+            )
+            self._active_deadlines = [e.deadline for e in self._active]
+        return self._active[bisect.bisect_left(self._active_deadlines, now) :]
+
+    def clear(self) -> None:
+        self._reset()
+
+    def _evict(self) -> None:
+        while len(self._events) > self.max_size and self._closed:
+            event_id, _ = self._closed.popitem(last=False)
+            del self._events[event_id]
@@ -1,118 +1,407 @@
-import json
+import uuid
+import asyncio
+import time
 
 import aio_pika
+import aio_pika.abc
 import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
 from sqlalchemy.ext.asyncio import AsyncSession
 from loguru import logger
 
-from app import schemas, services
+from app import schemas, services, metrics
 from app.db import models, session
-from app.services import utils
-from app.config import RABBITMQ_URL
+from app.services import utils, wire
+from app.services.cache import EventCache
+from app.config import (
+    RABBITMQ_URL,
+    EVENTS_BATCH_SIZE,
+    EVENTS_BATCH_LINGER_MS,
+    EVENTS_WORKERS,
+    EVENTS_RETRY_DELAY_MS,
+    EVENT_CACHE_SIZE,
+    EVENT_ACTIVE_TTL_MS,
+)
 
+cache = EventCache(EVENT_CACHE_SIZE, EVENT_ACTIVE_TTL_MS / 1000)
+metrics.registry.register(cache.hits)
+metrics.registry.register(cache.misses)
+# consumer of the running listen_events, for the prefetched messages gauge
+listener: "EventsConsumer | None" = None
+# age of the oldest message of the last applied batch
+last_lag = 0.0
 
-async def get_active_events(db: AsyncSession) -> list[models.Event]:
+events_consumed = metrics.registry.counter(
+    "events_consumed_total", "Event messages applied and acked"
+)
+events_failed = metrics.registry.counter(
+    "events_failed_total", "Event messages rejected"
+)
+events_requeued = metrics.registry.counter(
+    "events_requeued_total", "Event messages returned to the queue after a failure"
+)
+batch_latency = metrics.registry.histogram(
+    "events_batch_duration_seconds", "Apply latency of a batch of event messages"
+)
+# what the process holds, not the depth of the RabbitMQ queue: that is up
+# to the prefetch of the channel in memory plus the backlog on the broker
+metrics.registry.gauge(
+    "events_prefetched_pending",
+    "Messages delivered to this process and waiting in its worker shards",
+    lambda: listener.pending if listener else 0,
+)
+# sampled per batch, keeps the last value while no messages arrive
+metrics.registry.gauge(
+    "events_last_batch_age_seconds",
+    "Time from publish of the oldest message of the last applied batch to apply",
+    lambda: last_lag,
+)
+
+
+async def get_active_events(db: AsyncSession) -> list[schemas.Event]:
     """
     Получить активные события.
-    Активные это те, у которых не истек дедлайн
+    Активные это те, у которых не истек дедлайн и еще неизвестен исход.
+    Список отдается из кэша и перечитывается из БД раз в EVENT_ACTIVE_TTL_MS,
+    изменения из других процессов видны не позже
     """
-    stmt = sa.select(models.Event).where(
-        models.Event.deadline >= utils.current_timestamp()
+    now = utils.current_timestamp()
+    if not cache.active_expired:
+        return cache.active(now)
+
+    stmt = sa.select(
+        models.Event.id,
+        models.Event.coefficient,
+        models.Event.deadline,
+        models.Event.state,
+        models.Event.version,
+    ).where(
+        models.Event.deadline >= now,
+        models.Event.state == schemas.EventState.NEW,
     )
     result = await db.execute(stmt)
-    events = result.scalars().all()
+    # values from the DB are valid, skip ORM objects and validation
+    cache.load_active(
+        [
+            schemas.Event.construct(
+                id=event_id,
+                coefficient=coefficient,
+                deadline=deadline,
+                state=state,
+                version=version,
+            )
+            for event_id, coefficient, deadline, state, version in result
+        ]
+    )
+    return cache.active(now)
+
+
+async def get_cached_events(
+    db: AsyncSession, event_ids: set[uuid.UUID]
+) -> dict[uuid.UUID, schemas.Event]:
+    """
+    Получить события по списку id: из кэша, промахи одним запросом в БД
+    """
+    events = {}
+    missed = []
+    for event_id in event_ids:
+        event = cache.get(event_id)
+        if event is None:
+            missed.append(event_id)
+        else:
+            events[event_id] = event
+    if missed:
+        stmt = sa.select(models.Event).where(models.Event.id.in_(missed))
+        for event in (await db.execute(stmt)).scalars():
+            event = schemas.Event.from_orm(event)
+            cache.fill(event)
+            events[event.id] = event
     return events
 
 
-async def get_event_by_id(
-    db: AsyncSession, event_id: str, must_be: None | bool = None
-) -> None | models.Event:
+async def refresh_events(
+    db: AsyncSession, event_ids: set[uuid.UUID]
+) -> dict[uuid.UUID, schemas.Event]:
     """
-    Получить событие по id
+    Перечитать события из БД и обновить ими кэш, если они новее.
+    Для сессии основной БД, кэш отстает от нее
     """
-    stmt = sa.select(models.Event).where(models.Event.id == event_id)
-    result = await db.execute(stmt)
-    event = result.scalar()
+    stmt = sa.select(models.Event).where(models.Event.id.in_(event_ids))
+    events = {}
+    for event in (await db.execute(stmt)).scalars():
+        event = schemas.Event.from_orm(event)
+        cache.refresh(event)
+        events[event.id] = event
+    return events
+
 
-    if must_be == True and event is None:
-        raise utils.NotInDB("Event", id=event_id)
-    elif must_be == False and event is not None:
-        raise utils.ContainsInDB("Event", id=event_id)
+def get_bet_state(event_state: schemas.EventState) -> schemas.BetState:
+    "Статус ставок по статусу закрытого события"
+    if event_state == schemas.EventState.FINISHED_WIN:
+        return schemas.BetState.WIN
+    return schemas.BetState.LOSE
 
-    return event
+
+async def handle_event(event_info: schemas.Event):
+    """Обработчик получения события: один upsert без предварительного чтения"""
+    async with session.async_session() as db:
+        applied = await apply_events(db, [event_info])
+    for event in applied:
+        if event.state != schemas.EventState.NEW:
+            services.settlement.schedule(event.id)
+
+
+def coalesce_events(events: list[schemas.Event]) -> list[schemas.Event]:
+    """
+    Схлопнуть обновления одного события внутри пачки.
+    Остается последняя версия, но закрытие события никогда не пропускается
+    """
+    latest: dict[uuid.UUID, schemas.Event] = {}
+    for event in events:
+        current = latest.get(event.id)
+        if current is not None and (
+            # updates after closing would be rejected anyway
+            current.state != schemas.EventState.NEW
+            # redelivered older version
+            or event.version < current.version
+        ):
+            continue
+        latest[event.id] = event
+    return list(latest.values())
+
+
+def array_param(values: list, item_type) -> sa.BindParameter:
+    return sa.bindparam(None, values, type_=postgresql.ARRAY(item_type))
+
+
+async def upsert_events(
+    db: AsyncSession, events: list[schemas.Event]
+) -> list[schemas.Event]:
+    """
+    Сохранить пачку событий одним запросом без коммита, возвращает примененные.
+    Закрытые события и изменения старше сохраненной версии не применяются,
+    для только что закрытых событий создается расчет ставок
+    """
+    events = coalesce_events(events)
+    if not events:
+        return []
+    # rows are passed as one array per column: the statement doesn't grow
+    # with the batch, so it is compiled once and has no bind parameters limit
+    rows = sa.func.unnest(
+        array_param([e.id for e in events], postgresql.UUID(as_uuid=True)),
+        array_param([e.coefficient for e in events], models.Event.coefficient.type),
+        array_param([e.deadline for e in events], sa.Integer),
+        array_param([e.state.name for e in events], sa.String),
+        array_param([e.version for e in events], sa.BigInteger),
+    ).table_valued("id", "coefficient", "deadline", "state", "version")
+    rows = rows.render_derived()
+    stmt = postgresql.insert(models.Event).from_select(
+        ["id", "coefficient", "deadline", "state", "version"],
+        sa.select(
+            rows.c.id,
+            rows.c.coefficient,
+            rows.c.deadline,
+            sa.cast(rows.c.state, models.Event.state.type),
+            rows.c.version,
+        ),
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[models.Event.id],
+        set_={
+            "coefficient": stmt.excluded.coefficient,
+            "deadline": stmt.excluded.deadline,
+            "state": stmt.excluded.state,
+            "version": stmt.excluded.version,
+        },
+        where=sa.and_(
+            # we cannot update closed events, this will lead to unexpected behavior
+            models.Event.state == schemas.EventState.NEW,
+            # duplicates and reordered deliveries, unversioned messages always apply
+            sa.or_(
+                models.Event.version < stmt.excluded.version,
+                stmt.excluded.version == 0,
+            ),
+        ),
+    ).returning(
+        models.Event.id,
+        models.Event.state,
+        # xmax is 0 for rows inserted by the statement
+        sa.literal_column("xmax = 0").label("inserted"),
+    )
+    rows = (await db.execute(stmt)).all()
+    # an event inserted already closed can't have bets
+    await services.settlement.start_settlements(
+        db,
+        [
+            (row.id, get_bet_state(row.state))
+            for row in rows
+            if row.state != schemas.EventState.NEW and not row.inserted
+        ],
+    )
+    # applied rows hold the values of the batch
+    by_id = {event.id: event for event in events}
+    return [by_id[row.id] for row in rows]
 
 
-async def create_event_by_full_info(
-    db: AsyncSession, event_create: schemas.Event
-) -> models.Event:
-    event = models.Event(**event_create.dict())
-    db.add(event)
+async def apply_events(
+    db: AsyncSession, events: list[schemas.Event]
+) -> list[schemas.Event]:
+    """
+    Сохранить пачку событий одной транзакцией, возвращает примененные события.
+    Закрытые события не меняются, для только что закрытых создается расчет ставок
+    """
+    applied = await upsert_events(db, events)
     await db.commit()
+    for event in applied:
+        cache.put(event)
+    return applied
 
 
-async def update_event(
-    db: AsyncSession, event: models.Event, event_update: schemas.Event
-) -> models.Event:
-    # we cannot update closed events, this will lead to unexpected behavior
-    if event.state != schemas.EventState.NEW:
-        raise utils.ConflictError("Event already closed")
-    # update event status, close event
-    elif event_update.state != schemas.EventState.NEW:
-        if event_update.state == schemas.EventState.FINISHED_WIN:
-            bet_state = schemas.BetState.WIN
-        else:
-            bet_state = schemas.BetState.LOSE
-        # update event
-        stmt = (
-            sa.update(models.Event)
-            .where(models.Event.id == event.id)
-            .values(event_update.dict(exclude={"id"}))
-        )
-        result = await db.execute(stmt)
-        await db.flush()
-        # update bet state
-        await services.bets.update_bet_state_by_event(db, event.id, bet_state)
-    # update event fields (deadline, coiff)
-    else:
-        stmt = (
-            sa.update(models.Event)
-            .where(models.Event.id == event.id)
-            .values(event_update.dict(exclude={"id", "status"}))
-        )
-        result = await db.execute(stmt)
-        await db.commit()
+def is_transient(error: Exception) -> bool:
+    "Ошибка может пройти при повторе: недоступна БД, а не плохие данные события"
+    return not isinstance(error, (sa.exc.IntegrityError, sa.exc.DataError))
 
 
-async def handle_event(event_info: schemas.Event):
-    """Обработчик получения события"""
-    async with session.async_session() as db:
-        event = await get_event_by_id(db, event_info.id)
-        if event is None:
-            await create_event_by_full_info(db, event_info)
+def parse_event(data: bytes, content_type: str | None = None) -> schemas.Event:
+    "Разобрать сообщение о событии в формате, указанном в content_type"
+    return wire.decode(data, content_type)
+
+
+async def handle_messages(
+    batch: list[tuple[aio_pika.abc.AbstractIncomingMessage, schemas.Event]],
+):
+    """Обработчик пачки разобранных сообщений из очереди"""
+    global last_lag
+    # message -> requeue it
+    failed: dict[aio_pika.abc.AbstractIncomingMessage, bool] = {}
+    started = time.perf_counter()
+    try:
+        async with session.async_session() as db:
+            applied = await apply_events(db, [event for _, event in batch])
+        batch_latency.observe(time.perf_counter() - started)
+        logger.info("events batch: {} messages, {} applied", len(batch), len(applied))
+        for event in applied:
+            if event.state != schemas.EventState.NEW:
+                services.settlement.schedule(event.id)
+    except Exception as e:
+        logger.exception(e)
+        # apply one by one so that a single bad event doesn't lose the batch
+        for message, event in batch:
+            try:
+                await handle_event(event)
+            except Exception as e:
+                logger.exception(e)
+                failed[message] = is_transient(e)
+
+    if any(failed.values()):
+        # the DB is likely down, don't spin on redeliveries
+        await asyncio.sleep(EVENTS_RETRY_DELAY_MS / 1000)
+    # ack only after the event is applied
+    for message, _ in batch:
+        if message not in failed:
+            await message.ack()
+        elif failed[message]:
+            await message.nack(requeue=True)
+            events_requeued.inc()
         else:
-            await update_event(db, event, event_info)
+            await message.reject(requeue=False)
+            events_failed.inc()
+    events_consumed.inc(len(batch) - len(failed))
+    # messages come in publish order, the first one is the oldest
+    if batch[0][0].timestamp is not None:
+        last_lag = time.time() - batch[0][0].timestamp.timestamp()
+
+
+async def collect_batch(messages: asyncio.Queue, size: int, linger: float) -> list:
+    "Дождаться сообщения и добрать пачку до size сообщений или linger секунд"
+    batch = [await messages.get()]
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + linger
+    while len(batch) < size:
+        if not messages.empty():
+            batch.append(messages.get_nowait())
+            continue
+        timeout = deadline - loop.time()
+        if timeout <= 0:
+            break
+        try:
+            batch.append(await asyncio.wait_for(messages.get(), timeout))
+        except asyncio.TimeoutError:
+            break
+    return batch
+
+
+class EventsConsumer:
+    """
+    Пул обработчиков сообщений о событиях.
+    Сообщения распределяются по обработчикам по id события: обновления одного
+    события применяются по порядку, разные события обрабатываются параллельно
+    """
 
+    def __init__(self, workers: int, batch_size: int, linger: float):
+        self.batch_size = batch_size
+        self.linger = linger
+        self.shards = [asyncio.Queue() for _ in range(workers)]
+        self._tasks: list[asyncio.Task] = []
 
-def parse_event(data: bytes) -> schemas.Event:
-    return schemas.Event(**json.loads(data))
+    @property
+    def pending(self) -> int:
+        return sum(messages.qsize() for messages in self.shards)
+
+    async def on_message(self, message: aio_pika.abc.AbstractIncomingMessage):
+        "Колбэк очереди: разобрать сообщение и передать обработчику события"
+        try:
+            event = parse_event(message.body, message.content_type)
+        except Exception as e:
+            logger.exception(e)
+            await message.reject()
+            events_failed.inc()
+            return
+        self.shards[event.id.int % len(self.shards)].put_nowait((message, event))
+
+    def start(self) -> None:
+        self._tasks = [
+            asyncio.create_task(self._work(messages)) for messages in self.shards
+        ]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _work(self, messages: asyncio.Queue) -> None:
+        while True:
+            batch = await collect_batch(messages, self.batch_size, self.linger)
+            try:
+                await handle_messages(batch)
+            except Exception as e:
+                # e.g. ack on a channel closed by a reconnect: the worker must
+                # survive, unacked messages are redelivered by the broker
+                logger.exception(e)
 
 
 async def listen_events() -> None:
+    global listener
     connection = await aio_pika.connect_robust(RABBITMQ_URL)
 
     queue_name = "events"
 
     async with connection:
         channel = await connection.channel()
-        await channel.set_qos(prefetch_count=10)
+        await channel.set_qos(
+            prefetch_count=max(10, EVENTS_WORKERS * EVENTS_BATCH_SIZE)
+        )
         queue = await channel.declare_queue(queue_name)
 
-        async with queue.iterator() as queue_iter:
-            async for message in queue_iter:
-                async with message.process():
-                    logger.info(message.body)
-                    try:
-                        event = parse_event(message.body)
-                        await handle_event(event)
-                    except Exception as e:
-                        logger.exception(e)
+        consumer = EventsConsumer(
+            EVENTS_WORKERS, EVENTS_BATCH_SIZE, EVENTS_BATCH_LINGER_MS / 1000
+        )
+        consumer.start()
+        listener = consumer
+        try:
+            await queue.consume(consumer.on_message)
+            # consume until the app is stopped
+            await asyncio.Future()
+        finally:
+            listener = None
+            await consumer.stop()
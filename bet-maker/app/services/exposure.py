@@ -0,0 +1,157 @@
+import decimal
+import uuid
+from typing import Iterable
+
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import schemas, services
+from app.db import models
+from app.services import utils
+
+CENT = decimal.Decimal("0.01")
+
+
+def potential_payout(
+    amount: decimal.Decimal, coefficient: decimal.Decimal
+) -> decimal.Decimal:
+    # rounded the same way as the payout of a won bet, see bets.get_payout
+    return (amount * coefficient).quantize(CENT, rounding=decimal.ROUND_HALF_UP)
+
+
+async def add_bets(
+    db: AsyncSession,
+    bets: Iterable[tuple[uuid.UUID, decimal.Decimal, decimal.Decimal]],
+) -> None:
+    """
+    Учесть новые ставки (event_id, amount, coefficient) в обязательствах.
+    Вызывается в транзакции создания ставок, коммит за вызывающим
+    """
+    totals: dict[uuid.UUID, list] = {}
+    for event_id, amount, coefficient in bets:
+        total = totals.setdefault(event_id, [0, 0, 0])
+        total[0] += amount
+        total[1] += 1
+        total[2] += potential_payout(amount, coefficient)
+    if not totals:
+        return
+    stmt = postgresql.insert(models.EventExposure).values(
+        [
+            {
+                "event_id": event_id,
+                "staked": staked,
+                "bet_count": count,
+                "potential_payout": payout,
+                "settled_count": 0,
+                "paid_out": 0,
+            }
+            # the same lock order in every transaction, no deadlocks
+            for event_id, (staked, count, payout) in sorted(totals.items())
+        ]
+    )
+    exposure = models.EventExposure
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[exposure.event_id],
+        set_={
+            "staked": exposure.staked + stmt.excluded.staked,
+            "bet_count": exposure.bet_count + stmt.excluded.bet_count,
+            "potential_payout": exposure.potential_payout
+            + stmt.excluded.potential_payout,
+        },
+    )
+    await db.execute(stmt)
+
+
+def add_settled(event_id: uuid.UUID, settled: sa.CTE) -> sa.Update:
+    """
+    Учесть рассчитанные ставки из CTE settled (колонка payout),
+    выполняется одним запросом с их расчетом
+    """
+    exposure = models.EventExposure
+    count = sa.select(sa.func.count()).select_from(settled).scalar_subquery()
+    paid = (
+        sa.select(sa.func.coalesce(sa.func.sum(settled.c.payout), 0))
+        .select_from(settled)
+        .scalar_subquery()
+    )
+    return (
+        sa.update(exposure)
+        .where(exposure.event_id == event_id)
+        .values(
+            {
+                exposure.settled_count: exposure.settled_count + count,
+                exposure.paid_out: exposure.paid_out + paid,
+            }
+        )
+    )
+
+
+async def get_exposure(db: AsyncSession, event_id: uuid.UUID) -> schemas.Exposure:
+    "Обязательства по событию, одна строка независимо от кол-ва ставок"
+    exposure = await db.get(models.EventExposure, event_id)
+    if exposure is not None:
+        return schemas.Exposure.from_orm(exposure)
+    # no bets yet. The session may be on a replica, the cache is not filled
+    # from it
+    if (
+        services.events.cache.get(event_id) is None
+        and await db.get(models.Event, event_id) is None
+    ):
+        raise utils.NotInDB("Event", id=event_id)
+    return schemas.Exposure(
+        event_id=event_id,
+        staked=0,
+        bet_count=0,
+        potential_payout=0,
+        settled_count=0,
+        paid_out=0,
+    )
+
+
+def recompute_query() -> sa.Select:
+    "Обязательства, посчитанные заново по всем ставкам"
+    bet = models.Bet
+    return sa.select(
+        bet.event_id,
+        sa.func.sum(bet.amount).label("staked"),
+        sa.func.count().label("bet_count"),
+        sa.func.sum(sa.func.round(bet.amount * bet.coefficient, 2)).label(
+            "potential_payout"
+        ),
+        sa.func.count()
+        .filter(bet.state != schemas.BetState.WAIT)
+        .label("settled_count"),
+        sa.func.coalesce(sa.func.sum(bet.payout), 0).label("paid_out"),
+    ).group_by(bet.event_id)
+
+
+async def check_exposure(db: AsyncSession) -> list[uuid.UUID]:
+    """
+    Сверить обязательства с пересчетом по всем ставкам, полный проход по
+    таблице ставок. Возвращает события, у которых они расходятся.
+    Ставки архивированных партиций в пересчет не попадают, их события
+    тоже окажутся в списке
+    """
+    expected = {
+        row.event_id: tuple(row[1:]) for row in await db.execute(recompute_query())
+    }
+    exposure = models.EventExposure
+    stored = {
+        row.event_id: tuple(row[1:])
+        for row in await db.execute(
+            sa.select(
+                exposure.event_id,
+                exposure.staked,
+                exposure.bet_count,
+                exposure.potential_payout,
+                exposure.settled_count,
+                exposure.paid_out,
+            )
+        )
+    }
+    return [
+        event_id
+        for event_id in expected.keys() | stored.keys()
+        if expected.get(event_id) != stored.get(event_id)
+    ]
@@ -0,0 +1,241 @@
+import asyncio
+import datetime
+import gzip
+import os
+import re
+from typing import NamedTuple
+
+import sqlalchemy as sa
+from loguru import logger
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from app import services
+from app.db import models, session
+from app.services import utils
+from app.config import (
+    BET_PARTITIONS_AHEAD,
+    BET_ARCHIVE_DIR,
+    BET_ARCHIVE_AFTER_MONTHS,
+    BET_PARTITIONS_CHECK_S,
+)
+
+DEFAULT = "bet_default"
+# rows fetched from the server-side cursor at a time, the export memory
+EXPORT_BATCH = 10_000
+
+# DDL on bet waits this long for its locks, then fails instead of queueing
+# requests behind it, the next check tries again
+LOCK_TIMEOUT = "5s"
+
+BOUNDS = re.compile(r"FOR VALUES FROM \((MINVALUE|-?\d+)\) TO \((-?\d+)\)")
+
+
+class Partition(NamedTuple):
+    name: str
+    # created_at range [start, end), start is None for MINVALUE
+    start: int | None
+    end: int
+
+    def overlaps(self, start: int, end: int) -> bool:
+        return (self.start is None or self.start < end) and start < self.end
+
+
+def month_start(timestamp: int, months: int = 0) -> int:
+    "Начало месяца (UTC) timestamp, сдвинутое на months месяцев"
+    day = datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc)
+    month = day.year * 12 + day.month - 1 + months
+    start = datetime.datetime(
+        month // 12, month % 12 + 1, 1, tzinfo=datetime.timezone.utc
+    )
+    return int(start.timestamp())
+
+
+def partition_name(start: int) -> str:
+    day = datetime.datetime.fromtimestamp(start, datetime.timezone.utc)
+    return day.strftime("bet_p%Y%m")
+
+
+async def get_partitions(conn: AsyncConnection) -> list[Partition]:
+    "Партиции ставок по диапазонам created_at в порядке диапазонов, без DEFAULT"
+    result = await conn.execute(sa.text("""
+            SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+            FROM pg_inherits AS i JOIN pg_class AS c ON c.oid = i.inhrelid
+            WHERE i.inhparent = 'bet'::regclass
+            """))
+    partitions = []
+    for name, bound in result:
+        match = BOUNDS.fullmatch(bound)
+        # names are put into DDL, only the ones of services.partitions
+        if match is None or not models.BET_PARTITION.fullmatch(name):
+            continue
+        start, end = match.groups()
+        partitions.append(
+            Partition(name, None if start == "MINVALUE" else int(start), int(end))
+        )
+    return sorted(partitions, key=lambda p: p.end)
+
+
+async def create_partition(conn: AsyncConnection, start: int, end: int) -> str:
+    "Создать партицию ставок [start, end)"
+    name = partition_name(start)
+    create = sa.text(
+        f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF bet"
+        f" FOR VALUES FROM ({start}) TO ({end})"
+    )
+    # attaching locks the default partition, detaching it locks bet
+    await conn.execute(sa.text(f"SET LOCAL lock_timeout = '{LOCK_TIMEOUT}'"))
+    in_default = await conn.scalar(
+        sa.text(
+            f"SELECT EXISTS (SELECT FROM {DEFAULT}"
+            " WHERE created_at >= :start AND created_at < :end)"
+        ),
+        {"start": start, "end": end},
+    )
+    if not in_default:
+        await conn.execute(create)
+        return name
+    # the default partition can't give a range with rows to a new partition,
+    # they are moved while it is detached. Partitions are created ahead of
+    # time so this is the exception
+    logger.warning("bet partition {}: moving rows from {}", name, DEFAULT)
+    await conn.execute(sa.text(f"ALTER TABLE bet DETACH PARTITION {DEFAULT}"))
+    await conn.execute(create)
+    await conn.execute(
+        sa.text(f"""
+            WITH moved AS (
+                DELETE FROM {DEFAULT}
+                WHERE created_at >= :start AND created_at < :end
+                RETURNING *
+            )
+            INSERT INTO bet SELECT * FROM moved
+            """),
+        {"start": start, "end": end},
+    )
+    await conn.execute(sa.text(f"ALTER TABLE bet ATTACH PARTITION {DEFAULT} DEFAULT"))
+    return name
+
+
+async def create_partitions(now: int, ahead: int = BET_PARTITIONS_AHEAD) -> list[str]:
+    """
+    Создать партиции текущего и следующих ahead месяцев, которых еще нет.
+    Возвращает имена созданных
+    """
+    async with session.engine.connect() as conn:
+        partitions = await get_partitions(conn)
+    created = []
+    # future months first: they have no rows in the default partition yet
+    # and get their partitions even when moving the rows of an earlier one fails
+    for months in reversed(range(ahead + 1)):
+        start, end = month_start(now, months), month_start(now, months + 1)
+        if any(p.overlaps(start, end) for p in partitions):
+            continue
+        async with session.engine.begin() as conn:
+            created.append(await create_partition(conn, start, end))
+    created.sort()
+    if created:
+        logger.info("bet partitions created: {}", ", ".join(created))
+    return created
+
+
+async def export_partition(conn: AsyncConnection, name: str, path: str) -> int:
+    """
+    Записать ставки партиции в path, gzip NDJSON в формате GET /bets.
+    Строки читаются курсором на сервере порциями по EXPORT_BATCH, память
+    не зависит от размера партиции. Возвращает кол-во ставок
+    """
+    table = sa.table(
+        name,
+        *(
+            sa.column(column.key, models.Bet.__table__.c[column.key].type)
+            for column in services.bets.BET_COLUMNS
+        ),
+    )
+    result = await conn.stream(
+        sa.select(*table.c).execution_options(yield_per=EXPORT_BATCH)
+    )
+    count = 0
+    tmp = path + ".tmp"
+    try:
+        with open(tmp, "wb") as file:
+            with gzip.GzipFile(fileobj=file, mode="wb") as out:
+                async for rows in result.partitions():
+                    data = "".join(services.render.bet_json(row) + "\n" for row in rows)
+                    # compression is the slow part, out of the event loop
+                    await asyncio.to_thread(out.write, data.encode("utf-8"))
+                    count += len(rows)
+            file.flush()
+            os.fsync(file.fileno())
+    finally:
+        await result.close()
+    os.replace(tmp, path)
+    return count
+
+
+async def archive_partition(partition: Partition, directory: str) -> int | None:
+    """
+    Выгрузить ставки партиции в directory/<партиция>.ndjson.gz, затем
+    отсоединить и удалить ее. Партиция с нерассчитанными ставками
+    остается как есть, тогда возвращает None, иначе кол-во ставок.
+    Обязательства по событиям (event_exposure) продолжают учитывать
+    выгруженные ставки
+    """
+    name = partition.name
+    waiting = sa.text(f"SELECT EXISTS (SELECT FROM {name} WHERE state = 'WAIT')")
+    async with session.engine.connect() as conn:
+        # the export is of the same snapshot that was checked for WAIT bets
+        await conn.execution_options(isolation_level="REPEATABLE READ")
+        async with conn.begin():
+            if await conn.scalar(waiting):
+                return None
+            path = os.path.join(directory, f"{name}.ndjson.gz")
+            count = await export_partition(conn, name, path)
+    # the open cursor keeps the partition in use until the end of the
+    # transaction, it is dropped in the next one. Past months get no new bets
+    # and settled bets are not changed in between
+    async with session.engine.begin() as conn:
+        if await conn.scalar(waiting):
+            return None
+        # detach locks the whole bet table
+        await conn.execute(sa.text(f"SET LOCAL lock_timeout = '{LOCK_TIMEOUT}'"))
+        await conn.execute(sa.text(f"ALTER TABLE bet DETACH PARTITION {name}"))
+        await conn.execute(sa.text(f"DROP TABLE {name}"))
+    logger.info("bet partition {} archived to {}: {} bets", name, path, count)
+    return count
+
+
+async def archive_partitions(
+    now: int, directory: str, after_months: int = BET_ARCHIVE_AFTER_MONTHS
+) -> list[str]:
+    """
+    Выгрузить и отсоединить рассчитанные партиции, которые закончились
+    раньше, чем after_months месяцев назад. Возвращает имена выгруженных
+    """
+    cutoff = month_start(now, -after_months)
+    async with session.engine.connect() as conn:
+        partitions = await get_partitions(conn)
+    os.makedirs(directory, exist_ok=True)
+    archived = []
+    for partition in partitions:
+        if partition.end > cutoff:
+            break
+        if await archive_partition(partition, directory) is not None:
+            archived.append(partition.name)
+    return archived
+
+
+async def maintain(now: int) -> None:
+    "Создать партиции наперед и выгрузить старые, если задан BET_ARCHIVE_DIR"
+    await create_partitions(now)
+    if BET_ARCHIVE_DIR:
+        await archive_partitions(now, BET_ARCHIVE_DIR)
+
+
+async def run_maintenance() -> None:
+    "Обслуживать партиции ставок в фоне раз в BET_PARTITIONS_CHECK_S"
+    while True:
+        try:
+            await maintain(utils.current_timestamp())
+        except Exception as e:
+            # retried on the next check
+            logger.exception(e)
+        await asyncio.sleep(BET_PARTITIONS_CHECK_S)
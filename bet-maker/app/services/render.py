@@ -0,0 +1,41 @@
+import decimal
+from typing import Iterable
+
+from app import schemas
+
+# JSON of the list endpoints without pydantic models and jsonable_encoder:
+# the same keys and order as schemas.Event / schemas.Bet rendered by alias.
+# Decimals are written as their text, the same numbers without float rounding
+
+
+def _number(value: decimal.Decimal | None) -> str:
+    return "null" if value is None else str(value)
+
+
+def events_json(events: Iterable[schemas.Event]) -> bytes:
+    "Тело ответа со списком событий"
+    return (
+        "["
+        + ",".join(
+            f'{{"event_id":"{e.id}","coefficient":{e.coefficient},'
+            f'"deadline":{e.deadline},"state":{e.state.value},'
+            f'"version":{e.version}}}'
+            for e in events
+        )
+        + "]"
+    ).encode("utf-8")
+
+
+def bet_json(row: tuple) -> str:
+    "Ставка из строки services.bets.BET_COLUMNS"
+    event_id, amount, bet_id, state, coefficient, created_at, payout = row
+    return (
+        f'{{"event_id":"{event_id}","amount":{amount},"bet_id":"{bet_id}",'
+        f'"state":{state.value},"coefficient":{coefficient},'
+        f'"created_at":{created_at},"payout":{_number(payout)}}}'
+    )
+
+
+def bets_json(rows: Iterable[tuple]) -> bytes:
+    "Тело ответа со списком ставок из строк services.bets.BET_COLUMNS"
+    return ("[" + ",".join(map(bet_json, rows)) + "]").encode("utf-8")
@@ -0,0 +1,167 @@
+import time
+import uuid
+import asyncio
+
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import AsyncSession
+from loguru import logger
+
+from app import schemas, services
+from app.db import models, session
+from app.services import utils
+from app.config import SETTLEMENT_CHUNK_SIZE, SETTLEMENT_RETRY_S, SETTLEMENT_SWEEP_S
+
+# running settlements, keep references so the tasks are not garbage collected
+_tasks: dict[uuid.UUID, asyncio.Task] = {}
+
+
+async def start_settlements(
+    db: AsyncSession, items: list[tuple[uuid.UUID, schemas.BetState]]
+) -> None:
+    """
+    Запланировать расчет ставок событий одним запросом.
+    Вызывается в транзакции закрытия событий, повторный вызов ничего не меняет
+    """
+    if not items:
+        return
+    started_at = utils.current_timestamp()
+    stmt = (
+        postgresql.insert(models.Settlement)
+        .values(
+            [
+                {
+                    "event_id": event_id,
+                    "bet_state": bet_state,
+                    "settled": 0,
+                    "started_at": started_at,
+                }
+                for event_id, bet_state in items
+            ]
+        )
+        .on_conflict_do_nothing()
+    )
+    await db.execute(stmt)
+
+
+async def get_settlement(db: AsyncSession, event_id: uuid.UUID) -> models.Settlement:
+    "Получить прогресс расчета ставок события"
+    settlement = await db.get(models.Settlement, event_id)
+    if settlement is None:
+        raise utils.NotInDB("Settlement", event_id=event_id)
+    return settlement
+
+
+async def settle_event(
+    db: AsyncSession, event_id: uuid.UUID, chunk_size: int = SETTLEMENT_CHUNK_SIZE
+) -> int:
+    """
+    Рассчитать ставки события порциями по chunk_size, каждая порция в своей
+    транзакции вместе с прогрессом. Если процесс упадет, расчет продолжится
+    с нерассчитанных ставок. Возвращает кол-во рассчитанных ставок
+    """
+    settlement = await db.get(models.Settlement, event_id)
+    if settlement is None or settlement.finished_at is not None:
+        return 0
+    bet_state = settlement.bet_state
+
+    total = 0
+    started = time.perf_counter()
+    while True:
+        count = await services.bets.settle_bets_chunk(
+            db, event_id, bet_state, chunk_size
+        )
+        total += count
+        # a short chunk skips bets locked by another transaction, the
+        # settlement is finished only when no bet waits
+        done = count < chunk_size and not await services.bets.has_unsettled_bets(
+            db, event_id
+        )
+        values = {models.Settlement.settled: models.Settlement.settled + count}
+        if done:
+            values[models.Settlement.finished_at] = utils.current_timestamp()
+        await db.execute(
+            sa.update(models.Settlement)
+            .where(models.Settlement.event_id == event_id)
+            .values(values)
+        )
+        await db.commit()
+
+        elapsed = time.perf_counter() - started
+        logger.info(
+            "settlement {}: {} bets settled, {:.0f} bets/s",
+            event_id,
+            total,
+            total / elapsed if elapsed else 0,
+        )
+        if done:
+            return total
+        if count < chunk_size:
+            # wait for the locks to be released
+            await asyncio.sleep(SETTLEMENT_RETRY_S)
+
+
+async def sweep_settlements() -> list[uuid.UUID]:
+    """
+    Возобновить законченные расчеты событий, у которых есть нерассчитанные
+    ставки (попали в БД после расчета). Возвращает id событий
+    """
+    settlement = models.Settlement
+    stmt = (
+        sa.update(settlement)
+        .where(
+            settlement.finished_at.is_not(None),
+            sa.exists().where(
+                models.Bet.event_id == settlement.event_id,
+                models.Bet.state == schemas.BetState.WAIT,
+            ),
+        )
+        .values(finished_at=None)
+        .returning(settlement.event_id)
+    )
+    async with session.async_session() as db:
+        event_ids = (await db.execute(stmt)).scalars().all()
+        await db.commit()
+    for event_id in event_ids:
+        logger.warning("settlement {}: late bets, settling again", event_id)
+        schedule(event_id)
+    return event_ids
+
+
+async def run_sweeps() -> None:
+    "Искать поздние ставки рассчитанных событий раз в SETTLEMENT_SWEEP_S"
+    while True:
+        await asyncio.sleep(SETTLEMENT_SWEEP_S)
+        try:
+            await sweep_settlements()
+        except Exception as e:
+            # retried on the next sweep
+            logger.exception(e)
+
+
+async def _run(event_id: uuid.UUID) -> None:
+    try:
+        async with session.async_session() as db:
+            await settle_event(db, event_id)
+    except Exception as e:
+        # the settlement stays unfinished and is resumed on the next start
+        logger.exception(e)
+    finally:
+        _tasks.pop(event_id, None)
+
+
+def schedule(event_id: uuid.UUID) -> None:
+    "Запустить расчет ставок события в фоне"
+    if event_id not in _tasks:
+        _tasks[event_id] = asyncio.create_task(_run(event_id))
+
+
+async def resume_settlements() -> None:
+    "Продолжить расчеты, прерванные остановкой сервиса"
+    async with session.async_session() as db:
+        stmt = sa.select(models.Settlement.event_id).where(
+            models.Settlement.finished_at.is_(None)
+        )
+        event_ids = (await db.execute(stmt)).scalars().all()
+    for event_id in event_ids:
+        schedule(event_id)
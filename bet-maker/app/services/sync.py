@@ -0,0 +1,95 @@
+import json
+
+import httpx
+from loguru import logger
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import schemas, services
+from app.db import models, session
+from app.services import utils
+from app.config import LINE_PROVIDER_URL, EVENTS_SYNC_PAGE_SIZE
+
+SOURCE = "line-provider"
+
+
+async def get_last_seq(db: AsyncSession) -> int:
+    "Получить seq последнего загруженного изменения"
+    state = await db.get(models.SyncState, SOURCE)
+    return state.last_seq if state is not None else 0
+
+
+async def save_last_seq(db: AsyncSession, seq: int) -> None:
+    stmt = postgresql.insert(models.SyncState).values(
+        source=SOURCE, last_seq=seq, synced_at=utils.current_timestamp()
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[models.SyncState.source],
+        set_={"last_seq": stmt.excluded.last_seq, "synced_at": stmt.excluded.synced_at},
+    )
+    await db.execute(stmt)
+
+
+async def fetch_changes(
+    client: httpx.AsyncClient, since: int, limit: int
+) -> tuple[list[schemas.Event], int, int]:
+    """
+    Получить страницу изменений событий после since.
+    Возвращает события, seq последнего из них и seq последнего изменения в источнике
+    """
+    events = []
+    seq = since
+    async with client.stream(
+        "GET", "/events/changes", params={"since": since, "limit": limit}
+    ) as response:
+        response.raise_for_status()
+        head = int(response.headers["X-Head-Seq"])
+        async for line in response.aiter_lines():
+            if not line:
+                continue
+            data = json.loads(line)
+            # seq of the last change is the event version
+            seq = data["version"] = data.pop("seq")
+            events.append(schemas.Event.parse_obj(data))
+    return events, seq, head
+
+
+async def sync_events(
+    client: httpx.AsyncClient, page_size: int = EVENTS_SYNC_PAGE_SIZE
+) -> int:
+    """
+    Догрузить события, измененные в line-provider после прошлой синхронизации.
+    Все страницы и новая позиция сохраняются одной транзакцией, прерванная
+    синхронизация начнется заново с той же позиции.
+    Возвращает кол-во загруженных событий
+    """
+    total = 0
+    async with session.async_session() as db:
+        since = await get_last_seq(db)
+        while True:
+            events, seq, head = await fetch_changes(client, since, page_size)
+            if head < since:
+                # line-provider lost its history, load everything again
+                logger.warning("line-provider seq {} is behind {}", head, since)
+                since = 0
+                continue
+            await services.events.upsert_events(db, events)
+            total += len(events)
+            since = seq
+            if len(events) < page_size:
+                break
+        await save_last_seq(db, since)
+        await db.commit()
+    # cached events may be outdated, they are loaded again on demand
+    services.events.cache.clear()
+    return total
+
+
+async def resync() -> None:
+    "Синхронизация при старте, без line-provider сервис работает по очереди"
+    try:
+        async with httpx.AsyncClient(base_url=LINE_PROVIDER_URL, timeout=30) as client:
+            total = await sync_events(client)
+        logger.info("synced {} events from line-provider", total)
+    except Exception as e:
+        logger.exception(e)
@@ -3,3 +3,39 @@ import time
 
 def current_timestamp() -> int:
     return int(time.time())
+
+
+class NotInDB(Exception):
+    "Запись не найдена в БД"
+
+    def __init__(self, model_name: str, **filters):
+        params = ", ".join(f"{key}={value}" for key, value in filters.items())
+        super().__init__(f"{model_name} not found ({params})")
+
+
+class ContainsInDB(Exception):
+    "Запись уже есть в БД"
+
+    def __init__(self, model_name: str, **filters):
+        params = ", ".join(f"{key}={value}" for key, value in filters.items())
+        super().__init__(f"{model_name} already exists ({params})")
+
+
+class BadRequest(Exception):
+    "Некорректные параметры запроса"
+
+
+class ConflictError(Exception):
+    "Операция противоречит текущему состоянию данных"
+
+
+class Overloaded(Exception):
+    "Сервис перегружен, запрос стоит повторить через retry_after секунд"
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class RateLimited(Overloaded):
+    "Клиент превысил свой лимит запросов"
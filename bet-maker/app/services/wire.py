@@ -0,0 +1,65 @@
+import decimal
+import json
+import struct
+import uuid
+
+from app import schemas
+
+# keep in sync with line-provider/wire.py
+
+JSON_CONTENT_TYPE = "application/json"
+# compact binary event, the first byte is the format version
+BINARY_CONTENT_TYPE = "application/x-betting-event"
+
+BINARY_V1 = 1
+# format version, event_id, coefficient in cents, deadline, state
+_binary_v1 = struct.Struct(">B16sIqB")
+BINARY_V2 = 2
+# v1 + event version
+_binary_v2 = struct.Struct(">B16sIqBQ")
+
+
+def encode_json(event: schemas.Event) -> bytes:
+    return event.json(by_alias=True).encode("utf-8")
+
+
+def encode_binary(event: schemas.Event) -> bytes:
+    return _binary_v2.pack(
+        BINARY_V2,
+        event.id.bytes,
+        int(event.coefficient * 100),
+        event.deadline,
+        event.state.value,
+        event.version,
+    )
+
+
+def decode_json(data: bytes) -> schemas.Event:
+    return schemas.Event(**json.loads(data))
+
+
+def decode_binary(data: bytes) -> schemas.Event:
+    if data[:1] == bytes([BINARY_V2]):
+        _, event_id, cents, deadline, state, version = _binary_v2.unpack(data)
+    elif data[:1] == bytes([BINARY_V1]):
+        _, event_id, cents, deadline, state = _binary_v1.unpack(data)
+        version = 0
+    else:
+        raise ValueError(f"Unsupported event format version: {data[:1]!r}")
+    # fixed-width fields are valid by construction, skip pydantic validation
+    return schemas.Event.construct(
+        id=uuid.UUID(bytes=event_id),
+        coefficient=decimal.Decimal(cents).scaleb(-2),
+        deadline=deadline,
+        state=schemas.EventState(state),
+        version=version,
+    )
+
+
+def decode(data: bytes, content_type: str | None) -> schemas.Event:
+    # messages without content type come from older line-provider versions
+    if content_type is None or content_type == JSON_CONTENT_TYPE:
+        return decode_json(data)
+    if content_type == BINARY_CONTENT_TYPE:
+        return decode_binary(data)
+    raise ValueError(f"Unsupported content type: {content_type}")
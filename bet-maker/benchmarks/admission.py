@@ -0,0 +1,78 @@
+"""
+POST /bet under overload with and without admission control: many clients
+in a closed loop, throughput and latency of accepted bets, share of rejected
+requests. Without the limit every request queues on the connection pool and
+the latency grows with the clients, with it the latency stays bounded and
+the excess is rejected at once.
+
+Recreates the tables of DATABASE_URL, run it against a scratch database:
+    python -m benchmarks.admission --clients 50,500 --seconds 10
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+from httpx import AsyncClient
+
+from app import admission
+from app.db import session
+from app.main import app
+from benchmarks.bets import create_event, reset_tables
+
+async def client_loop(client: AsyncClient, body: dict, until: float, stats: dict):
+    while time.perf_counter() < until:
+        started = time.perf_counter()
+        response = await client.post("/bet", json=body)
+        elapsed = time.perf_counter() - started
+        if response.status_code == 200:
+            stats["latencies"].append(elapsed)
+        else:
+            assert response.status_code == 503, response.text
+            stats["rejected"] += 1
+            # well-behaved clients, the server shares a CPU with them here
+            await asyncio.sleep(float(response.headers["Retry-After"]))
+
+
+async def run(clients: int, seconds: float, body: dict) -> None:
+    stats = {"latencies": [], "rejected": 0}
+    async with AsyncClient(app=app, base_url="http://localhost") as client:
+        until = time.perf_counter() + seconds
+        await asyncio.gather(
+            *(client_loop(client, body, until, stats) for _ in range(clients))
+        )
+    latencies = sorted(stats["latencies"])
+    accepted = len(latencies)
+    total = accepted + stats["rejected"]
+    p99 = latencies[int(accepted * 0.99)] if accepted else 0
+    median = statistics.median(latencies) if accepted else 0
+    print(
+        f"{accepted / seconds:8.0f} bets/s"
+        f"  p50 {median * 1000:7.1f} ms  p99 {p99 * 1000:7.1f} ms"
+        f"  rejected {stats['rejected'] / max(total, 1):6.1%}"
+    )
+
+
+async def main(clients: list[int], seconds: float):
+    await reset_tables()
+    event_id = await create_event()
+    body = {"event_id": str(event_id), "amount": 10.5}
+    enabled = admission.limit
+    disabled = admission.AdmissionLimit(
+        max_inflight=10**9, max_queue=0, timeout=0, retry_after=0
+    )
+    for count in clients:
+        for name, limit in (("off", disabled), ("on", enabled)):
+            admission.limit = limit
+            print(f"{count:>4} clients, admission {name:<3}", end="  ", flush=True)
+            await run(count, seconds, body)
+    await session.engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", default="1,50,500")
+    parser.add_argument("--seconds", type=float, default=10)
+    args = parser.parse_args()
+    asyncio.run(main([int(c) for c in args.clients.split(",")], args.seconds))
@@ -0,0 +1,80 @@
+"""
+Archival of a settled month of bets: export speed, file size and the peak
+memory of the export (tracemalloc) for partitions of growing size. The
+server-side cursor keeps the memory flat, fetchall would grow with the rows.
+
+Recreates the tables of DATABASE_URL, run it against a scratch database:
+    python -m benchmarks.archive --rows 100000,1000000
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+import tracemalloc
+import uuid
+
+import sqlalchemy as sa
+
+from app import services
+from app.db import models, session
+from benchmarks.reads import reset_tables
+
+
+async def fill(rows: int, created_at: int) -> None:
+    event_id = uuid.uuid4()
+    async with session.engine.begin() as conn:
+        await conn.execute(
+            sa.insert(models.Event).values(
+                id=event_id, coefficient=1.5, deadline=created_at, state="FINISHED_WIN"
+            )
+        )
+        # generated on the server, the client side would dominate the run
+        await conn.execute(
+            sa.text("""
+                INSERT INTO bet (id, event_id, amount, coefficient, created_at, state, payout)
+                SELECT gen_random_uuid(), :event_id, 10 + i % 1000, 1.5, :created_at + i % 1000,
+                       'WIN', round((10 + i % 1000) * 1.5, 2)
+                FROM generate_series(1, :rows) AS i
+                """),
+            {"event_id": event_id, "created_at": created_at, "rows": rows},
+        )
+
+
+async def main(sizes: list[int]):
+    now = int(time.time())
+    directory = tempfile.mkdtemp(prefix="bet-archive-")
+    for rows in sizes:
+        await reset_tables()
+        month = services.partitions.month_start(now, -6)
+        await services.partitions.create_partitions(month, ahead=6)
+        await fill(rows, month)
+        async with session.engine.connect() as conn:
+            [partition] = [
+                p
+                for p in await services.partitions.get_partitions(conn)
+                if p.start == month
+            ]
+
+        tracemalloc.start()
+        started = time.perf_counter()
+        count = await services.partitions.archive_partition(partition, directory)
+        elapsed = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        assert count == rows
+
+        size = os.path.getsize(os.path.join(directory, f"{partition.name}.ndjson.gz"))
+        print(
+            f"{rows:>9} bets  {rows / elapsed:8.0f} bets/s"
+            f"  file {size / rows:5.1f} bytes/bet"
+            f"  peak memory {peak / 2**20:6.1f} MiB"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", default="100000,1000000")
+    args = parser.parse_args()
+    asyncio.run(main([int(rows) for rows in args.rows.split(",")]))
@@ -0,0 +1,76 @@
+"""
+Bet placement: looping POST /bet vs. POST /bets/batch.
+
+Recreates the tables of DATABASE_URL, run it against a scratch database:
+    python -m benchmarks.bets --bets 10000 --batch-size 1000
+"""
+
+import argparse
+import asyncio
+import decimal
+import time
+import uuid
+
+from httpx import AsyncClient
+
+from app import schemas
+from app.db import models, session
+from app.main import app
+
+
+async def create_event() -> uuid.UUID:
+    event_id = uuid.uuid4()
+    async with session.async_session() as db:
+        db.add(
+            models.Event(
+                id=event_id,
+                coefficient=decimal.Decimal("1.50"),
+                deadline=int(time.time()) + 3600,
+                state=schemas.EventState.NEW,
+            )
+        )
+        await db.commit()
+    return event_id
+
+
+async def single(client: AsyncClient, bets: list[dict], batch_size: int):
+    for bet in bets:
+        response = await client.post("/bet", json=bet)
+        assert response.status_code == 200, response.text
+
+
+async def batched(client: AsyncClient, bets: list[dict], batch_size: int):
+    for i in range(0, len(bets), batch_size):
+        response = await client.post(
+            "/bets/batch", json={"bets": bets[i : i + batch_size]}
+        )
+        assert response.status_code == 200, response.text
+
+
+async def reset_tables():
+    # benchmarks start from empty tables, the app keeps data between restarts
+    async with session.engine.begin() as conn:
+        await conn.run_sync(session.Base.metadata.drop_all)
+        await conn.run_sync(session.Base.metadata.create_all)
+
+
+async def main(total: int, batch_size: int):
+    await reset_tables()
+    event_id = await create_event()
+    bets = [{"event_id": str(event_id), "amount": 10.5} for _ in range(total)]
+
+    async with AsyncClient(app=app, base_url="http://localhost") as client:
+        for name, run in (("POST /bet", single), ("POST /bets/batch", batched)):
+            started = time.perf_counter()
+            await run(client, bets, batch_size)
+            elapsed = time.perf_counter() - started
+            print(f"{name:<17} {total / elapsed:>9.0f} bets/s")
+    await session.engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bets", type=int, default=10_000)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+    asyncio.run(main(args.bets, args.batch_size))
@@ -0,0 +1,45 @@
+"""
+Event wire formats: encode/decode time and bytes per message.
+
+    python -m benchmarks.codec -n 100000
+"""
+
+import argparse
+import decimal
+import time
+import timeit
+import uuid
+
+from app import schemas
+from app.services import wire
+
+
+def main(number: int):
+    event = schemas.Event(
+        id=uuid.uuid4(),
+        coefficient=decimal.Decimal("1.67"),
+        deadline=int(time.time()) + 600,
+        state=schemas.EventState.NEW,
+    )
+    for name, content_type, encode in (
+        ("json", wire.JSON_CONTENT_TYPE, wire.encode_json),
+        ("binary", wire.BINARY_CONTENT_TYPE, wire.encode_binary),
+    ):
+        data = encode(event)
+        assert wire.decode(data, content_type) == event
+        encode_time = timeit.timeit(lambda: encode(event), number=number)
+        decode_time = timeit.timeit(
+            lambda: wire.decode(data, content_type), number=number
+        )
+        print(
+            f"{name:<7} {len(data):>4} bytes"
+            f"  encode {encode_time / number * 1e6:6.2f} us"
+            f"  decode {decode_time / number * 1e6:6.2f} us"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--number", type=int, default=100_000)
+    args = parser.parse_args()
+    main(args.number)
@@ -0,0 +1,155 @@
+"""
+Events consumer: message-by-message handle_event vs. batched apply_events
+with 1/2/4/8 parallel workers.
+
+Recreates the tables of DATABASE_URL, run it against a scratch database:
+    python -m benchmarks.consumer --events 200 --updates 20000 --batch-size 100 \
+        --linger-ms 20 --workers 1,2,4,8
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+
+from loguru import logger
+from sqlalchemy import event as sa_event
+
+from app import services
+from app.db import session
+
+
+class FakeMessage:
+    "Minimal stand-in for aio_pika.IncomingMessage"
+
+    pending = 0
+    done = None
+    timestamp = None
+
+    def __init__(self, body: bytes):
+        self.body = body
+
+    async def ack(self):
+        self._processed()
+
+    async def reject(self, requeue: bool = False):
+        self._processed()
+
+    def _processed(self):
+        FakeMessage.pending -= 1
+        if FakeMessage.pending == 0:
+            FakeMessage.done.set()
+
+
+def make_messages(events: int, updates: int) -> list[FakeMessage]:
+    deadline = int(time.time()) + 3600
+    ids = [str(uuid.uuid4()) for _ in range(events)]
+    bodies = [
+        {"event_id": event_id, "coefficient": 1.5, "deadline": deadline, "state": 1}
+        for event_id in ids
+    ]
+    # chatty odds feed: many coefficient updates of the same events
+    for _ in range(updates):
+        bodies.append(
+            {
+                "event_id": random.choice(ids),
+                "coefficient": random.randint(101, 999) / 100,
+                "deadline": deadline,
+                "state": 1,
+            }
+        )
+    # every tenth event is settled at the end
+    for event_id in ids[::10]:
+        bodies.append(
+            {"event_id": event_id, "coefficient": 1.5, "deadline": deadline, "state": 2}
+        )
+    return [FakeMessage(json.dumps(body).encode()) for body in bodies]
+
+
+class Counter:
+    def __init__(self, engine):
+        self.statements = 0
+        self.commits = 0
+        sa_event.listen(engine, "before_cursor_execute", self.on_execute)
+        sa_event.listen(engine, "commit", self.on_commit)
+
+    def on_execute(self, *args):
+        self.statements += 1
+
+    def on_commit(self, *args):
+        self.commits += 1
+
+    def reset(self):
+        self.statements = self.commits = 0
+
+
+async def per_message(messages):
+    for message in messages:
+        try:
+            await services.events.handle_event(
+                services.events.parse_event(message.body)
+            )
+        except Exception:
+            pass
+
+
+async def batched(messages, workers: int, batch_size: int, linger: float):
+    FakeMessage.pending = len(messages)
+    FakeMessage.done = asyncio.Event()
+    consumer = services.events.EventsConsumer(workers, batch_size, linger)
+    consumer.start()
+    for message in messages:
+        await consumer.on_message(message)
+    await FakeMessage.done.wait()
+    await consumer.stop()
+
+
+async def reset_tables():
+    # benchmarks start from empty tables, the app keeps data between restarts
+    async with session.engine.begin() as conn:
+        await conn.run_sync(session.Base.metadata.drop_all)
+        await conn.run_sync(session.Base.metadata.create_all)
+
+
+async def main(
+    events: int, updates: int, batch_size: int, linger_ms: int, workers: list[int]
+):
+    logger.remove()
+    counter = Counter(session.engine.sync_engine)
+    runs = [("per-message", per_message)] + [
+        (
+            f"{n} worker(s)",
+            lambda m, n=n: batched(m, n, batch_size, linger_ms / 1000),
+        )
+        for n in workers
+    ]
+    for name, run in runs:
+        await reset_tables()
+        messages = make_messages(events, updates)
+        counter.reset()
+        started = time.perf_counter()
+        await run(messages)
+        elapsed = time.perf_counter() - started
+        print(
+            f"{name:<13} {len(messages) / elapsed:>9.0f} msg/s"
+            f"  statements {counter.statements:>7}  commits {counter.commits:>7}"
+        )
+        # let background settlements finish before the tables are dropped
+        await asyncio.gather(*(asyncio.all_tasks() - {asyncio.current_task()}))
+    await session.engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", type=int, default=200)
+    parser.add_argument("--updates", type=int, default=20_000)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--linger-ms", type=int, default=20)
+    parser.add_argument("--workers", default="1,2,4,8")
+    args = parser.parse_args()
+    workers = [int(n) for n in args.workers.split(",")]
+    asyncio.run(
+        main(args.events, args.updates, args.batch_size, args.linger_ms, workers)
+    )
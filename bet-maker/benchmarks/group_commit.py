@@ -0,0 +1,77 @@
+"""
+POST /bet with a transaction per request vs the group commit writer: many
+clients in a closed loop, sustained bets/s and latency. Admission control
+is off for requests with their own transaction, so every client has a
+request in progress. The writer runs with the default admission, it bounds
+the queue of the writer and not the requests in flight.
+
+Recreates the tables of DATABASE_URL, run it against a scratch database:
+    python -m benchmarks.group_commit --clients 1,50,500 --seconds 10
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+from httpx import AsyncClient
+
+from app import admission, services
+from app.config import BETS_GROUP_COMMIT_SIZE, BETS_GROUP_COMMIT_LINGER_MS
+from app.db import session
+from app.main import app
+from benchmarks.bets import create_event, reset_tables
+
+
+async def client_loop(client: AsyncClient, body: dict, until: float, latencies):
+    while time.perf_counter() < until:
+        started = time.perf_counter()
+        response = await client.post("/bet", json=body)
+        assert response.status_code == 200, response.text
+        latencies.append(time.perf_counter() - started)
+
+
+async def run(clients: int, seconds: float, body: dict) -> None:
+    latencies = []
+    async with AsyncClient(app=app, base_url="http://localhost") as client:
+        until = time.perf_counter() + seconds
+        await asyncio.gather(
+            *(client_loop(client, body, until, latencies) for _ in range(clients))
+        )
+    latencies.sort()
+    print(
+        f"{len(latencies) / seconds:8.0f} bets/s"
+        f"  p50 {statistics.median(latencies) * 1000:7.1f} ms"
+        f"  p99 {latencies[int(len(latencies) * 0.99)] * 1000:7.1f} ms"
+    )
+
+
+async def main(clients: list[int], seconds: float):
+    await reset_tables()
+    event_id = await create_event()
+    body = {"event_id": str(event_id), "amount": 10.5}
+    enabled = admission.limit
+    disabled = admission.AdmissionLimit(
+        max_inflight=10**9, max_queue=0, timeout=0, retry_after=0
+    )
+    for count in clients:
+        for name in ("per request", "group"):
+            admission.limit = disabled
+            if name == "group":
+                admission.limit = enabled
+                services.bets.writer = services.bets.BetWriter(
+                    BETS_GROUP_COMMIT_SIZE, BETS_GROUP_COMMIT_LINGER_MS / 1000
+                )
+                services.bets.writer.start()
+            print(f"{count:>4} clients, {name:<11}", end="  ", flush=True)
+            await run(count, seconds, body)
+            await services.bets.stop_writer()
+    await session.engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", default="1,50,500")
+    parser.add_argument("--seconds", type=float, default=10)
+    args = parser.parse_args()
+    asyncio.run(main([int(c) for c in args.clients.split(",")], args.seconds))
@@ -0,0 +1,139 @@
+"""
+CPU per row of the list endpoints: ORM objects, orm_mode models and
+jsonable_encoder vs. Core column tuples rendered straight to JSON bytes.
+
+Recreates the tables of DATABASE_URL, run it against a scratch database:
+    python -m benchmarks.reads --rows 100000
+"""
+
+import argparse
+import asyncio
+import decimal
+import json
+import random
+import time
+import uuid
+
+import sqlalchemy as sa
+from fastapi.encoders import jsonable_encoder
+
+from app import schemas, services
+from app.db import models, session
+
+
+async def reset_tables():
+    # benchmarks start from empty tables, the app keeps data between restarts
+    async with session.engine.begin() as conn:
+        await conn.run_sync(session.Base.metadata.drop_all)
+        await conn.run_sync(session.Base.metadata.create_all)
+
+
+async def fill(rows: int) -> None:
+    event_id = uuid.uuid4()
+    states = list(schemas.BetState)
+    async with session.async_session() as db:
+        await db.execute(
+            sa.insert(models.Event).values(
+                id=event_id,
+                coefficient=decimal.Decimal("1.50"),
+                deadline=int(time.time()) + 3600,
+                state=schemas.EventState.NEW,
+            )
+        )
+        for start in range(0, rows, 10_000):
+            bets = []
+            for i in range(start, min(start + 10_000, rows)):
+                state = random.choice(states)
+                bets.append(
+                    {
+                        "id": uuid.uuid4(),
+                        "event_id": event_id,
+                        "amount": decimal.Decimal(random.randint(1, 100_000)) / 100,
+                        "coefficient": decimal.Decimal("1.50"),
+                        "created_at": i,
+                        "state": state,
+                        "payout": (
+                            None
+                            if state == schemas.BetState.WAIT
+                            else decimal.Decimal("1.00")
+                        ),
+                    }
+                )
+            await db.execute(sa.insert(models.Bet), bets)
+        await db.commit()
+
+
+def render_models(bets) -> bytes:
+    # what FastAPI does for response_model=list[schemas.Bet]
+    validated = [schemas.Bet.from_orm(bet) for bet in bets]
+    return json.dumps(
+        jsonable_encoder(validated, by_alias=True), separators=(",", ":")
+    ).encode("utf-8")
+
+
+async def measure(name: str, rows: int, fetch, render) -> bytes:
+    async with session.async_session() as db:
+        started = time.process_time()
+        fetched = await fetch(db)
+        fetched_at = time.process_time()
+        body = render(fetched)
+        finished = time.process_time()
+    assert len(fetched) == rows
+    print(
+        f"{name:<6} fetch {(fetched_at - started) / rows * 1e6:6.2f} us/row"
+        f"  render {(finished - fetched_at) / rows * 1e6:6.2f} us/row"
+        f"  total {(finished - started) / rows * 1e6:6.2f} us/row"
+    )
+    return body
+
+
+async def main(rows: int):
+    await reset_tables()
+    await fill(rows)
+
+    async def fetch_orm(db):
+        stmt = sa.select(models.Bet).order_by(models.Bet.created_at, models.Bet.id)
+        return (await db.execute(stmt)).scalars().all()
+
+    async def fetch_core(db):
+        # services.bets.get_bets without the page limit
+        stmt = sa.select(*services.bets.BET_COLUMNS).order_by(
+            models.Bet.created_at, models.Bet.id
+        )
+        return (await db.execute(stmt)).all()
+
+    print(f"GET /bets, {rows} rows")
+    async with session.async_session() as db:
+        # warm up compiled statement caches and the connection
+        await fetch_orm(db)
+        await fetch_core(db)
+    orm = await measure("orm", rows, fetch_orm, render_models)
+    core = await measure("core", rows, fetch_core, services.render.bets_json)
+    assert json.loads(orm) == json.loads(core)
+
+    events = [
+        schemas.Event.construct(
+            id=uuid.uuid4(),
+            coefficient=decimal.Decimal("1.50"),
+            deadline=i,
+            state=schemas.EventState.NEW,
+            version=i,
+        )
+        for i in range(rows)
+    ]
+    print(f"GET /events, {rows} cached events")
+    started = time.process_time()
+    json.dumps(jsonable_encoder(events, by_alias=True), separators=(",", ":"))
+    elapsed = time.process_time() - started
+    print(f"models render {elapsed / rows * 1e6:6.2f} us/row")
+    started = time.process_time()
+    services.render.events_json(events)
+    elapsed = time.process_time() - started
+    print(f"bytes  render {elapsed / rows * 1e6:6.2f} us/row")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=100_000)
+    args = parser.parse_args()
+    asyncio.run(main(args.rows))
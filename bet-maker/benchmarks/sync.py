@@ -0,0 +1,83 @@
+"""
+Startup catch-up from line-provider: full load vs. delta since last sync.
+Tables are recreated!
+
+    python -m benchmarks.sync --events 100000 --delta 1000
+"""
+
+import argparse
+import asyncio
+import json
+import time
+import uuid
+
+import httpx
+from loguru import logger
+
+from app import services
+from app.db import session
+
+
+async def reset_tables():
+    # benchmarks start from empty tables, the app keeps data between restarts
+    async with session.engine.begin() as conn:
+        await conn.run_sync(session.Base.metadata.drop_all)
+        await conn.run_sync(session.Base.metadata.create_all)
+
+
+class ChangesFeed:
+    "GET /events/changes of line-provider: one line per change, seq = index"
+
+    def __init__(self, events: int):
+        deadline = int(time.time()) + 3600
+        self.lines = [
+            json.dumps(
+                {
+                    "event_id": str(uuid.uuid4()),
+                    "coefficient": 1.5,
+                    "deadline": deadline,
+                    "state": 1,
+                    "seq": seq,
+                }
+            )
+            + "\n"
+            for seq in range(1, events + 1)
+        ]
+
+    def handle(self, request: httpx.Request) -> httpx.Response:
+        since = int(request.url.params["since"])
+        limit = int(request.url.params["limit"])
+        page = self.lines[since : since + limit]
+        return httpx.Response(
+            200,
+            content="".join(page),
+            headers={"X-Head-Seq": str(len(self.lines))},
+        )
+
+
+async def main(events: int, delta: int, page_size: int):
+    logger.remove()
+    await reset_tables()
+    feed = ChangesFeed(events)
+    total = len(feed.lines)
+    client = httpx.AsyncClient(
+        transport=httpx.MockTransport(feed.handle), base_url="http://line-provider"
+    )
+    # the line grows by delta events while bet-maker is down
+    feed.lines, extra = feed.lines[: total - delta], feed.lines[total - delta :]
+    for name in ("full", "delta"):
+        started = time.perf_counter()
+        loaded = await services.sync.sync_events(client, page_size)
+        elapsed = time.perf_counter() - started
+        print(f"{name:<6} {loaded:>8} events  {elapsed:7.2f} s")
+        feed.lines += extra
+    await client.aclose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", type=int, default=100_000)
+    parser.add_argument("--delta", type=int, default=1000)
+    parser.add_argument("--page-size", type=int, default=5000)
+    args = parser.parse_args()
+    asyncio.run(main(args.events, args.delta, args.page_size))
@@ -2,33 +2,26 @@ import uuid
 import time
 import decimal
 import asyncio
+import datetime
+import json
+import gzip
 
 import pytest
 import pytest_asyncio
+import aio_pika
+import httpx
+from httpx import AsyncClient
+from fastapi.encoders import jsonable_encoder
 import sqlalchemy as sa
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 
+from app.db.session import Base, engine as app_engine
+from app.db import models, session as db_session
 from app.config import DATABASE_URL
-from app.db.session import Base
-from app.db import models
-from app import schemas, services
-
-
-@pytest.fixture(scope="session")
-def event_loop():
-    try:
-        loop = asyncio.get_running_loop()
-    except RuntimeError:
-        loop = asyncio.new_event_loop()
-    yield loop
-    loop.close()
-
-
-@pytest_asyncio.fixture(scope="session")
-def engine():
-    engine = create_async_engine(DATABASE_URL)
-    yield engine
-    engine.sync_engine.dispose()
+from app import schemas, services, admission
+from app.main import app
+from app.services import wire, utils
+from app.services.cache import EventCache
 
 
 @pytest_asyncio.fixture()
@@ -38,6 +31,8 @@ async def create(engine):
     yield
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.drop_all)
+    # pooled connections of the app cache type oids of the dropped enums
+    await app_engine.dispose()
 
 
 @pytest_asyncio.fixture
@@ -84,34 +79,1076 @@ async def test_create_bet(session: AsyncSession):
     assert len((await session.execute(stmt)).scalars().all()) == 1
 
 
+def test_coalesce_events_keeps_latest_and_settlement():
+    event_id = uuid.uuid4()
+    deadline = int(time.time()) + 600
+
+    def event(coefficient, state=schemas.EventState.NEW):
+        return schemas.Event(
+            id=event_id,
+            coefficient=decimal.Decimal(coefficient),
+            deadline=deadline,
+            state=state,
+        )
+
+    latest = services.events.coalesce_events([event("1.10"), event("1.20")])
+    assert [e.coefficient for e in latest] == [decimal.Decimal("1.20")]
+
+    closed = event("1.30", schemas.EventState.FINISHED_WIN)
+    latest = services.events.coalesce_events([event("1.10"), closed, event("1.40")])
+    assert latest == [closed]
+
+
 @pytest.mark.asyncio
-async def test_update_bet_state(session: AsyncSession):
-    # create debug event
+async def test_apply_events_batch(session: AsyncSession):
+    deadline = int(time.time()) + 600
+    event_id, closed_id = uuid.uuid4(), uuid.uuid4()
+    session.add(
+        models.Event(
+            id=closed_id,
+            coefficient=decimal.Decimal("2.00"),
+            deadline=deadline,
+            state=schemas.EventState.NEW,
+        )
+    )
+    await session.commit()
+    bet = await services.bets.create_bet(
+        session,
+        schemas.BetCreate(event_id=closed_id, amount=decimal.Decimal("10.00")),
+    )
+
+    batch = [
+        schemas.Event(id=event_id, coefficient="1.10", deadline=deadline, state=1),
+        schemas.Event(id=event_id, coefficient="1.20", deadline=deadline, state=1),
+        schemas.Event(id=closed_id, coefficient="2.00", deadline=deadline, state=2),
+    ]
+    assert len(await services.events.apply_events(session, batch)) == 2
+
+    event = await session.get(models.Event, event_id)
+    assert event.coefficient == decimal.Decimal("1.20")
+    # closing the event schedules settlement of its bets
+    assert await services.settlement.settle_event(session, closed_id) == 1
+    stmt = sa.select(models.Bet.state).where(models.Bet.id == bet.id)
+    assert await session.scalar(stmt) == schemas.BetState.WIN
+
+    # closed event is not updated again
+    reopen = schemas.Event(id=closed_id, coefficient="3.00", deadline=deadline, state=1)
+    assert await services.events.apply_events(session, [reopen]) == []
+
+
+@pytest.mark.asyncio
+async def test_apply_events_by_version(session: AsyncSession, monkeypatch):
+    scheduled = []
+    monkeypatch.setattr(services.settlement, "schedule", scheduled.append)
+    deadline = int(time.time()) + 600
     event_id = uuid.uuid4()
-    event = models.Event(
-        id=event_id,
-        coefficient=decimal.Decimal("3.34"),
+
+    def version(coefficient: str, version: int, state: int = 1) -> schemas.Event:
+        return schemas.Event(
+            id=event_id,
+            coefficient=coefficient,
+            deadline=deadline,
+            state=state,
+            version=version,
+        )
+
+    await services.events.handle_event(version("1.10", 5))
+    # duplicate and reordered deliveries
+    await services.events.handle_event(version("1.10", 5))
+    await services.events.handle_event(version("1.05", 3))
+    event = await session.get(models.Event, event_id)
+    assert (event.coefficient, event.version) == (decimal.Decimal("1.10"), 5)
+
+    await services.events.handle_event(version("1.20", 6, state=2))
+    await services.events.handle_event(version("1.20", 6, state=2))
+    await session.refresh(event)
+    assert (event.state, event.version) == (schemas.EventState.FINISHED_WIN, 6)
+    # settlement is started once, for the transition from NEW only
+    assert scheduled == [event_id]
+    assert (await services.settlement.get_settlement(session, event_id)).settled == 0
+
+
+@pytest.mark.asyncio
+async def test_settle_event_in_chunks(session: AsyncSession):
+    event_id = uuid.uuid4()
+    session.add(
+        models.Event(
+            id=event_id,
+            coefficient=decimal.Decimal("1.50"),
+            deadline=int(time.time()) + 600,
+            state=schemas.EventState.NEW,
+        )
+    )
+    await session.commit()
+    for _ in range(5):
+        await services.bets.create_bet(
+            session,
+            schemas.BetCreate(event_id=event_id, amount=decimal.Decimal("10.00")),
+        )
+
+    await services.settlement.start_settlements(
+        session, [(event_id, schemas.BetState.WIN)]
+    )
+    await session.commit()
+    # emulate a crash after the first chunk
+    await services.bets.settle_bets_chunk(session, event_id, schemas.BetState.WIN, 2)
+    await session.commit()
+
+    assert await services.settlement.settle_event(session, event_id, chunk_size=2) == 3
+
+    settlement = await services.settlement.get_settlement(session, event_id)
+    assert settlement.finished_at is not None
+    stmt = sa.select(models.Bet.state, models.Bet.payout).where(
+        models.Bet.event_id == event_id
+    )
+    rows = (await session.execute(stmt)).all()
+    assert rows == [(schemas.BetState.WIN, decimal.Decimal("15.00"))] * 5
+    # finished settlement is not run again
+    assert await services.settlement.settle_event(session, event_id) == 0
+
+
+@pytest.mark.asyncio
+async def test_settlement_waits_for_locked_bets_and_sweeps_late_ones(
+    session: AsyncSession, engine, monkeypatch
+):
+    monkeypatch.setattr(services.settlement, "SETTLEMENT_RETRY_S", 0.05)
+    event_id = uuid.uuid4()
+    session.add(
+        models.Event(
+            id=event_id,
+            coefficient=decimal.Decimal("1.50"),
+            deadline=int(time.time()) + 600,
+            state=schemas.EventState.NEW,
+        )
+    )
+    await session.commit()
+    bets = [
+        await services.bets.create_bet(
+            session,
+            schemas.BetCreate(event_id=event_id, amount=decimal.Decimal("10.00")),
+        )
+        for _ in range(3)
+    ]
+    await services.settlement.start_settlements(
+        session, [(event_id, schemas.BetState.WIN)]
+    )
+    await session.commit()
+
+    async def finished_at():
+        async with AsyncSession(engine) as other:
+            return (await other.get(models.Settlement, event_id)).finished_at
+
+    # a bet locked by another transaction is skipped by the chunk
+    async with engine.connect() as conn:
+        await conn.execute(
+            sa.select(models.Bet.id)
+            .where(models.Bet.id == bets[0].id)
+            .with_for_update()
+        )
+        task = asyncio.create_task(
+            services.settlement.settle_event(session, event_id, chunk_size=10)
+        )
+        await asyncio.sleep(0.3)
+        assert not task.done()
+        assert await finished_at() is None
+        await conn.rollback()
+    assert await task == 3
+    assert await finished_at() is not None
+
+    # a bet that came after the settlement is settled by the sweep
+    session.add(
+        models.Bet(
+            event_id=event_id,
+            amount=decimal.Decimal("1.00"),
+            coefficient=decimal.Decimal("1.50"),
+            created_at=int(time.time()),
+            state=schemas.BetState.WAIT,
+        )
+    )
+    await session.commit()
+    scheduled = []
+    monkeypatch.setattr(services.settlement, "schedule", scheduled.append)
+    assert await services.settlement.sweep_settlements() == [event_id]
+    assert scheduled == [event_id]
+    assert await services.settlement.settle_event(session, event_id) == 1
+    assert await services.settlement.sweep_settlements() == []
+
+
+def test_event_cache_evicts_closed_events():
+    cache = EventCache(max_size=2)
+    deadline = int(time.time()) + 600
+    open_event = schemas.Event(
+        id=uuid.uuid4(), coefficient="1.10", deadline=deadline, state=1
+    )
+    closed = [
+        schemas.Event(id=uuid.uuid4(), coefficient="1.10", deadline=deadline, state=2)
+        for _ in range(2)
+    ]
+    cache.put(open_event)
+    for event in closed:
+        cache.put(event)
+
+    assert len(cache) == 2
+    assert cache.get(closed[0].id) is None
+    assert cache.get(open_event.id) == open_event
+    assert (cache.hits.value, cache.misses.value) == (1, 1)
+    # the counters are kept across resyncs
+    cache.clear()
+    assert cache.get(open_event.id) is None
+    assert (cache.hits.value, cache.misses.value) == (1, 2)
+
+
+@pytest.mark.asyncio
+async def test_active_events_served_from_cache(session: AsyncSession, monkeypatch):
+    services.events.cache.clear()
+    monkeypatch.setattr(services.events.cache, "active_ttl", 60)
+    now = int(time.time())
+    expired, later, sooner = (
+        schemas.Event(id=uuid.uuid4(), coefficient="1.10", deadline=deadline, state=1)
+        for deadline in (now - 10, now + 600, now + 60)
+    )
+    await services.events.apply_events(session, [expired, later])
+    assert await services.events.get_active_events(session) == [later]
+
+    # consumer updates are visible without querying the db
+    await services.events.apply_events(session, [sooner])
+    await session.close()
+    assert await services.events.get_active_events(None) == [sooner, later]
+
+    closed = later.copy(update={"state": schemas.EventState.FINISHED_LOSE})
+    await services.events.apply_events(session, [closed])
+    assert await services.events.get_active_events(None) == [sooner]
+
+    # changes applied by another process reach the list once it expires
+    other = schemas.Event(
+        id=uuid.uuid4(), coefficient="1.10", deadline=now + 300, state=1
+    )
+    await session.execute(sa.insert(models.Event).values(other.dict()))
+    await session.execute(
+        sa.update(models.Event)
+        .where(models.Event.id == sooner.id)
+        .values(state=schemas.EventState.FINISHED_WIN)
+    )
+    await session.commit()
+    assert await services.events.get_active_events(None) == [sooner]
+    monkeypatch.setattr(services.events.cache, "active_ttl", 0)
+    assert [e.id for e in await services.events.get_active_events(session)] == [
+        other.id
+    ]
+    assert services.events.cache.get(sooner.id) is None
+
+
+@pytest.mark.asyncio
+async def test_create_bets_batch(session: AsyncSession):
+    now = int(time.time())
+    open_id, closed_id, expired_id = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+    for event_id, deadline, state in (
+        (open_id, now + 600, schemas.EventState.NEW),
+        (closed_id, now + 600, schemas.EventState.FINISHED_WIN),
+        (expired_id, now - 10, schemas.EventState.NEW),
+    ):
+        session.add(
+            models.Event(
+                id=event_id,
+                coefficient=decimal.Decimal("2.50"),
+                deadline=deadline,
+                state=state,
+            )
+        )
+    await session.commit()
+
+    bet_creates = [
+        schemas.BetCreate(event_id=event_id, amount=decimal.Decimal("10.00"))
+        for event_id in (open_id, closed_id, uuid.uuid4(), expired_id, open_id)
+    ]
+    results = await services.bets.create_bets(session, bet_creates)
+
+    assert [r.status for r in results] == [
+        schemas.BetBatchStatus.ACCEPTED,
+        schemas.BetBatchStatus.REJECTED,
+        schemas.BetBatchStatus.REJECTED,
+        schemas.BetBatchStatus.REJECTED,
+        schemas.BetBatchStatus.ACCEPTED,
+    ]
+    assert results[1].reason == "Event already closed"
+    assert results[0].bet.coefficient == decimal.Decimal("2.50")
+
+    stmt = sa.select(models.Bet.id).where(models.Bet.event_id == open_id)
+    saved = set((await session.execute(stmt)).scalars().all())
+    assert saved == {results[0].bet.id, results[4].bet.id}
+
+
+@pytest.mark.asyncio
+async def test_bets_checked_against_db_when_cache_is_stale(session: AsyncSession):
+    event = schemas.Event(
+        id=uuid.uuid4(),
+        coefficient="2.50",
         deadline=int(time.time()) + 600,
         state=schemas.EventState.NEW,
+        version=1,
+    )
+    await services.events.apply_events(session, [event])
+    # closed by the consumer of another process, the cache here still has it open
+    await session.execute(
+        sa.update(models.Event)
+        .where(models.Event.id == event.id)
+        .values(state=schemas.EventState.FINISHED_WIN, version=2)
     )
-    session.add(event)
     await session.commit()
-    await session.refresh(event)
-    event_id = event.id
+    bet_create = schemas.BetCreate(event_id=event.id, amount=decimal.Decimal("10"))
 
-    # create debug bet
-    bet_create = schemas.BetCreate(
-        event_id=event_id, amount=decimal.Decimal("50000.00")
+    [result] = await services.bets.create_bets(session, [bet_create])
+    assert result.status == schemas.BetBatchStatus.REJECTED
+    assert result.reason == "Event already closed"
+    # the cache caught up
+    assert services.events.cache.get(event.id).version == 2
+    with pytest.raises(utils.ConflictError):
+        await services.bets.create_bet(session, bet_create)
+
+    stmt = sa.select(sa.func.count()).where(models.Bet.event_id == event.id)
+    assert await session.scalar(stmt) == 0
+
+
+@pytest.mark.asyncio
+async def test_group_commit_writer(session: AsyncSession, monkeypatch):
+    now = int(time.time())
+    open_id, closed_id = uuid.uuid4(), uuid.uuid4()
+    for event_id, state in (
+        (open_id, schemas.EventState.NEW),
+        (closed_id, schemas.EventState.FINISHED_WIN),
+    ):
+        session.add(
+            models.Event(
+                id=event_id,
+                coefficient=decimal.Decimal("2.50"),
+                deadline=now + 600,
+                state=state,
+            )
+        )
+    await session.commit()
+
+    writer = services.bets.BetWriter(batch_size=10, linger=0.05)
+    writer.start()
+    monkeypatch.setattr(services.bets, "writer", writer)
+    # the endpoint leaves the sessions to the writer
+    monkeypatch.setattr("app.main.async_session", None)
+    written = services.bets.group_commit_latency.count
+    try:
+        results = await asyncio.gather(
+            *(
+                writer.create_bet(
+                    schemas.BetCreate(event_id=event_id, amount=decimal.Decimal("10"))
+                )
+                for event_id in (open_id, closed_id, uuid.uuid4(), open_id)
+            ),
+            return_exceptions=True,
+        )
+        async with AsyncClient(app=app, base_url="http://localhost") as ac:
+            response = await ac.post(
+                "/bet", json={"event_id": str(open_id), "amount": "5.00"}
+            )
+    finally:
+        await writer.stop()
+
+    # one transaction for the group, then one for the request
+    assert services.bets.group_commit_latency.count == written + 2
+    assert isinstance(results[1], utils.ConflictError)
+    assert isinstance(results[2], utils.NotInDB)
+    assert results[0].coefficient == decimal.Decimal("2.50")
+    assert results[0].state == schemas.BetState.WAIT
+    assert response.status_code == 200
+    assert response.json()["amount"] == 5
+
+    stmt = sa.select(models.Bet.id).where(models.Bet.event_id == open_id)
+    saved = set((await session.execute(stmt)).scalars().all())
+    assert saved == {results[0].id, results[3].id, uuid.UUID(response.json()["bet_id"])}
+    exposure = await session.get(models.EventExposure, open_id)
+    assert (exposure.bet_count, exposure.staked) == (3, decimal.Decimal("25.00"))
+
+
+@pytest.mark.asyncio
+async def test_group_commit_writer_survives_errors(session: AsyncSession, monkeypatch):
+    event_id = uuid.uuid4()
+    session.add(
+        models.Event(
+            id=event_id,
+            coefficient=decimal.Decimal("2.50"),
+            deadline=int(time.time()) + 600,
+            state=schemas.EventState.NEW,
+        )
     )
-    bet = await services.bets.create_bet(session, bet_create)
+    await session.commit()
+    collect_batch = services.events.collect_batch
+    calls = []
+
+    async def failing_collect_batch(*args):
+        calls.append(args)
+        if len(calls) == 1:
+            raise RuntimeError("collect failed")
+        return await collect_batch(*args)
+
+    monkeypatch.setattr(services.events, "collect_batch", failing_collect_batch)
+    writer = services.bets.BetWriter(batch_size=10, linger=0.01)
+    writer.start()
+    try:
+        bet = await asyncio.wait_for(
+            writer.create_bet(
+                schemas.BetCreate(event_id=event_id, amount=decimal.Decimal("10"))
+            ),
+            timeout=5,
+        )
+    finally:
+        await writer.stop()
+    assert bet.event_id == event_id
+    assert len(calls) >= 2
+
+
+@pytest.mark.asyncio
+async def test_admission_limit_queues_and_sheds():
+    limit = admission.AdmissionLimit(
+        max_inflight=1, max_queue=1, timeout=0.05, retry_after=1
+    )
+    await limit.acquire()
+    # waits in the queue and gets the released slot
+    waiter = asyncio.create_task(limit.acquire())
+    await asyncio.sleep(0)
+    assert limit.queued == 1
+    # the queue is full
+    with pytest.raises(utils.Overloaded):
+        await limit.acquire()
+    limit.release()
+    await waiter
+    assert (limit.inflight, limit.queued) == (1, 0)
+    # no slot in time
+    with pytest.raises(utils.Overloaded):
+        await limit.acquire()
+    assert limit.queued == 0
+    # a cancelled waiter leaves the queue
+    waiter = asyncio.create_task(limit.acquire())
+    await asyncio.sleep(0)
+    waiter.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiter
+    limit.release()
+    assert (limit.inflight, limit.queued) == (0, 0)
+
+
+def test_client_rate_limit():
+    rate_limit = admission.ClientRateLimit(rate=2, burst=2, max_clients=2)
+    assert rate_limit.take("a", 0) == 0
+    assert rate_limit.take("a", 0) == 0
+    assert rate_limit.take("a", 0) == 0.5
+    # refilled at the rate, up to the burst
+    assert rate_limit.take("a", 0.5) == 0
+    assert rate_limit.take("b", 0.5) == 0
+    # the least recently seen client is forgotten
+    assert rate_limit.take("c", 0.5) == 0
+    assert len(rate_limit) == 2
+    assert rate_limit.take("a", 0.5) == 0
 
-    assert bet.state == schemas.BetState.WAIT
 
-    await services.bets.update_bet_state_by_event(
-        session, event_id, schemas.BetState.WIN
+@pytest.mark.asyncio
+async def test_create_bet_overloaded(session: AsyncSession, monkeypatch):
+    event_id = uuid.uuid4()
+    session.add(
+        models.Event(
+            id=event_id,
+            coefficient=decimal.Decimal("2.50"),
+            deadline=int(time.time()) + 600,
+            state=schemas.EventState.NEW,
+        )
+    )
+    await session.commit()
+    limit = admission.AdmissionLimit(
+        max_inflight=1, max_queue=0, timeout=0.05, retry_after=2
     )
+    monkeypatch.setattr(admission, "limit", limit)
+    rejected = admission.admission_rejected.value
+    body = {"event_id": str(event_id), "amount": "10.00"}
+
+    async with AsyncClient(app=app, base_url="http://localhost") as ac:
+        response = await ac.post("/bet", json=body)
+        assert response.status_code == 200
+        assert limit.inflight == 0
+        await limit.acquire()
+        response = await ac.post("/bet", json=body)
+        assert response.status_code == 503
+        assert response.headers["Retry-After"] == "2"
+        assert admission.admission_rejected.value == rejected + 1
+        limit.release()
+
+        monkeypatch.setattr(
+            admission, "rate_limit", admission.ClientRateLimit(rate=0.5, burst=1)
+        )
+        headers = {"X-Client-Id": "client"}
+        response = await ac.post("/bet", json=body, headers=headers)
+        assert response.status_code == 200
+        response = await ac.post("/bet", json=body, headers=headers)
+        assert response.status_code == 429
+        assert response.headers["Retry-After"] == "2"
+        # other clients have their own buckets
+        response = await ac.post("/bet", json=body)
+        assert response.status_code == 200
+
 
-    stmt = sa.select(models.Bet).where(models.Bet.event_id == event_id).limit(1)
-    bet = (await session.execute(stmt)).scalar()
+@pytest.mark.asyncio
+async def test_group_commit_not_bound_by_inflight_limit(
+    session: AsyncSession, monkeypatch
+):
+    event_id = uuid.uuid4()
+    session.add(
+        models.Event(
+            id=event_id,
+            coefficient=decimal.Decimal("2.50"),
+            deadline=int(time.time()) + 600,
+            state=schemas.EventState.NEW,
+        )
+    )
+    await session.commit()
+    limit = admission.AdmissionLimit(
+        max_inflight=1, max_queue=0, timeout=0.05, retry_after=2
+    )
+    monkeypatch.setattr(admission, "limit", limit)
+    writer = services.bets.BetWriter(batch_size=50, linger=0.05)
+    writer.start()
+    monkeypatch.setattr(services.bets, "writer", writer)
+    written = services.bets.group_commit_latency.count
+    body = {"event_id": str(event_id), "amount": "10.00"}
+    try:
+        async with AsyncClient(app=app, base_url="http://localhost") as ac:
+            responses = await asyncio.gather(
+                *(ac.post("/bet", json=body) for _ in range(20))
+            )
+            # the bets in the writer queue are bounded instead
+            monkeypatch.setattr(admission, "BETS_GROUP_COMMIT_MAX_PENDING", 0)
+            rejected = await ac.post("/bet", json=body)
+    finally:
+        await writer.stop()
+
+    assert [r.status_code for r in responses] == [200] * 20
+    # more bets in a group than requests admitted at a time
+    assert services.bets.group_commit_latency.count == written + 1
+    assert rejected.status_code == 503
+    assert rejected.headers["Retry-After"] == "2"
+
+
+@pytest.mark.asyncio
+async def test_exposure_follows_bets_and_settlement(session: AsyncSession):
+    event_id, quiet_id = uuid.uuid4(), uuid.uuid4()
+    for id_ in (event_id, quiet_id):
+        session.add(
+            models.Event(
+                id=id_,
+                coefficient=decimal.Decimal("1.55"),
+                deadline=int(time.time()) + 600,
+                state=schemas.EventState.NEW,
+            )
+        )
+    await session.commit()
+    services.events.cache.clear()
+
+    await services.bets.create_bet(
+        session, schemas.BetCreate(event_id=event_id, amount=decimal.Decimal("0.03"))
+    )
+    await services.bets.create_bets(
+        session,
+        [
+            schemas.BetCreate(event_id=event_id, amount=decimal.Decimal("10.00"))
+            for _ in range(4)
+        ],
+    )
+    assert await services.exposure.check_exposure(session) == []
+
+    async with AsyncClient(app=app, base_url="http://localhost") as ac:
+        response = await ac.get(f"/events/{event_id}/exposure")
+        assert response.status_code == 200
+        exposure = schemas.Exposure(**response.json())
+        assert exposure.staked == decimal.Decimal("40.03")
+        assert exposure.bet_count == 5
+        # 0.03 * 1.55 = 0.0465 is rounded up like a payout
+        assert exposure.potential_payout == decimal.Decimal("62.05")
+        assert exposure.settled_count == 0
+
+        response = await ac.get(f"/events/{quiet_id}/exposure")
+        assert response.status_code == 200
+        assert response.json()["bet_count"] == 0
+        response = await ac.get(f"/events/{uuid.uuid4()}/exposure")
+        assert response.status_code == 404
+
+    await services.settlement.start_settlements(
+        session, [(event_id, schemas.BetState.WIN)]
+    )
+    await session.commit()
+    await services.bets.settle_bets_chunk(session, event_id, schemas.BetState.WIN, 2)
+    await session.commit()
+    exposure = await services.exposure.get_exposure(session, event_id)
+    assert exposure.settled_count == 2
+    assert await services.exposure.check_exposure(session) == []
+
+    await services.settlement.settle_event(session, event_id, chunk_size=2)
+    exposure = await services.exposure.get_exposure(session, event_id)
+    assert exposure.settled_count == 5
+    assert exposure.paid_out == exposure.potential_payout
+    assert await services.exposure.check_exposure(session) == []
+
+
+@pytest.mark.asyncio
+async def test_bet_partitions_and_archive(session: AsyncSession, tmp_path):
+    partitions = services.partitions
+    now = int(time.time())
+    event_id = uuid.uuid4()
+    session.add(
+        models.Event(
+            id=event_id,
+            coefficient=decimal.Decimal("2.00"),
+            deadline=now + 600,
+            state=schemas.EventState.NEW,
+        )
+    )
+    # settled bets five months ago, one unsettled four months ago and a new one
+    rows = [
+        (partitions.month_start(now, -5) + 10, schemas.BetState.WIN),
+        (partitions.month_start(now, -5) + 20, schemas.BetState.LOSE),
+        (partitions.month_start(now, -4) + 10, schemas.BetState.WAIT),
+        (now, schemas.BetState.WAIT),
+    ]
+    await session.execute(
+        sa.insert(models.Bet),
+        [
+            {
+                "id": uuid.uuid4(),
+                "event_id": event_id,
+                "amount": decimal.Decimal("10.00"),
+                "coefficient": decimal.Decimal("2.00"),
+                "created_at": created_at,
+                "state": state,
+                "payout": None if state == schemas.BetState.WAIT else 0,
+            }
+            for created_at, state in rows
+        ],
+    )
+    await session.commit()
+
+    # the rows of the default partition are moved to the new ones
+    created = await partitions.create_partitions(
+        partitions.month_start(now, -5), ahead=7
+    )
+    assert len(created) == 8
+    assert await partitions.create_partitions(now) == []
+    default = await session.scalar(sa.text("SELECT count(*) FROM bet_default"))
+    assert default == 0
+
+    stmt = sa.select(*services.bets.BET_COLUMNS).where(
+        models.Bet.created_at < partitions.month_start(now, -4)
+    )
+    settled = (await session.execute(stmt)).all()
+    await session.commit()
+    archived = await partitions.archive_partitions(now, str(tmp_path), after_months=3)
+    # the partition with an unsettled bet stays
+    assert archived == [created[0]]
+
+    with gzip.open(tmp_path / f"{created[0]}.ndjson.gz", "rt") as f:
+        lines = f.read().splitlines()
+    assert sorted(lines) == sorted(services.render.bet_json(row) for row in settled)
+    async with app_engine.connect() as conn:
+        names = [p.name for p in await partitions.get_partitions(conn)]
+    assert names == created[1:]
+    assert await session.scalar(sa.select(sa.func.count()).select_from(models.Bet)) == 2
+
+
+@pytest.mark.asyncio
+async def test_bet_partition_ddl_does_not_wait_for_locks(
+    session: AsyncSession, monkeypatch
+):
+    partitions = services.partitions
+    monkeypatch.setattr(partitions, "LOCK_TIMEOUT", "100ms")
+    now = int(time.time())
+    # a long transaction reading bets of the default partition
+    await session.execute(sa.text("SELECT count(*) FROM bet_default"))
+    started = time.perf_counter()
+    with pytest.raises(sa.exc.DBAPIError, match="lock timeout"):
+        await partitions.create_partitions(now, ahead=0)
+    assert time.perf_counter() - started < 5
+    await session.rollback()
+    assert await partitions.create_partitions(now, ahead=0) == [
+        partitions.partition_name(partitions.month_start(now))
+    ]
+
+
+def test_render_as_schemas():
+    event = schemas.Event(
+        id=uuid.uuid4(), coefficient="1.20", deadline=100, state=1, version=7
+    )
+    assert json.loads(services.render.events_json([event])) == jsonable_encoder(
+        [event], by_alias=True
+    )
+    bets = [
+        schemas.Bet(
+            event_id=event.id,
+            amount=amount,
+            id=uuid.uuid4(),
+            state=state,
+            coefficient=event.coefficient,
+            created_at=100,
+            payout=payout,
+        )
+        for amount, state, payout in [
+            ("10.50", schemas.BetState.WAIT, None),
+            ("3.00", schemas.BetState.WIN, "3.60"),
+            ("0.01", schemas.BetState.LOSE, "0.00"),
+        ]
+    ]
+    rows = [
+        (b.event_id, b.amount, b.id, b.state, b.coefficient, b.created_at, b.payout)
+        for b in bets
+    ]
+    assert json.loads(services.render.bets_json(rows)) == jsonable_encoder(
+        bets, by_alias=True
+    )
+
+
+@pytest.mark.asyncio
+async def test_get_bets_keyset_pages(session: AsyncSession):
+    event_ids = [uuid.uuid4(), uuid.uuid4()]
+    for event_id in event_ids:
+        session.add(
+            models.Event(
+                id=event_id,
+                coefficient=decimal.Decimal("1.50"),
+                deadline=int(time.time()) + 600,
+                state=schemas.EventState.NEW,
+            )
+        )
+    await session.commit()
+    for created_at in range(100, 106):
+        session.add(
+            models.Bet(
+                event_id=event_ids[created_at % 2],
+                amount=decimal.Decimal("1.00"),
+                coefficient=decimal.Decimal("1.50"),
+                created_at=created_at,
+                state=schemas.BetState.WAIT,
+            )
+        )
+    await session.commit()
+
+    pages = []
+    params = {"limit": 4, "created_from": 101}
+    async with AsyncClient(app=app, base_url="http://localhost") as ac:
+        while True:
+            response = await ac.get("/bets", params=params)
+            assert response.status_code == 200
+            pages.append([bet["created_at"] for bet in response.json()])
+            if "X-Next-Cursor" not in response.headers:
+                break
+            params["cursor"] = response.headers["X-Next-Cursor"]
+
+        assert pages == [[101, 102, 103, 104], [105]]
+
+        response = await ac.get("/bets", params={"event_id": str(event_ids[0])})
+        assert [bet["created_at"] for bet in response.json()] == [100, 102, 104]
+
+        response = await ac.get("/bets", params={"cursor": "broken"})
+        assert response.status_code == 400
+        response = await ac.get("/bets", params={"limit": 100_000})
+        assert response.status_code == 422
+
+
+class FakeMessage:
+    def __init__(self, event: schemas.Event, content_type=wire.JSON_CONTENT_TYPE):
+        self.content_type = content_type
+        self.body = wire.encode_json(event)
+        if content_type == wire.BINARY_CONTENT_TYPE:
+            self.body = wire.encode_binary(event)
+        self.timestamp = datetime.datetime.now(datetime.timezone.utc)
+        self.acked = asyncio.Event()
+        self.rejected = False
+        self.requeued = False
+
+    async def ack(self):
+        self.acked.set()
+
+    async def reject(self, requeue: bool = False):
+        self.rejected = True
+        self.acked.set()
+
+    async def nack(self, requeue: bool = True):
+        self.requeued = requeue
+        self.acked.set()
+
+
+@pytest.mark.asyncio
+async def test_events_consumer_keeps_order_per_event(
+    session: AsyncSession, monkeypatch
+):
+    services.events.cache.clear()
+    # closing events schedules settlement, not needed here
+    monkeypatch.setattr(services.settlement, "schedule", lambda event_id: None)
+    deadline = int(time.time()) + 600
+    event_ids = [uuid.uuid4() for _ in range(4)]
+    messages = [
+        FakeMessage(
+            schemas.Event(
+                id=event_id, coefficient=f"1.{i:02}", deadline=deadline, state=1
+            )
+        )
+        for i in range(1, 20)
+        for event_id in event_ids
+    ]
+    messages.append(
+        FakeMessage(
+            schemas.Event(
+                id=event_ids[0], coefficient="9.99", deadline=deadline, state=3
+            )
+        )
+    )
+    messages.append(
+        FakeMessage(
+            schemas.Event(
+                id=event_ids[0], coefficient="1.01", deadline=deadline, state=1
+            )
+        )
+    )
+
+    consumer = services.events.EventsConsumer(workers=2, batch_size=5, linger=0.01)
+    consumer.start()
+    for message in messages:
+        await consumer.on_message(message)
+    await asyncio.wait_for(asyncio.gather(*(m.acked.wait() for m in messages)), 10)
+    await consumer.stop()
+
+    assert not any(m.rejected for m in messages[:-1])
+    stmt = sa.select(models.Event.id, models.Event.coefficient, models.Event.state)
+    rows = {row.id: row for row in await session.execute(stmt)}
+    # the update after closing is dropped
+    assert rows[event_ids[0]].state == schemas.EventState.FINISHED_LOSE
+    assert rows[event_ids[0]].coefficient == decimal.Decimal("9.99")
+    for event_id in event_ids[1:]:
+        assert rows[event_id].coefficient == decimal.Decimal("1.19")
+
+
+@pytest.mark.asyncio
+async def test_failed_events_requeued_unless_bad_data(monkeypatch):
+    events = [
+        schemas.Event(
+            id=uuid.uuid4(), coefficient="1.50", deadline=int(time.time()), state=1
+        )
+        for _ in range(3)
+    ]
+    errors = {
+        events[0].id: OSError("connection refused"),
+        events[1].id: sa.exc.DataError("INSERT", {}, Exception("out of range")),
+    }
+
+    async def apply_events(db, batch):
+        raise OSError("connection refused")
+
+    async def handle_event(event):
+        if event.id in errors:
+            raise errors[event.id]
+
+    monkeypatch.setattr(services.events, "apply_events", apply_events)
+    monkeypatch.setattr(services.events, "handle_event", handle_event)
+    monkeypatch.setattr(services.events, "EVENTS_RETRY_DELAY_MS", 0)
+    messages = [FakeMessage(event) for event in events]
+    await services.events.handle_messages(list(zip(messages, events)))
+
+    # the DB may come back, bad data won't
+    assert messages[0].requeued and not messages[0].rejected
+    assert messages[1].rejected and not messages[1].requeued
+    assert not messages[2].rejected and not messages[2].requeued
+
+
+class ClosedChannelMessage(FakeMessage):
+    async def ack(self):
+        raise aio_pika.exceptions.ChannelInvalidStateError("channel closed")
+
+
+@pytest.mark.asyncio
+async def test_events_consumer_survives_failed_ack(session: AsyncSession):
+    deadline = int(time.time()) + 600
+    broken, message = [
+        cls(
+            schemas.Event(
+                id=uuid.uuid4(), coefficient="1.50", deadline=deadline, state=1
+            )
+        )
+        for cls in (ClosedChannelMessage, FakeMessage)
+    ]
+    consumer = services.events.EventsConsumer(workers=1, batch_size=1, linger=0)
+    consumer.start()
+    await consumer.on_message(broken)
+    await consumer.on_message(message)
+    # the worker is still alive after the failed ack
+    await asyncio.wait_for(message.acked.wait(), 10)
+    await consumer.stop()
+    assert not message.rejected
+
+
+@pytest.mark.asyncio
+async def test_metrics(session: AsyncSession):
+    consumed = services.events.events_consumed.value
+    failed = services.events.events_failed.value
+    event = schemas.Event(
+        id=uuid.uuid4(), coefficient="1.05", deadline=int(time.time()) + 600, state=1
+    )
+    broken = FakeMessage(event)
+    broken.body = b"not an event"
+
+    messages = [FakeMessage(event), broken]
+    consumer = services.events.EventsConsumer(workers=1, batch_size=5, linger=0.01)
+    consumer.start()
+    for message in messages:
+        await consumer.on_message(message)
+    await asyncio.wait_for(asyncio.gather(*(m.acked.wait() for m in messages)), 10)
+    await consumer.stop()
+
+    assert services.events.events_consumed.value == consumed + 1
+    assert services.events.events_failed.value == failed + 1
+    async with AsyncClient(app=app, base_url="http://localhost") as ac:
+        await ac.get(f"/events/{uuid.uuid4()}/settlement")
+        response = await ac.get("/metrics")
+    assert response.status_code == 200
+    assert "db_pool_checked_out 0" in response.text
+    assert (
+        'http_request_duration_seconds_count{method="GET",'
+        'route="/events/{event_id}/settlement",status="404"} 1' in response.text
+    )
+
+
+async def read_bind():
+    sessions = db_session.get_read_session()
+    db = await anext(sessions)
+    bind = db.sync_session.get_bind()
+    await sessions.aclose()
+    return bind
+
+
+@pytest.mark.asyncio
+async def test_read_session_routing(session: AsyncSession, monkeypatch):
+    replica = db_session.Replica(create_async_engine(DATABASE_URL), max_lag=1)
+    monkeypatch.setattr(db_session, "replica", replica)
+    try:
+        # the lag is not known yet
+        assert await read_bind() is app_engine.sync_engine
+        # not a standby, nothing to replay
+        assert await replica.check() == 0
+        assert await read_bind() is replica.engine.sync_engine
+        async with AsyncClient(app=app, base_url="http://localhost") as ac:
+            response = await ac.get("/bets")
+        assert response.status_code == 200
+        assert replica.engine.pool.checkedin() == 1
+
+        replica.lag = 5
+        assert await read_bind() is app_engine.sync_engine
+        # writes go to the primary
+        async with db_session.async_session() as db:
+            assert db.sync_session.get_bind() is app_engine.sync_engine
+    finally:
+        await replica.engine.dispose()
+
+    unreachable = db_session.Replica(
+        create_async_engine("postgresql+asyncpg://postgres@127.0.0.1:1/postgres"), 1
+    )
+    assert await unreachable.check() is None
+    assert not unreachable.usable
+
+
+@pytest.mark.parametrize(
+    "content_type", [None, wire.JSON_CONTENT_TYPE, wire.BINARY_CONTENT_TYPE]
+)
+def test_parse_event_by_content_type(content_type):
+    event = schemas.Event(
+        id=uuid.uuid4(),
+        coefficient="1.05",
+        deadline=int(time.time()),
+        state=2,
+        version=42,
+    )
+    if content_type == wire.BINARY_CONTENT_TYPE:
+        data = wire.encode_binary(event)
+    else:
+        data = wire.encode_json(event)
+
+    assert services.events.parse_event(data, content_type) == event
+
+
+def test_parse_binary_v1_event():
+    event_id = uuid.uuid4()
+    data = wire._binary_v1.pack(wire.BINARY_V1, event_id.bytes, 105, 1700000000, 2)
+    event = wire.decode_binary(data)
+    assert (event.id, event.coefficient, event.version) == (
+        event_id,
+        decimal.Decimal("1.05"),
+        0,
+    )
+
+
+class FakeLineProvider:
+    "GET /events/changes of line-provider over a list of changes"
+
+    def __init__(self):
+        self.changes: list[dict] = []
+        self.requested: list[int] = []
+
+    def change(self, event_id: uuid.UUID, coefficient: float, state: int = 1):
+        seq = len(self.changes) + 1
+        self.changes.append(
+            {
+                "event_id": str(event_id),
+                "coefficient": coefficient,
+                "deadline": int(time.time()) + 600,
+                "state": state,
+                "seq": seq,
+            }
+        )
+
+    def handle(self, request: httpx.Request) -> httpx.Response:
+        since = int(request.url.params["since"])
+        limit = int(request.url.params["limit"])
+        self.requested.append(since)
+        latest = {}
+        for change in self.changes:
+            latest[change["event_id"]] = change
+        page = sorted(latest.values(), key=lambda c: c["seq"])
+        page = [c for c in page if c["seq"] > since][:limit]
+        return httpx.Response(
+            200,
+            content="".join(json.dumps(c) + "\n" for c in page),
+            headers={"X-Head-Seq": str(len(self.changes))},
+        )
+
+
+@pytest.mark.asyncio
+async def test_sync_events_catches_up_by_seq(session: AsyncSession):
+    line_provider = FakeLineProvider()
+    first, second, third = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+    line_provider.change(first, 1.1)
+    line_provider.change(second, 1.2)
+    line_provider.change(first, 1.3)
+    line_provider.change(third, 1.4)
+    client = httpx.AsyncClient(
+        transport=httpx.MockTransport(line_provider.handle), base_url="http://lp"
+    )
+
+    assert await services.sync.sync_events(client, page_size=2) == 3
+    assert line_provider.requested == [0, 3]
+    event = await session.get(models.Event, first)
+    assert event.coefficient == decimal.Decimal("1.30")
+
+    # only the delta is loaded on the next start
+    line_provider.change(second, 2.0, state=2)
+    line_provider.requested.clear()
+    assert await services.sync.sync_events(client, page_size=2) == 1
+    assert line_provider.requested == [4]
+    await session.refresh(await session.get(models.Event, second))
+    assert (await session.get(models.Event, second)).state == (
+        schemas.EventState.FINISHED_WIN
+    )
 
-    assert bet.state == schemas.BetState.WIN
+    # line-provider started from scratch, everything is loaded again
+    line_provider.changes = line_provider.changes[:1]
+    line_provider.requested.clear()
+    assert await services.sync.sync_events(client, page_size=2) == 1
+    assert line_provider.requested == [5, 0]
+    assert await services.sync.get_last_seq(session) == 1
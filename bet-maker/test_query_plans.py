@@ -0,0 +1,243 @@
+"""
+Query plan regression suite: runs the hot service queries against a seeded
+dataset, then EXPLAINs the exact SQL they sent and checks that the expected
+index is used and the big tables are never scanned sequentially.
+"""
+
+import contextlib
+import json
+import time
+import uuid
+
+import pytest
+import pytest_asyncio
+import sqlalchemy as sa
+from sqlalchemy import event as sa_event
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db import models
+from app.db.session import Base, engine as app_engine
+from app import schemas, services
+
+EVENTS = 5_000
+BETS = 200_000
+
+
+@pytest_asyncio.fixture(scope="module")
+async def dataset(engine):
+    now = int(time.time())
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    # monthly partitions over the bets and a couple of older ones
+    start = services.partitions.month_start(now - BETS, -2)
+    await services.partitions.create_partitions(start, ahead=4)
+    async with engine.begin() as conn:
+        # every tenth event is open, deadlines are spread around now
+        await conn.execute(
+            sa.text("""
+                INSERT INTO event (id, coefficient, deadline, state)
+                SELECT gen_random_uuid(), 1.5, :now - 50000 + i * 20,
+                       (CASE WHEN i % 10 = 0 THEN 'NEW' ELSE 'FINISHED_WIN' END)::eventstate
+                FROM generate_series(1, :events) AS i
+                """),
+            {"now": now, "events": EVENTS},
+        )
+        # bets in creation order, most of them already settled
+        await conn.execute(
+            sa.text("""
+                INSERT INTO bet (id, event_id, amount, coefficient, created_at, state)
+                SELECT gen_random_uuid(), e.id, 10, 1.5, :now - :bets + i,
+                       (CASE WHEN i % 20 = 0 THEN 'WAIT' ELSE 'WIN' END)::betstate
+                FROM generate_series(1, :bets) AS i
+                JOIN (
+                    SELECT id, row_number() OVER (ORDER BY id) - 1 AS n FROM event
+                ) AS e ON e.n = i % :events
+                """),
+            {"now": now, "bets": BETS, "events": EVENTS},
+        )
+        await conn.execute(
+            sa.insert(models.EventExposure).from_select(
+                [
+                    "event_id",
+                    "staked",
+                    "bet_count",
+                    "potential_payout",
+                    "settled_count",
+                    "paid_out",
+                ],
+                services.exposure.recompute_query(),
+            )
+        )
+        await conn.execute(sa.text("ANALYZE event"))
+        await conn.execute(sa.text("ANALYZE bet"))
+        await conn.execute(sa.text("ANALYZE event_exposure"))
+        event_id = (
+            await conn.execute(sa.text("SELECT event_id FROM bet LIMIT 1"))
+        ).scalar()
+    yield {"now": now, "event_id": event_id}
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+    await app_engine.dispose()
+
+
+@contextlib.contextmanager
+def captured_statements(engine):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, many):
+        statements.append((statement, parameters))
+
+    sa_event.listen(engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        sa_event.remove(
+            engine.sync_engine, "before_cursor_execute", before_cursor_execute
+        )
+
+
+async def partition_parents(engine) -> tuple[dict[str, str], set[str]]:
+    """
+    Partitions and their indexes to the partitioned table or index, and the
+    empty partitions: scanning them sequentially is the right plan
+    """
+    async with engine.connect() as conn:
+        result = await conn.execute(sa.text("""
+                SELECT c.relname, p.relname, c.relkind = 'r' AND c.reltuples = 0
+                FROM pg_inherits AS i
+                JOIN pg_class AS c ON c.oid = i.inhrelid
+                JOIN pg_class AS p ON p.oid = i.inhparent
+                """))
+        rows = result.all()
+    return {name: parent for name, parent, _ in rows}, {
+        name for name, _, empty in rows if empty
+    }
+
+
+def plan_nodes(plan: dict):
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from plan_nodes(child)
+
+
+async def explain(engine, statement: str, parameters) -> list[dict]:
+    async with engine.connect() as conn:
+        result = await conn.exec_driver_sql(
+            "EXPLAIN (FORMAT JSON) " + statement, parameters
+        )
+        plan = result.scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return list(plan_nodes(plan[0]["Plan"]))
+
+
+HOT_QUERIES = {
+    "active_events": (
+        lambda db, data: services.events.get_active_events(db),
+        "ix_event_open_deadline",
+    ),
+    "events_by_ids": (
+        lambda db, data: services.events.get_cached_events(
+            db, {data["event_id"], uuid.uuid4()}
+        ),
+        "event_pkey",
+    ),
+    "insert_bets": (
+        lambda db, data: services.bets.insert_bets(
+            db,
+            [
+                (
+                    uuid.uuid4(),
+                    schemas.BetCreate(event_id=data["event_id"], amount="10.00"),
+                )
+            ],
+            data["now"],
+        ),
+        "event_pkey",
+    ),
+    "event_exposure": (
+        lambda db, data: services.exposure.get_exposure(db, data["event_id"]),
+        "event_exposure_pkey",
+    ),
+    "bets_first_page": (
+        lambda db, data: services.bets.get_bets(db, 100),
+        "ix_bet_created_at_id",
+    ),
+    "bets_next_page": (
+        lambda db, data: services.bets.get_bets(
+            db, 100, after=(data["now"] - BETS // 2, uuid.uuid4())
+        ),
+        "ix_bet_created_at_id",
+    ),
+    "bets_by_event": (
+        lambda db, data: services.bets.get_bets(db, 100, event_id=data["event_id"]),
+        "ix_bet_event_id_created_at_id",
+    ),
+    "bets_by_created_range": (
+        lambda db, data: services.bets.get_bets(
+            db, 100, created_from=data["now"] - 1000, created_to=data["now"]
+        ),
+        "ix_bet_created_at_id",
+    ),
+    "settle_bets_chunk": (
+        lambda db, data: services.bets.settle_bets_chunk(
+            db, data["event_id"], schemas.BetState.WIN, 1000
+        ),
+        "ix_bet_event_id_wait",
+    ),
+}
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("name", HOT_QUERIES)
+async def test_hot_query_uses_index(engine, dataset, name):
+    query, index_name = HOT_QUERIES[name]
+    services.events.cache.clear()
+
+    with captured_statements(engine) as statements:
+        async with AsyncSession(engine) as db:
+            # changes are rolled back on close
+            await query(db, dataset)
+    assert statements
+
+    # plans name the partitions of bet and their indexes
+    parents, empty = await partition_parents(engine)
+    for statement, parameters in statements:
+        nodes = await explain(engine, statement, parameters)
+        seq_scans = [
+            node["Relation Name"]
+            for node in nodes
+            if node["Node Type"] == "Seq Scan"
+            and node["Relation Name"] not in empty
+            and parents.get(node["Relation Name"], node["Relation Name"])
+            in ("event", "bet")
+        ]
+        assert not seq_scans, f"{name}: seq scan on {seq_scans}\n{statement}"
+        assert index_name in {
+            parents.get(node.get("Index Name"), node.get("Index Name"))
+            for node in nodes
+        }, f"{name}: {index_name} is not used\n{statement}"
+
+
+@pytest.mark.asyncio
+async def test_bets_queries_skip_old_partitions(engine, dataset):
+    now = dataset["now"]
+    async with engine.connect() as conn:
+        partitions = await services.partitions.get_partitions(conn)
+    old = {p.name for p in partitions if p.end <= now - 1000}
+    assert old
+
+    for kwargs in (
+        {"created_from": now - 1000, "created_to": now},
+        {"after": (now - 1000, uuid.uuid4())},
+    ):
+        with captured_statements(engine) as statements:
+            async with AsyncSession(engine) as db:
+                await services.bets.get_bets(db, 100, **kwargs)
+        [(statement, parameters)] = statements
+        scanned = {
+            node["Relation Name"]
+            for node in await explain(engine, statement, parameters)
+            if "Relation Name" in node
+        }
+        assert scanned and not scanned & old, f"{kwargs}: {scanned}"
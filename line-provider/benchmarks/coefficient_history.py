@@ -0,0 +1,105 @@
+"""
+Coefficient history: ingest rate in memory and with the file, memory per
+change vs lists of (time, cents) tuples, load time on restart, latency of
+point-in-time and range lookups.
+
+    python -m benchmarks.coefficient_history --events 100000 --changes 20
+"""
+
+import argparse
+import gc
+import random
+import tempfile
+import time
+import timeit
+import tracemalloc
+import uuid
+
+from coefficient_history import CoefficientHistory
+
+
+def changes(ids: list[uuid.UUID], count: int, start: float):
+    # a change of an event every 10 ms, every change of an event is a
+    # different coefficient
+    for i in range(len(ids) * count):
+        cents = 100 + i % 400 + i // len(ids) % 2 * 7
+        yield ids[i % len(ids)], cents, start + i * 0.01
+
+
+def build_lists(ids, count, start) -> dict:
+    series = {}
+    for event_id, cents, at in changes(ids, count, start):
+        series.setdefault(event_id, []).append((int(at * 1000), cents))
+    return series
+
+
+def build_history(ids, count, start, path=None) -> CoefficientHistory:
+    history = CoefficientHistory(path)
+    if path is not None:
+        history.open()
+    add = history.add
+    for event_id, cents, at in changes(ids, count, start):
+        add(event_id, cents, at)
+    history.close()
+    return history
+
+
+def measure(build, *args):
+    gc.collect()
+    tracemalloc.start()
+    container = build(*args)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return container, size
+
+
+def main(count: int, per_event: int, lookups: int):
+    ids = [uuid.uuid4() for _ in range(count)]
+    points = count * per_event
+    start = time.time() - points * 0.01
+    end = start + points * 0.01
+
+    _, lists_size = measure(build_lists, ids, per_event, start)
+    history, history_size = measure(build_history, ids, per_event, start)
+    print(f"lists    {lists_size / points:6.1f} bytes per change")
+    print(f"history  {history_size / points:6.1f} bytes per change")
+
+    started = time.perf_counter()
+    build_history(ids, per_event, start)
+    elapsed = time.perf_counter() - started
+    print(f"ingest   {points / elapsed:10.0f} changes/s in memory")
+    path = tempfile.mkdtemp(prefix="coefficient-history-") + "/history.bin"
+    started = time.perf_counter()
+    build_history(ids, per_event, start, path)
+    elapsed = time.perf_counter() - started
+    print(f"ingest   {points / elapsed:10.0f} changes/s with the file")
+    started = time.perf_counter()
+    loaded = CoefficientHistory(path)
+    loaded.open()
+    elapsed = time.perf_counter() - started
+    loaded.close()
+    print(f"load     {elapsed:10.2f} s for {loaded.points} changes")
+
+    sample = [(random.choice(ids), random.uniform(start, end)) for _ in range(lookups)]
+    for name, func in (
+        ("at", lambda: [history.at(event_id, at) for event_id, at in sample]),
+        (
+            "between",
+            # an hour after a random time
+            lambda: [
+                history.between(event_id, at, at + 3600, 1000)
+                for event_id, at in sample
+            ],
+        ),
+    ):
+        best = min(timeit.repeat(func, number=1, repeat=5))
+        print(f"{name:<8} {best / len(sample) * 1e9:10.0f} ns per lookup")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", type=int, default=100_000)
+    parser.add_argument("--changes", type=int, default=20, help="per event")
+    parser.add_argument("--lookups", type=int, default=100_000)
+    args = parser.parse_args()
+    main(args.events, args.changes, args.lookups)
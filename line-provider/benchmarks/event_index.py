@@ -0,0 +1,64 @@
+"""
+GET /events: full scan of the events dict vs. OpenEventIndex.
+
+    python -m benchmarks.event_index --historical 1000000 --open 10000
+"""
+import argparse
+import time
+import timeit
+import uuid
+
+from app import Event, EventState
+from event_index import OpenEventIndex
+
+
+def build(historical: int, open_count: int):
+    now = int(time.time())
+    events: dict[uuid.UUID, Event] = {}
+    index = OpenEventIndex()
+    for i in range(historical + open_count):
+        is_open = i >= historical
+        event = Event.construct(
+            event_id=uuid.uuid4(),
+            coefficient=1,
+            # half of the history is closed, the other half has expired
+            deadline=now + 3600 if is_open or i % 2 else now - 3600,
+            state=EventState.NEW if is_open or i % 2 == 0 else EventState.FINISHED_WIN,
+        )
+        events[event.event_id] = event
+        index.update(event.event_id, event.deadline, event.state == EventState.NEW)
+    return events, index
+
+
+def scan(events):
+    return [
+        e
+        for e in events.values()
+        if time.time() < e.deadline and e.state == EventState.NEW
+    ]
+
+
+def indexed(events, index):
+    return [events[event_id] for event_id in index.active(time.time())]
+
+
+def main(historical: int, open_count: int, repeat: int):
+    events, index = build(historical, open_count)
+    # first call prunes the expired history once
+    assert len(indexed(events, index)) == len(scan(events)) == open_count
+
+    for name, func in (
+        ("scan", lambda: scan(events)),
+        ("index", lambda: indexed(events, index)),
+    ):
+        best = min(timeit.repeat(func, number=1, repeat=repeat))
+        print(f"{name:<6} {best * 1000:9.2f} ms per GET /events")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--historical", type=int, default=1_000_000)
+    parser.add_argument("--open", type=int, default=10_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    main(args.historical, args.open, args.repeat)
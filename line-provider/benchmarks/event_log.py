@@ -0,0 +1,59 @@
+"""
+Restart time of line-provider: replaying the whole write-ahead log vs.
+loading a snapshot.
+
+    python -m benchmarks.event_log --events 1000000 --updates 1000000
+"""
+
+import argparse
+import asyncio
+import random
+import tempfile
+import time
+import uuid
+
+from event_log import EventLog
+from event_store import EventStore, STATE_NEW
+
+
+def recover(directory: str) -> tuple[float, EventStore]:
+    store = EventStore()
+    started = time.perf_counter()
+    EventLog(directory).recover(store)
+    return time.perf_counter() - started, store
+
+
+async def main(count: int, updates: int):
+    deadline = int(time.time()) + 3600
+    with tempfile.TemporaryDirectory() as directory:
+        store = EventStore()
+        log = EventLog(directory, snapshot_every=count + updates + 1)
+        log.open(store)
+        ids = [uuid.uuid4() for _ in range(count)]
+        started = time.perf_counter()
+        for event_id in ids:
+            log.append(store.put(event_id, 150, deadline, STATE_NEW))
+        for event_id in random.choices(ids, k=updates):
+            log.append(store.put(event_id, random.randint(101, 999), deadline, 1))
+        elapsed = time.perf_counter() - started
+        writes = count + updates
+        print(f"append       {elapsed / writes * 1e6:6.2f} us per write")
+
+        elapsed, recovered = recover(directory)
+        assert len(recovered) == count and recovered.seq == writes
+        print(f"log replay   {elapsed:6.2f} s for {writes} writes")
+
+        started = time.perf_counter()
+        await log.snapshot()
+        print(f"snapshot     {time.perf_counter() - started:6.2f} s to write")
+        elapsed, recovered = recover(directory)
+        assert len(recovered) == count and recovered.seq == writes
+        print(f"snapshot     {elapsed:6.2f} s to load {count} events")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", type=int, default=1_000_000)
+    parser.add_argument("--updates", type=int, default=1_000_000)
+    args = parser.parse_args()
+    asyncio.run(main(args.events, args.updates))
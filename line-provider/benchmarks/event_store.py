@@ -0,0 +1,72 @@
+"""
+Memory per event and lookup latency: dict of pydantic Event vs EventStore.
+
+    python -m benchmarks.event_store --events 1000000
+"""
+
+import argparse
+import decimal
+import gc
+import random
+import time
+import timeit
+import tracemalloc
+import uuid
+
+from app import Event, EventState, to_event
+from event_store import EventStore
+
+
+def build_dict(ids: list[uuid.UUID], deadline: int) -> dict:
+    return {
+        event_id: Event(
+            event_id=event_id,
+            coefficient=decimal.Decimal(100 + i % 900).scaleb(-2),
+            deadline=deadline,
+            state=EventState.NEW,
+        )
+        for i, event_id in enumerate(ids)
+    }
+
+
+def build_store(ids: list[uuid.UUID], deadline: int) -> EventStore:
+    store = EventStore()
+    for i, event_id in enumerate(ids):
+        store.put(event_id, 100 + i % 900, deadline, EventState.NEW.value)
+    return store
+
+
+def measure(build, ids, deadline):
+    gc.collect()
+    tracemalloc.start()
+    container = build(ids, deadline)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return container, size
+
+
+def main(count: int, lookups: int):
+    deadline = int(time.time()) + 3600
+    # ids are allocated up front, both layouts share them
+    ids = [uuid.uuid4() for _ in range(count)]
+    events, dict_size = measure(build_dict, ids, deadline)
+    store, store_size = measure(build_store, ids, deadline)
+    print(f"dict   {dict_size / count:7.1f} bytes per event")
+    print(f"store  {store_size / count:7.1f} bytes per event")
+
+    sample = random.sample(ids, min(lookups, count))
+    for name, func in (
+        ("dict", lambda: [events[event_id] for event_id in sample]),
+        ("store", lambda: [store.get(event_id) for event_id in sample]),
+        ("store+model", lambda: [to_event(store.get(event_id)) for event_id in sample]),
+    ):
+        best = min(timeit.repeat(func, number=1, repeat=5))
+        print(f"{name:<12} {best / len(sample) * 1e9:7.0f} ns per lookup")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", type=int, default=1_000_000)
+    parser.add_argument("--lookups", type=int, default=100_000)
+    args = parser.parse_args()
+    main(args.events, args.lookups)
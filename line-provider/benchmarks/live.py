@@ -0,0 +1,227 @@
+"""
+GET /events/live with thousands of connected clients: time to connect and
+get the snapshot, cost of a write with the fan-out, delivery latency from
+the write to the client, and dropping of clients that don't read.
+
+The server (uvicorn, without lifespan - no RabbitMQ needed) runs in this
+process, the clients in worker processes of up to 1000 connections each:
+    python -m benchmarks.live --clients 5000 --slow 50 --events 1000 --writes 300 --rate 10
+"""
+
+import argparse
+import array
+import asyncio
+import multiprocessing
+import os
+import random
+import re
+import socket
+import tempfile
+import time
+import uuid
+
+os.environ.setdefault("EVENTS_DATA_DIR", tempfile.mkdtemp(prefix="line-provider-"))
+
+import uvicorn
+
+import app
+
+CLIENTS_PER_WORKER = 1000
+
+
+def rss_mb() -> float:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def percentile(values: list[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] * 1000
+
+
+class Client(asyncio.Protocol):
+    "Records the seq and the arrival time of frames without parsing them"
+
+    # chunked transfer encoding around the frames, only the ids are of interest
+    ids = re.compile(rb"\nid: (\d+)\n")
+
+    def __init__(self, seqs: array.array, times: array.array):
+        self.seqs = seqs
+        self.times = times
+        self.tail = b""
+
+    def connection_made(self, transport):
+        transport.write(b"GET /events/live HTTP/1.1\r\nHost: localhost\r\n\r\n")
+
+    def data_received(self, data: bytes):
+        data = self.tail + data
+        # wall clock, compared with the write time in another process
+        now = time.time()
+        for match in self.ids.finditer(data):
+            self.seqs.append(int(match[1]))
+            self.times.append(now)
+        # an id may be split between reads
+        self.tail = data[data.rfind(b"\n") :]
+
+
+async def connect(port: int, protocol, slow: bool = False):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    if slow:
+        # a client on a bad network: the server can't push much into it
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    sock.setblocking(False)
+    loop = asyncio.get_running_loop()
+    await loop.sock_connect(sock, ("127.0.0.1", port))
+    transport, _ = await loop.create_connection(protocol, sock=sock)
+    if slow:
+        # never reads after the request
+        transport.pause_reading()
+    return transport
+
+
+async def run_clients(port: int, count: int, slow: int, conn) -> None:
+    seqs, times = array.array("q"), array.array("d")
+    semaphore = asyncio.Semaphore(200)
+
+    async def connect_one(slow=False):
+        async with semaphore:
+            return await connect(port, lambda: Client(seqs, times), slow)
+
+    transports = await asyncio.gather(*(connect_one() for _ in range(count)))
+    transports += await asyncio.gather(*(connect_one(slow=True) for _ in range(slow)))
+    # wait for the end of the run
+    await asyncio.get_running_loop().run_in_executor(None, conn.recv)
+    conn.send((seqs.tobytes(), times.tobytes()))
+    for transport in transports:
+        transport.close()
+
+
+def clients_worker(port: int, count: int, slow: int, conn) -> None:
+    asyncio.run(run_clients(port, count, slow, conn))
+
+
+async def main(
+    clients: int, slow: int, count: int, writes: int, rate: int, buffer: int
+):
+    loop = asyncio.get_running_loop()
+    app.live.buffer_size = buffer
+    deadline = int(time.time()) + 3600
+    ids = [uuid.uuid4() for _ in range(count)]
+    for event_id in ids:
+        app.write_event(event_id, 150, deadline, 1)
+
+    server = uvicorn.Server(
+        uvicorn.Config(
+            app.app,
+            host="127.0.0.1",
+            port=0,
+            lifespan="off",
+            log_level="warning",
+            backlog=clients + slow,
+        )
+    )
+    serving = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+    listener = server.servers[0].sockets[0]
+    port = listener.getsockname()[1]
+    # accepted sockets inherit it: a client that doesn't read fills the
+    # send buffer in kilobytes, not in megabytes of loopback autotuning
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 16384)
+
+    # (clients, slow clients) of every worker
+    shares = [
+        [min(CLIENTS_PER_WORKER, clients - start), 0]
+        for start in range(0, clients, CLIENTS_PER_WORKER)
+    ]
+    for i in range(slow):
+        shares[i % len(shares)][1] += 1
+
+    rss = rss_mb()
+    started = time.perf_counter()
+    workers = []
+    context = multiprocessing.get_context("spawn")
+    for worker_clients, worker_slow in shares:
+        parent, child = context.Pipe()
+        process = context.Process(
+            target=clients_worker, args=(port, worker_clients, worker_slow, child)
+        )
+        process.start()
+        workers.append((process, parent))
+    while len(app.live) < clients + slow:
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - started
+    memory = (rss_mb() - rss) * 1024 / (clients + slow)
+    print(
+        f"connect      {clients + slow} clients in {elapsed:6.2f} s"
+        f" (with worker start), server {memory:.1f} KiB per client"
+    )
+    # let the clients receive the snapshots
+    await asyncio.sleep(1)
+
+    written: dict[int, float] = {}
+    write_times = []
+    started = time.perf_counter()
+    for i in range(writes):
+        event_id = random.choice(ids)
+        written[app.events.seq + 1] = time.time()
+        write_started = time.perf_counter()
+        app.write_event(event_id, random.randint(101, 999), deadline, 1)
+        write_times.append(time.perf_counter() - write_started)
+        # open loop at the given rate, the clients are served in between
+        delay = started + (i + 1) / rate - time.perf_counter()
+        await asyncio.sleep(max(delay, 0))
+    # let the last writes reach the clients
+    await asyncio.sleep(2)
+    connected = len(app.live)
+
+    latencies = []
+    for process, conn in workers:
+        conn.send("stop")
+        seqs, times = await loop.run_in_executor(None, conn.recv)
+        for seq, received in zip(array.array("q", seqs), array.array("d", times)):
+            if seq in written:
+                latencies.append(received - written[seq])
+        process.join()
+
+    print(
+        f"write        p50 {percentile(write_times, 0.5):7.3f} ms"
+        f"  p99 {percentile(write_times, 0.99):7.3f} ms"
+        f"  (store, log and fan-out to {clients + slow} clients)"
+    )
+    print(
+        f"delivery     p50 {percentile(latencies, 0.5):7.2f} ms"
+        f"  p99 {percentile(latencies, 0.99):7.2f} ms"
+        f"  {len(latencies)}/{writes * clients} changes received"
+    )
+    print(
+        f"dropped      {app.live_dropped.value} of {slow} clients that don't read,"
+        f" {connected} connected at the end"
+    )
+
+    server.should_exit = True
+    await serving
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=5000)
+    parser.add_argument("--slow", type=int, default=50)
+    parser.add_argument("--events", type=int, default=1000)
+    parser.add_argument("--writes", type=int, default=300)
+    parser.add_argument("--rate", type=int, default=10, help="writes per second")
+    parser.add_argument("--buffer", type=int, default=256, help="EVENTS_LIVE_BUFFER")
+    args = parser.parse_args()
+    asyncio.run(
+        main(
+            args.clients,
+            args.slow,
+            args.events,
+            args.writes,
+            args.rate,
+            args.buffer,
+        )
+    )
@@ -0,0 +1,88 @@
+"""
+Read endpoints: pydantic models encoded by FastAPI on every request vs.
+cached JSON bytes, and 304 for clients that send If-None-Match.
+Requests go through the ASGI app in-process, without a network.
+
+    python -m benchmarks.response_cache --events 10000 --seconds 3
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+import uuid
+
+os.environ.setdefault("EVENTS_DATA_DIR", tempfile.mkdtemp(prefix="line-provider-"))
+
+from fastapi import FastAPI
+from httpx import AsyncClient
+
+import app
+
+# the read endpoints as they were before the cache
+before = FastAPI()
+
+
+@before.get("/events")
+async def get_events():
+    return [app.to_event(record) for record in app.events.active(time.time())]
+
+
+@before.get("/event/{event_id}")
+async def get_event(event_id: uuid.UUID):
+    return app.to_event(app.events.get(event_id))
+
+
+async def measure(client: AsyncClient, url: str, seconds: float, headers=None):
+    response = await client.get(url, headers=headers)
+    assert response.status_code in (200, 304)
+    count = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < seconds:
+        await client.get(url, headers=headers)
+        count += 1
+    return count / (time.perf_counter() - started), response
+
+
+async def main(count: int, seconds: float):
+    deadline = int(time.time()) + 3600
+    ids = [uuid.uuid4() for _ in range(count)]
+    for event_id in ids:
+        app.write_event(event_id, 150, deadline, 1)
+
+    async with AsyncClient(app=before, base_url="http://bench") as old, AsyncClient(
+        app=app.app, base_url="http://bench"
+    ) as new:
+        for name, url in [("/events", "/events"), ("/event/{id}", f"/event/{ids[0]}")]:
+            rps_before, response = await measure(old, url, seconds)
+            rps_after, cached = await measure(new, url, seconds)
+            assert cached.json() == response.json()
+            rps_304, _ = await measure(
+                new, url, seconds, headers={"If-None-Match": cached.headers["etag"]}
+            )
+            print(
+                f"{name:<12} models {rps_before:8.0f} req/s"
+                f"  cached {rps_after:8.0f} req/s"
+                f"  304 {rps_304:8.0f} req/s"
+                f"  ({len(cached.content)} bytes)"
+            )
+
+        # a write between reads: the list is joined again from cached events
+        url = "/events"
+        written = 0
+        started = time.perf_counter()
+        while time.perf_counter() - started < seconds:
+            app.write_event(ids[written % count], 175, deadline, 1)
+            await new.get(url)
+            written += 1
+        elapsed = time.perf_counter() - started
+        print(f"{'write+read':<12} cached {written / elapsed:8.0f} req/s  (/events)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", type=int, default=10_000)
+    parser.add_argument("--seconds", type=float, default=3)
+    args = parser.parse_args()
+    asyncio.run(main(args.events, args.seconds))
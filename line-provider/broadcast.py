@@ -0,0 +1,103 @@
+import asyncio
+import collections
+
+
+class Subscriber:
+    """
+    Bounded buffer of encoded frames of one live client.
+    A client that lets the buffer fill up is dropped instead of holding
+    frames (and memory) for it: it reconnects and catches up from its
+    last seen seq.
+    """
+
+    __slots__ = ("frames", "maxsize", "dropped", "_waiter")
+
+    def __init__(self, maxsize: int):
+        self.frames: collections.deque[bytes] = collections.deque()
+        self.maxsize = maxsize
+        self.dropped = False
+        self._waiter: asyncio.Future | None = None
+
+    def push(self, frame: bytes) -> bool:
+        "Returns False when the buffer is full"
+        if len(self.frames) >= self.maxsize:
+            return False
+        self.frames.append(frame)
+        self.wake()
+        return True
+
+    def drop(self) -> None:
+        self.dropped = True
+        self.wake()
+
+    def take(self) -> bytes:
+        "All buffered frames as one chunk"
+        chunk = b"".join(self.frames)
+        self.frames.clear()
+        return chunk
+
+    async def wait(self) -> None:
+        """
+        Wait for frames or the drop. Also returns on the heartbeat of the
+        broadcast, without frames
+        """
+        if self.frames or self.dropped:
+            return
+        self._waiter = asyncio.get_running_loop().create_future()
+        try:
+            await self._waiter
+        finally:
+            self._waiter = None
+
+    def wake(self) -> None:
+        waiter = self._waiter
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+
+class Broadcast:
+    """
+    Fan-out of event changes to live clients of the process.
+    A change is encoded once and the same bytes are pushed to every
+    buffer, so a write costs an append and a wakeup per subscriber and
+    nothing waits for the clients. Idle clients are woken by one shared
+    heartbeat timer instead of a timeout per client.
+    """
+
+    def __init__(self, buffer_size: int = 256, heartbeat: float = 15):
+        self.buffer_size = buffer_size
+        self.heartbeat = heartbeat
+        self._subscribers: set[Subscriber] = set()
+        self._timer: asyncio.TimerHandle | None = None
+
+    def __len__(self) -> int:
+        return len(self._subscribers)
+
+    def subscribe(self) -> Subscriber:
+        subscriber = Subscriber(self.buffer_size)
+        self._subscribers.add(subscriber)
+        if self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(
+                self.heartbeat, self._tick
+            )
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        self._subscribers.discard(subscriber)
+        if not self._subscribers and self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def publish(self, frame: bytes) -> int:
+        "Returns how many slow subscribers were dropped"
+        slow = [s for s in self._subscribers if not s.push(frame)]
+        for subscriber in slow:
+            # frames already buffered are still sent, then the stream ends
+            self._subscribers.discard(subscriber)
+            subscriber.drop()
+        return len(slow)
+
+    def _tick(self) -> None:
+        for subscriber in self._subscribers:
+            subscriber.wake()
+        self._timer = asyncio.get_running_loop().call_later(self.heartbeat, self._tick)
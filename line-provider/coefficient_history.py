@@ -0,0 +1,130 @@
+import array
+import bisect
+import mmap
+import os
+import pathlib
+import struct
+import uuid
+
+# event_id, time of the change in milliseconds, coefficient in cents
+_point = struct.Struct(">16sqI")
+
+
+class CoefficientHistory:
+    """
+    Coefficient of every event over time: per event, parallel arrays of
+    change times (milliseconds) and coefficients in cents, 12 bytes per
+    change. A point is added only when the coefficient changes, times of an
+    event never decrease, so lookups are a bisect over its arrays.
+
+    The event log keeps only the current state of events, with a path the
+    history is also appended to its own file and loaded from it on open.
+    Nothing is ever dropped: the file grows by 28 bytes per change and all
+    of it is loaded into memory, it is removed by hand with the service
+    stopped to start the history over.
+    """
+
+    def __init__(self, path: str | os.PathLike | None = None, fsync: bool = False):
+        self.path = pathlib.Path(path) if path is not None else None
+        # fsync every change, like the event log with EVENTS_WAL_FSYNC
+        self.fsync = fsync
+        # event_id -> (times, cents)
+        self._series: dict[uuid.UUID, tuple[array.array, array.array]] = {}
+        self._file = None
+        self.points = 0
+
+    def __len__(self) -> int:
+        return len(self._series)
+
+    def __contains__(self, event_id: uuid.UUID) -> bool:
+        return event_id in self._series
+
+    def open(self) -> int:
+        "Load the history from the file and append to it, returns loaded points"
+        loaded = 0
+        if self.path.exists():
+            loaded = self._load()
+        self._file = open(self.path, "ab")
+        return loaded
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def add(self, event_id: uuid.UUID, cents: int, at: float) -> bool:
+        "Record the coefficient at the time at, False if it didn't change"
+        ms = int(at * 1000)
+        series = self._series.get(event_id)
+        if series is None:
+            series = self._series[event_id] = (array.array("q"), array.array("I"))
+        else:
+            times, values = series
+            if values[-1] == cents:
+                return False
+            # the wall clock may step back, the order of changes is kept
+            ms = max(ms, times[-1])
+        series[0].append(ms)
+        series[1].append(cents)
+        self.points += 1
+        if self._file is not None:
+            self._file.write(_point.pack(event_id.bytes, ms, cents))
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+        return True
+
+    def at(self, event_id: uuid.UUID, at: float) -> int | None:
+        "Coefficient in cents at the time at, None before the event was created"
+        series = self._series.get(event_id)
+        if series is None:
+            return None
+        i = bisect.bisect_right(series[0], int(at * 1000))
+        return series[1][i - 1] if i else None
+
+    def between(
+        self, event_id: uuid.UUID, since: float, until: float, limit: int
+    ) -> list[tuple[float, int]]:
+        """
+        (time, cents) of the coefficient in effect at since and of the
+        changes after it, before until. Up to limit points
+        """
+        series = self._series.get(event_id)
+        if series is None:
+            return []
+        times, values = series
+        start = max(bisect.bisect_right(times, int(since * 1000)) - 1, 0)
+        end = min(bisect.bisect_left(times, int(until * 1000)), start + limit)
+        return [(times[i] / 1000, values[i]) for i in range(start, end)]
+
+    def _load(self) -> int:
+        size = self.path.stat().st_size
+        tail = size % _point.size
+        if tail:
+            # torn write of a crashed process
+            os.truncate(self.path, size - tail)
+            size -= tail
+        if not size:
+            return 0
+        series = self._series
+        # ids of the file are repeated, a UUID object per event only
+        by_bytes: dict[bytes, tuple[array.array, array.array]] = {}
+        with open(self.path, "rb") as f, mmap.mmap(
+            f.fileno(), 0, access=mmap.ACCESS_READ
+        ) as data:
+            with memoryview(data) as view:
+                points = _point.iter_unpack(view)
+                for event_id, ms, cents in points:
+                    pair = by_bytes.get(event_id)
+                    if pair is None:
+                        pair = by_bytes[event_id] = series.setdefault(
+                            uuid.UUID(bytes=event_id),
+                            (array.array("q"), array.array("I")),
+                        )
+                    pair[0].append(ms)
+                    pair[1].append(cents)
+                # the iterator holds the buffer, it must go before mmap is closed
+                del points
+        loaded = size // _point.size
+        self.points += loaded
+        return loaded
@@ -0,0 +1,61 @@
+import heapq
+import uuid
+
+
+class OpenEventIndex:
+    """
+    Index of open (NEW) events with their deadlines.
+
+    Listing is proportional to the number of open events: closed events are
+    removed eagerly, expired ones are pruned lazily through a deadline heap.
+    """
+
+    def __init__(self):
+        # event_id -> deadline, keeps insertion order like the events dict
+        self._open: dict[uuid.UUID, int] = {}
+        # (deadline, event_id), may contain stale entries of updated/closed events
+        self._heap: list[tuple[int, uuid.UUID]] = []
+
+    def __len__(self) -> int:
+        return len(self._open)
+
+    def __contains__(self, event_id: uuid.UUID) -> bool:
+        return event_id in self._open
+
+    def update(self, event_id: uuid.UUID, deadline: int, is_open: bool) -> None:
+        "Sync the index with the current event deadline and state"
+        if not is_open:
+            self.discard(event_id)
+            return
+        if self._open.get(event_id) == deadline:
+            return
+        self._open[event_id] = deadline
+        heapq.heappush(self._heap, (deadline, event_id))
+        if len(self._heap) > 2 * len(self._open) + 64:
+            self._compact()
+
+    def discard(self, event_id: uuid.UUID) -> None:
+        # heap entry becomes stale and is skipped on prune
+        self._open.pop(event_id, None)
+
+    def load(self, items: list[tuple[uuid.UUID, int]]) -> None:
+        "Bulk fill an empty index with (event_id, deadline) of open events"
+        self._open.update(items)
+        self._compact()
+
+    def prune(self, now: float) -> None:
+        "Drop events whose deadline has passed"
+        heap, open_events = self._heap, self._open
+        while heap and heap[0][0] <= now:
+            deadline, event_id = heapq.heappop(heap)
+            if open_events.get(event_id) == deadline:
+                del open_events[event_id]
+
+    def active(self, now: float) -> list[uuid.UUID]:
+        "Ids of open events with deadline after now"
+        self.prune(now)
+        return list(self._open)
+
+    def _compact(self) -> None:
+        self._heap = [(deadline, event_id) for event_id, deadline in self._open.items()]
+        heapq.heapify(self._heap)
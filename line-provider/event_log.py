@@ -0,0 +1,177 @@
+import asyncio
+import gc
+import mmap
+import os
+import pathlib
+import struct
+import uuid
+
+from event_store import EventRecord, EventStore
+
+# seq, event_id, coefficient in cents, deadline, state - both for the log
+# and for the snapshot, so replaying either is the same loop
+_record = struct.Struct(">Q16sIqB")
+# magic, format version, seq of the last write in the snapshot, records count
+_snapshot_header = struct.Struct(">4sBQQ")
+SNAPSHOT_MAGIC = b"LPSN"
+SNAPSHOT_V1 = 1
+
+
+def _pack(record: EventRecord) -> bytes:
+    return _record.pack(
+        record.seq, record.event_id.bytes, record.cents, record.deadline, record.state
+    )
+
+
+def _replay(store: EventStore, data, after: int) -> int:
+    "Apply packed records with seq > after, returns how many were applied"
+    applied = 0
+    for seq, event_id, cents, deadline, state in _record.iter_unpack(data):
+        if seq > after:
+            store.put(uuid.UUID(bytes=event_id), cents, deadline, state, seq)
+            applied += 1
+    return applied
+
+
+class EventLog:
+    """
+    Durable event state: an append-only log of writes, split into segments,
+    and compacted snapshots of the whole store.
+
+    A snapshot is written when the current segment grows over
+    snapshot_every records, segments and snapshots it covers are removed.
+    Recovery loads the latest snapshot through mmap and replays only the
+    segments written after it, so restart time is bounded by the number of
+    events, not by the length of their history.
+    """
+
+    def __init__(self, directory: str, snapshot_every: int = 100_000, fsync=False):
+        self.directory = pathlib.Path(directory)
+        self.snapshot_every = snapshot_every
+        # fsync every write to survive power loss, not only a process crash
+        self.fsync = fsync
+        self._store: EventStore | None = None
+        self._segment = None
+        self._appended = 0
+        self._snapshot_task: asyncio.Task | None = None
+
+    @property
+    def is_open(self) -> bool:
+        return self._segment is not None
+
+    def open(self, store: EventStore) -> int:
+        "Recover the store and start a new segment, returns replayed writes"
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._store = store
+        replayed = self.recover(store)
+        self._rotate(store.seq + 1)
+        return replayed
+
+    def recover(self, store: EventStore) -> int:
+        # millions of small acyclic objects are created here, cyclic GC
+        # passes over the growing heap only double the load time
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            snapshots = sorted(self.directory.glob("snapshot-*.bin"))
+            after = self._load_snapshot(snapshots[-1], store) if snapshots else 0
+            replayed = len(store)
+            for path in sorted(self.directory.glob("wal-*.log")):
+                data = path.read_bytes()
+                tail = len(data) % _record.size
+                if tail:
+                    # torn write of a crashed process, the change wasn't confirmed
+                    data = data[:-tail]
+                    os.truncate(path, len(data))
+                replayed += _replay(store, data, after)
+            return replayed
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+    def append(self, record: EventRecord) -> None:
+        "Write ahead: called before the change is published"
+        if self._segment is None:
+            return
+        self._segment.write(_pack(record))
+        self._segment.flush()
+        if self.fsync:
+            os.fsync(self._segment.fileno())
+        self._appended += 1
+        if self._appended >= self.snapshot_every and self._snapshot_task is None:
+            self._snapshot_task = asyncio.get_running_loop().create_task(
+                self.snapshot()
+            )
+
+    async def snapshot(self) -> None:
+        try:
+            # capture in the loop, pack and write in a thread
+            seq = self._store.seq
+            rows = [
+                (r.seq, r.event_id.bytes, r.cents, r.deadline, r.state)
+                for r in self._store.values()
+            ]
+            # writes after the capture go to the new segment
+            self._rotate(seq + 1)
+            await asyncio.to_thread(self._write_snapshot, seq, rows)
+            self._cleanup(seq)
+        finally:
+            self._snapshot_task = None
+
+    async def close(self) -> None:
+        if self._snapshot_task is not None:
+            await self._snapshot_task
+        if self._segment is None:
+            return
+        if self._appended:
+            # next start doesn't need to replay anything
+            await self.snapshot()
+        self._segment.close()
+        self._segment = None
+
+    def _rotate(self, first_seq: int) -> None:
+        if self._segment is not None:
+            self._segment.close()
+        path = self.directory / f"wal-{first_seq:020d}.log"
+        self._segment = open(path, "ab")
+        self._appended = 0
+
+    def _write_snapshot(self, seq: int, rows: list[tuple]) -> None:
+        path = self.directory / f"snapshot-{seq:020d}.bin"
+        tmp = path.with_suffix(".tmp")
+        with open(tmp, "wb") as f:
+            f.write(_snapshot_header.pack(SNAPSHOT_MAGIC, SNAPSHOT_V1, seq, len(rows)))
+            f.write(b"".join(_record.pack(*row) for row in rows))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    def _load_snapshot(self, path: pathlib.Path, store: EventStore) -> int:
+        "Returns seq of the last write in the snapshot"
+        with open(path, "rb") as f, mmap.mmap(
+            f.fileno(), 0, access=mmap.ACCESS_READ
+        ) as data:
+            magic, version, seq, count = _snapshot_header.unpack_from(data)
+            if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_V1:
+                raise ValueError(f"Unsupported snapshot format: {path}")
+            start = _snapshot_header.size
+            with memoryview(data)[start : start + count * _record.size] as view:
+                records = _record.iter_unpack(view)
+                store.load(
+                    (uuid.UUID(bytes=event_id), cents, deadline, state, seq)
+                    for seq, event_id, cents, deadline, state in records
+                )
+                # the iterator holds the buffer, it must go before mmap is closed
+                del records
+        store.seq = max(store.seq, seq)
+        return seq
+
+    def _cleanup(self, seq: int) -> None:
+        "Remove snapshots and segments covered by the snapshot at seq"
+        current = pathlib.Path(self._segment.name)
+        for path in self.directory.glob("wal-*.log"):
+            if path != current and int(path.stem[4:]) <= seq:
+                path.unlink()
+        for path in self.directory.glob("snapshot-*.bin"):
+            if int(path.stem[9:]) < seq:
+                path.unlink()
@@ -0,0 +1,157 @@
+import bisect
+import time
+import uuid
+from typing import Iterable, Iterator
+
+from event_index import OpenEventIndex
+
+# EventState.NEW.value, the store doesn't depend on the API models
+STATE_NEW = 1
+
+
+class EventRecord:
+    """
+    Compact event: a slotted record with the coefficient in integer cents
+    and the state as EventState value, pydantic models are built from it
+    only at the API boundary. seq is the number of the last change.
+    """
+
+    __slots__ = ("event_id", "cents", "deadline", "state", "seq")
+
+    def __init__(
+        self, event_id: uuid.UUID, cents: int, deadline: int, state: int, seq: int
+    ):
+        self.event_id = event_id
+        self.cents = cents
+        self.deadline = deadline
+        self.state = state
+        self.seq = seq
+
+    @property
+    def is_open(self) -> bool:
+        return self.state == STATE_NEW
+
+
+class EventStore:
+    """
+    All events of the process by id, with the index of open events kept in
+    sync on every write. Every write is numbered with the next seq, events
+    changed after a seq are listed with changes().
+    """
+
+    def __init__(self):
+        self._records: dict[uuid.UUID, EventRecord] = {}
+        self._open = OpenEventIndex()
+        # seq of the last write
+        self.seq = 0
+        # change log sorted by seq: (seq, event_id) of every write, an entry
+        # is stale once the event is written again, see _compact_changes
+        self._change_seqs: list[int] = []
+        self._change_ids: list[uuid.UUID] = []
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def __contains__(self, event_id: uuid.UUID) -> bool:
+        return event_id in self._records
+
+    @property
+    def open_count(self) -> int:
+        return len(self._open)
+
+    def get(self, event_id: uuid.UUID) -> EventRecord | None:
+        return self._records.get(event_id)
+
+    def values(self) -> Iterator[EventRecord]:
+        return iter(self._records.values())
+
+    def put(
+        self,
+        event_id: uuid.UUID,
+        cents: int,
+        deadline: int,
+        state: int,
+        seq: int | None = None,
+    ) -> EventRecord:
+        """
+        Create the event or overwrite all of its fields.
+        seq is given only when replaying already numbered writes
+        """
+        if seq is None:
+            seq = self.seq + 1
+        self.seq = max(self.seq, seq)
+        record = self._records.get(event_id)
+        if record is None:
+            record = self._records[event_id] = EventRecord(
+                event_id, cents, deadline, state, seq
+            )
+        else:
+            record.cents = cents
+            record.deadline = deadline
+            record.state = state
+            record.seq = seq
+        self._open.update(event_id, deadline, state == STATE_NEW)
+        self._add_change(seq, event_id)
+        return record
+
+    def load(self, rows: Iterable[tuple[uuid.UUID, int, int, int, int]]) -> None:
+        """
+        Bulk fill an empty store with (event_id, cents, deadline, state, seq),
+        e.g. from a snapshot. Cheaper than put: the open index is heapified once
+        """
+        records = self._records
+        open_events = []
+        for event_id, cents, deadline, state, seq in rows:
+            records[event_id] = EventRecord(event_id, cents, deadline, state, seq)
+            if state == STATE_NEW:
+                open_events.append((event_id, deadline))
+            if seq > self.seq:
+                self.seq = seq
+        self._open.load(open_events)
+        self._compact_changes()
+
+    def changes(self, since: int, limit: int) -> list[EventRecord]:
+        "Events in the order of their last write, written after since"
+        records = self._records
+        seqs, ids = self._change_seqs, self._change_ids
+        changed = []
+        i = bisect.bisect_right(seqs, since)
+        while i < len(seqs) and len(changed) < limit:
+            record = records[ids[i]]
+            if record.seq == seqs[i]:
+                changed.append(record)
+            i += 1
+        return changed
+
+    def _add_change(self, seq: int, event_id: uuid.UUID) -> None:
+        seqs = self._change_seqs
+        if not seqs or seq > seqs[-1]:
+            seqs.append(seq)
+            self._change_ids.append(event_id)
+        else:
+            # replayed out of order, doesn't happen for writes of the process
+            i = bisect.bisect_left(seqs, seq)
+            seqs.insert(i, seq)
+            self._change_ids.insert(i, event_id)
+        if len(seqs) > 2 * len(self._records) + 64:
+            # drop stale entries, the order is kept
+            records = self._records
+            live = [
+                (seq, event_id)
+                for seq, event_id in zip(seqs, self._change_ids)
+                if records[event_id].seq == seq
+            ]
+            self._change_seqs = [seq for seq, _ in live]
+            self._change_ids = [event_id for _, event_id in live]
+
+    def _compact_changes(self) -> None:
+        "Rebuild the change log from the records"
+        live = sorted((r.seq, r.event_id) for r in self._records.values())
+        self._change_seqs = [seq for seq, _ in live]
+        self._change_ids = [event_id for _, event_id in live]
+
+    def active(self, now: float | None = None) -> list[EventRecord]:
+        "Open events with the deadline in the future, in insertion order"
+        if now is None:
+            now = time.time()
+        return [self._records[event_id] for event_id in self._open.active(now)]
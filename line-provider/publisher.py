@@ -0,0 +1,132 @@
+import asyncio
+import collections
+import contextlib
+
+import aio_pika
+import aio_pika.abc
+
+
+class EventPublisher:
+    """
+    Process-wide publisher: one robust connection and a bounded pool of
+    channels with publisher confirms, shared by all requests.
+    """
+
+    def __init__(self, url: str, routing_key: str, pool_size: int = 8):
+        self.url = url
+        self.routing_key = routing_key
+        self.pool_size = pool_size
+        self._connection: aio_pika.abc.AbstractRobustConnection | None = None
+        # open channels nobody uses, None when the publisher is not started
+        self._idle: list[aio_pika.abc.AbstractChannel] | None = None
+        # channels given out, a closed one frees its place on release
+        self._in_use = 0
+        # acquirers waiting for a channel to come back, in arrival order
+        self._waiters: collections.deque[asyncio.Future] = collections.deque()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._lock: asyncio.Lock | None = None
+
+    @property
+    def is_started(self) -> bool:
+        return self._connection is not None and self._loop is asyncio.get_running_loop()
+
+    async def start(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._idle is None:
+            # connection from another (already closed) event loop, e.g. when
+            # every test runs in a fresh loop - it can't be reused here
+            self._reset(loop)
+        async with self._lock:
+            if self._connection is not None:
+                return
+            connection = await aio_pika.connect_robust(self.url)
+            channel = await self._open_channel(connection)
+            # make sure the queue exists
+            await channel.declare_queue(self.routing_key)
+            self._connection = connection
+            self._idle.append(channel)
+
+    async def close(self) -> None:
+        if self._connection is None:
+            return
+        connection = self._connection
+        self._connection = None
+        self._idle = None
+        self._in_use = 0
+        # nothing will be released to them any more
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_exception(ConnectionError("Publisher is closed"))
+        await connection.close()
+
+    @contextlib.asynccontextmanager
+    async def acquire(self):
+        "Take a channel from the pool for the time of the block"
+        if not self.is_started:
+            await self.start()
+        idle = self._idle
+        channel = await self._get_channel()
+        try:
+            yield channel
+        finally:
+            # a channel of a publisher closed meanwhile is not returned
+            if self._idle is idle:
+                self._release(channel)
+
+    async def _get_channel(self) -> aio_pika.abc.AbstractChannel:
+        while True:
+            while self._idle:
+                channel = self._idle.pop()
+                # closed by a reconnect while it was idle
+                if not channel.is_closed:
+                    self._in_use += 1
+                    return channel
+            if self._in_use < self.pool_size:
+                self._in_use += 1
+                try:
+                    return await self._open_channel(self._connection)
+                except BaseException:
+                    self._in_use -= 1
+                    self._wake()
+                    raise
+            # pool is exhausted, wait for a channel to come back and look again
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    # woken just before the cancel, pass the turn on
+                    self._wake()
+                else:
+                    self._waiters.remove(waiter)
+                raise
+
+    def _release(self, channel: aio_pika.abc.AbstractChannel) -> None:
+        self._in_use -= 1
+        # closed channels are dropped, the waiter opens a new one instead
+        if not channel.is_closed:
+            self._idle.append(channel)
+        self._wake()
+
+    def _wake(self) -> None:
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+    @staticmethod
+    async def _open_channel(connection) -> aio_pika.abc.AbstractChannel:
+        return await connection.channel(
+            publisher_confirms=True, on_return_raises=True
+        )
+
+    def _reset(self, loop: asyncio.AbstractEventLoop) -> None:
+        self._connection = None
+        self._idle = []
+        self._in_use = 0
+        self._waiters = collections.deque()
+        self._loop = loop
+        self._lock = asyncio.Lock()
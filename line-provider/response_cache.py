@@ -0,0 +1,89 @@
+import collections
+import hashlib
+import json
+from typing import NamedTuple
+
+from event_store import EventRecord, EventStore
+
+
+class Cached(NamedTuple):
+    body: bytes
+    etag: str
+
+
+def encode_event(record: EventRecord) -> bytes:
+    # what FastAPI renders for app.Event: field order, float coefficient
+    # and compact separators
+    return json.dumps(
+        {
+            "coefficient": record.cents / 100,
+            "deadline": record.deadline,
+            "event_id": str(record.event_id),
+            "state": record.state,
+        },
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+
+def _cached(body: bytes) -> Cached:
+    return Cached(body, '"' + hashlib.blake2b(body, digest_size=8).hexdigest() + '"')
+
+
+class ResponseCache:
+    """
+    Ready-to-send JSON of the read endpoints: bytes per event and for the
+    lists of all and of active events. Entries are built on the first read
+    and are valid until the next write, checked by the seq of the event or
+    of the store, so every write path invalidates them. Lists are joined
+    from the cached bytes of their events. The ETag is a hash of the body.
+    Bytes are kept for the max_events events read last, with more events
+    the lists encode the rest on every rebuild.
+    """
+
+    def __init__(self, store: EventStore, max_events: int = 100_000):
+        self.store = store
+        self.max_events = max_events
+        # record -> (seq of the event, response), least recently read first.
+        # Records are updated in place and hash by identity, cheaper than
+        # hashing UUIDs
+        self._events: collections.OrderedDict[EventRecord, tuple[int, Cached]] = (
+            collections.OrderedDict()
+        )
+        # (seq of the store, response)
+        self._all: tuple[int, Cached] = (-1, None)
+        # the active list is also valid only until its earliest deadline
+        self._active: tuple[int, Cached] = (-1, None)
+        self._active_until = 0.0
+
+    def __len__(self) -> int:
+        return len(self._events)
+
+    def event(self, record: EventRecord) -> Cached:
+        seq, cached = self._events.pop(record, (-1, None))
+        if seq != record.seq:
+            cached = _cached(encode_event(record))
+        self._events[record] = (record.seq, cached)
+        if len(self._events) > self.max_events:
+            self._events.popitem(last=False)
+        return cached
+
+    def all(self) -> Cached:
+        seq, cached = self._all
+        if seq != self.store.seq:
+            cached = self._join(self.store.values())
+            self._all = (self.store.seq, cached)
+        return cached
+
+    def active(self, now: float) -> Cached:
+        seq, cached = self._active
+        if seq != self.store.seq or now >= self._active_until:
+            records = self.store.active(now)
+            cached = self._join(records)
+            self._active = (self.store.seq, cached)
+            self._active_until = min(
+                (r.deadline for r in records), default=float("inf")
+            )
+        return cached
+
+    def _join(self, records) -> Cached:
+        return _cached(b"[" + b",".join(self.event(r).body for r in records) + b"]")
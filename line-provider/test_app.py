@@ -1,10 +1,12 @@
+import asyncio
+import json
 import time
 import uuid
 
 import pytest
 from httpx import AsyncClient
 
-from app import app
+from app import app, events, iter_live, live, write_event
 
 
 @pytest.mark.asyncio
@@ -76,3 +78,123 @@ async def test_update_event():
 
 
 # TODO попытка отредактировать завершенное событие
+
+
+@pytest.mark.asyncio
+async def test_etag_on_read_endpoints():
+    deadline = int(time.time()) + 600
+    record = write_event(uuid.uuid4(), 150, deadline, 1)
+    urls = ["/events", "/events/all", f"/event/{record.event_id}"]
+
+    async with AsyncClient(app=app, base_url="http://localhost") as ac:
+        responses = [await ac.get(url) for url in urls]
+        cached = [
+            await ac.get(url, headers={"If-None-Match": response.headers["etag"]})
+            for url, response in zip(urls, responses)
+        ]
+        write_event(record.event_id, 175, deadline, 1)
+        changed = [
+            await ac.get(url, headers={"If-None-Match": response.headers["etag"]})
+            for url, response in zip(urls, responses)
+        ]
+
+    assert [r.status_code for r in responses] == [200, 200, 200]
+    assert responses[2].json()["coefficient"] == 1.5
+    assert [r.status_code for r in cached] == [304, 304, 304]
+    assert [r.status_code for r in changed] == [200, 200, 200]
+    assert changed[2].json()["coefficient"] == 1.75
+    assert str(record.event_id) in {e["event_id"] for e in changed[0].json()}
+
+
+@pytest.mark.asyncio
+async def test_event_changes():
+    since = events.seq
+    first, second = uuid.uuid4(), uuid.uuid4()
+    events.put(first, 120, 1000, 1)
+    events.put(second, 167, 2000, 1)
+    events.put(first, 250, 1000, 3)
+
+    async with AsyncClient(app=app, base_url="http://localhost") as ac:
+        response = await ac.get("/events/changes", params={"since": since})
+        page = await ac.get("/events/changes", params={"since": since, "limit": 1})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert response.headers["x-head-seq"] == str(since + 3)
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert lines == [
+        {
+            "event_id": str(second),
+            "coefficient": 1.67,
+            "deadline": 2000,
+            "state": 1,
+            "seq": since + 2,
+        },
+        {
+            "event_id": str(first),
+            "coefficient": 2.5,
+            "deadline": 1000,
+            "state": 3,
+            "seq": since + 3,
+        },
+    ]
+    assert page.text.splitlines() == response.text.splitlines()[:1]
+
+
+@pytest.mark.asyncio
+async def test_coefficient_history_endpoints():
+    deadline = int(time.time()) + 600
+    async with AsyncClient(app=app, base_url="http://localhost") as ac:
+        created = await ac.post(
+            "/event", json={"coefficient": 1.5, "deadline": deadline, "state": 1}
+        )
+        event_id = created.json()["event_id"]
+        # points are in milliseconds
+        await asyncio.sleep(0.005)
+        before = time.time()
+        await asyncio.sleep(0.005)
+        await ac.patch(f"/events/{event_id}/coeff", json={"coefficient": 1.75})
+        await ac.patch(f"/events/{event_id}/state", json={"state": 2})
+
+        now = await ac.get(f"/event/{event_id}/coefficient", params={"at": time.time()})
+        created_at = await ac.get(
+            f"/event/{event_id}/coefficient", params={"at": before}
+        )
+        too_early = await ac.get(f"/event/{event_id}/coefficient", params={"at": 1})
+        points = await ac.get(f"/event/{event_id}/coefficients")
+        unknown = await ac.get(f"/event/{uuid.uuid4()}/coefficients")
+
+    assert now.json()["coefficient"] == 1.75
+    assert created_at.json()["coefficient"] == 1.5
+    assert too_early.status_code == 404
+    # the state change is not a coefficient change
+    assert [p["coefficient"] for p in points.json()] == [1.5, 1.75]
+    assert points.json()[1]["at"] > before
+    assert unknown.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_events_live():
+    stream = iter_live(None)
+    snapshot = (await anext(stream)).decode()
+    assert snapshot.startswith(f"event: snapshot\nid: {events.seq}\ndata: [")
+    assert len(live) == 1
+
+    event_id = uuid.uuid4()
+    deadline = int(time.time()) + 600
+    seq = write_event(event_id, 150, deadline, 1).seq
+    write_event(event_id, 175, deadline, 1)
+    frames = (await anext(stream)).decode().split("\n\n")[:-1]
+    assert [frame.split("\n")[:2] for frame in frames] == [
+        ["event: change", f"id: {seq}"],
+        ["event: change", f"id: {seq + 1}"],
+    ]
+    assert json.loads(frames[1].split("data: ")[1])["coefficient"] == 1.75
+
+    # reconnect after the first change gets only the second one
+    resumed = iter_live(seq)
+    assert (await anext(resumed)).decode() == frames[1] + "\n\n"
+
+    await stream.aclose()
+    await resumed.aclose()
+    assert len(live) == 0
@@ -0,0 +1,46 @@
+import asyncio
+
+import pytest
+
+from broadcast import Broadcast
+
+
+@pytest.mark.asyncio
+async def test_publish_to_every_subscriber():
+    broadcast = Broadcast(buffer_size=2)
+    first, second = broadcast.subscribe(), broadcast.subscribe()
+
+    waiter = asyncio.create_task(first.wait())
+    await asyncio.sleep(0)
+    assert broadcast.publish(b"a") == 0
+    await asyncio.wait_for(waiter, 1)
+
+    assert first.take() == b"a" and second.take() == b"a"
+    assert not first.frames
+
+
+@pytest.mark.asyncio
+async def test_slow_subscriber_is_dropped():
+    broadcast = Broadcast(buffer_size=2)
+    fast, slow = broadcast.subscribe(), broadcast.subscribe()
+    broadcast.publish(b"a")
+    fast.take()
+    broadcast.publish(b"b")
+    fast.take()
+
+    assert broadcast.publish(b"c") == 1
+    assert slow.dropped and not fast.dropped
+    assert len(broadcast) == 1
+    # buffered frames are kept for the last write to the client
+    assert slow.take() == b"ab"
+    # doesn't wait once dropped
+    await asyncio.wait_for(slow.wait(), 1)
+
+
+@pytest.mark.asyncio
+async def test_heartbeat_wakes_idle_subscribers():
+    broadcast = Broadcast(heartbeat=0.01)
+    subscriber = broadcast.subscribe()
+    await asyncio.wait_for(subscriber.wait(), 1)
+    assert not subscriber.frames and not subscriber.dropped
+    broadcast.unsubscribe(subscriber)
@@ -0,0 +1,68 @@
+import os
+import uuid
+
+from coefficient_history import CoefficientHistory
+
+
+def test_point_in_time_and_range():
+    history = CoefficientHistory()
+    event_id = uuid.uuid4()
+    assert history.add(event_id, 150, 100.0)
+    # unchanged coefficient is not a new point
+    assert not history.add(event_id, 150, 105.0)
+    assert history.add(event_id, 175, 110.0)
+    # the clock stepped back, the change is still after the previous one
+    assert history.add(event_id, 120, 109.0)
+
+    assert history.at(event_id, 99.999) is None
+    assert history.at(event_id, 100.0) == 150
+    assert history.at(event_id, 109.999) == 150
+    assert history.at(event_id, 110.0) == 120
+    assert history.at(uuid.uuid4(), 110.0) is None
+
+    assert history.between(event_id, 105.0, 200.0, 10) == [
+        (100.0, 150),
+        (110.0, 175),
+        (110.0, 120),
+    ]
+    assert history.between(event_id, 0.0, 110.0, 10) == [(100.0, 150)]
+    assert history.between(event_id, 0.0, 200.0, 2) == [(100.0, 150), (110.0, 175)]
+    assert history.points == 3 and len(history) == 1
+
+
+def test_history_survives_restart(tmp_path):
+    path = tmp_path / "history.bin"
+    history = CoefficientHistory(path)
+    assert history.open() == 0
+    ids = [uuid.uuid4() for _ in range(3)]
+    for i, event_id in enumerate(ids):
+        history.add(event_id, 100 + i, 1.0)
+        history.add(event_id, 200 + i, 2.0)
+    # torn write of a crashed process
+    history._file.write(b"\x00" * 5)
+    history.close()
+
+    restored = CoefficientHistory(path)
+    assert restored.open() == 6
+    for i, event_id in enumerate(ids):
+        assert restored.between(event_id, 0, 10, 10) == [(1.0, 100 + i), (2.0, 200 + i)]
+    # appends go after the loaded points
+    restored.add(ids[0], 300, 3.0)
+    restored.close()
+    again = CoefficientHistory(path)
+    assert again.open() == 7
+    assert again.at(ids[0], 5.0) == 300
+
+
+def test_history_fsyncs_when_asked(tmp_path, monkeypatch):
+    synced = []
+    monkeypatch.setattr(os, "fsync", synced.append)
+    event_id = uuid.uuid4()
+    for fsync in (False, True):
+        history = CoefficientHistory(tmp_path / f"{fsync}.bin", fsync=fsync)
+        history.open()
+        history.add(event_id, 100, 1.0)
+        # unchanged coefficients are not written
+        history.add(event_id, 100, 2.0)
+        history.close()
+    assert len(synced) == 1
@@ -0,0 +1,37 @@
+import uuid
+
+from event_index import OpenEventIndex
+
+
+def test_active_events_skip_closed_and_expired():
+    index = OpenEventIndex()
+    first, second, third = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+    index.update(first, 100, is_open=True)
+    index.update(second, 200, is_open=True)
+    index.update(third, 300, is_open=True)
+
+    index.update(second, 200, is_open=False)
+    assert index.active(now=50) == [first, third]
+    # deadline is exclusive, like `time.time() < deadline`
+    assert index.active(now=100) == [third]
+
+
+def test_deadline_update_moves_expiry():
+    index = OpenEventIndex()
+    event_id = uuid.uuid4()
+    index.update(event_id, 100, is_open=True)
+    index.update(event_id, 500, is_open=True)
+
+    # the stale heap entry for deadline 100 must not drop the event
+    assert index.active(now=200) == [event_id]
+    assert index.active(now=500) == []
+
+
+def test_stale_entries_are_compacted():
+    index = OpenEventIndex()
+    event_id = uuid.uuid4()
+    for deadline in range(1000, 2000):
+        index.update(event_id, deadline, is_open=True)
+
+    assert len(index._heap) < 100
+    assert index.active(now=0) == [event_id]
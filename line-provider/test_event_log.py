@@ -0,0 +1,50 @@
+import uuid
+
+import pytest
+
+from event_log import EventLog
+from event_store import EventStore, STATE_NEW
+
+
+def state_of(store: EventStore) -> dict:
+    return {r.event_id: (r.cents, r.deadline, r.state, r.seq) for r in store.values()}
+
+
+@pytest.mark.asyncio
+async def test_recover_from_snapshot_and_log(tmp_path):
+    store = EventStore()
+    log = EventLog(tmp_path, snapshot_every=1000)
+    log.open(store)
+    ids = [uuid.uuid4() for _ in range(10)]
+    for i, event_id in enumerate(ids):
+        log.append(store.put(event_id, 100 + i, 1000, STATE_NEW))
+    await log.snapshot()
+    # writes after the snapshot are only in the log
+    log.append(store.put(ids[0], 555, 1000, 3))
+    log.append(store.put(ids[1], 777, 2000, STATE_NEW))
+    # torn write of a crashed process
+    log._segment.write(b"\x00" * 7)
+    log._segment.flush()
+
+    recovered = EventStore()
+    assert EventLog(tmp_path).open(recovered) == 12
+    assert state_of(recovered) == state_of(store)
+    assert recovered.seq == store.seq == 12
+    assert [r.event_id for r in recovered.active(now=0)] == ids[1:]
+
+
+@pytest.mark.asyncio
+async def test_close_compacts_history(tmp_path):
+    store = EventStore()
+    log = EventLog(tmp_path, snapshot_every=3)
+    log.open(store)
+    event_id = uuid.uuid4()
+    for cents in range(100, 110):
+        log.append(store.put(event_id, cents, 1000, STATE_NEW))
+    await log.close()
+
+    assert len(list(tmp_path.glob("snapshot-*.bin"))) == 1
+    recovered = EventStore()
+    # one event is loaded from the snapshot, nothing left to replay
+    assert EventLog(tmp_path).open(recovered) == 1
+    assert state_of(recovered) == state_of(store)
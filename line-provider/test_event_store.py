@@ -0,0 +1,38 @@
+import uuid
+
+from event_store import EventStore, STATE_NEW
+
+
+def test_put_keeps_open_index_in_sync():
+    store = EventStore()
+    first, second = uuid.uuid4(), uuid.uuid4()
+    store.put(first, 120, 100, STATE_NEW)
+    record = store.put(second, 167, 200, STATE_NEW)
+
+    assert [r.event_id for r in store.active(now=50)] == [first, second]
+    # overwriting keeps the same record
+    assert store.put(second, 199, 200, 3) is record
+    assert record.cents == 199 and not record.is_open
+    assert [r.event_id for r in store.active(now=50)] == [first]
+    assert len(store) == 2 and store.open_count == 1
+    assert store.get(uuid.uuid4()) is None
+
+
+def test_changes_since_seq():
+    store = EventStore()
+    first, second, third = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+    store.put(first, 100, 100, STATE_NEW)
+    store.put(second, 100, 100, STATE_NEW)
+    store.put(third, 100, 100, STATE_NEW)
+    store.put(first, 150, 100, STATE_NEW)
+    for _ in range(100):
+        # compacts the change log on the way
+        store.put(second, 200, 100, STATE_NEW)
+
+    assert [(r.event_id, r.seq) for r in store.changes(0, 10)] == [
+        (third, 3),
+        (first, 4),
+        (second, 104),
+    ]
+    assert [r.event_id for r in store.changes(3, 1)] == [first]
+    assert store.changes(104, 10) == []
@@ -0,0 +1,38 @@
+import uuid
+
+import pytest
+from httpx import AsyncClient
+
+import metrics
+from app import app
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = metrics.Registry()
+    histogram = registry.histogram("latency_seconds", "test", buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.observe(value)
+
+    text = registry.render()
+
+    assert 'latency_seconds_bucket{le="0.1"} 2' in text
+    assert 'latency_seconds_bucket{le="1.0"} 3' in text
+    assert 'latency_seconds_bucket{le="+Inf"} 4' in text
+    assert "latency_seconds_count 4" in text
+    assert "latency_seconds_sum 3.65" in text
+
+
+@pytest.mark.asyncio
+async def test_request_latency_by_route_template():
+    async with AsyncClient(app=app, base_url="http://localhost") as ac:
+        await ac.get(f"/event/{uuid.uuid4()}")
+        await ac.get(f"/event/{uuid.uuid4()}")
+        response = await ac.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert (
+        'http_request_duration_seconds_count{method="GET",route="/event/{event_id}",status="404"} 2'
+        in response.text
+    )
+    assert "events_published_total" in response.text
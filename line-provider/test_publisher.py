@@ -0,0 +1,108 @@
+import asyncio
+
+import pytest
+
+import publisher as publisher_module
+from publisher import EventPublisher
+
+
+class FakeChannel:
+    def __init__(self):
+        self.is_closed = False
+
+    async def declare_queue(self, name):
+        return name
+
+
+class FakeConnection:
+    def __init__(self):
+        self.channels = []
+        self.closed = False
+
+    async def channel(self, **kwargs):
+        channel = FakeChannel()
+        self.channels.append(channel)
+        return channel
+
+    async def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def connections(monkeypatch):
+    created = []
+
+    async def connect_robust(url):
+        connection = FakeConnection()
+        created.append(connection)
+        return connection
+
+    monkeypatch.setattr(publisher_module.aio_pika, "connect_robust", connect_robust)
+    return created
+
+
+@pytest.mark.asyncio
+async def test_pool_reuses_connection_and_bounds_channels(connections):
+    publisher = EventPublisher("amqp://test/", "events", pool_size=2)
+
+    async def publish():
+        async with publisher.acquire():
+            await asyncio.sleep(0.01)
+
+    await asyncio.gather(*(publish() for _ in range(10)))
+
+    assert len(connections) == 1
+    assert len(connections[0].channels) == 2
+
+    await publisher.close()
+    assert connections[0].closed
+
+
+@pytest.mark.asyncio
+async def test_pool_replaces_closed_channel(connections):
+    publisher = EventPublisher("amqp://test/", "events", pool_size=1)
+
+    async with publisher.acquire() as channel:
+        channel.is_closed = True
+    async with publisher.acquire() as channel:
+        assert not channel.is_closed
+
+    assert len(connections[0].channels) == 2
+    await publisher.close()
+
+
+@pytest.mark.asyncio
+async def test_waiter_gets_new_channel_when_held_one_closes(connections):
+    publisher = EventPublisher("amqp://test/", "events", pool_size=1)
+    held = asyncio.Event()
+    done = asyncio.Event()
+
+    async def hold():
+        async with publisher.acquire() as channel:
+            held.set()
+            await done.wait()
+            # closed by a reconnect while in use
+            channel.is_closed = True
+
+    holder = asyncio.create_task(hold())
+    await held.wait()
+    waiter = asyncio.create_task(publisher.acquire().__aenter__())
+    await asyncio.sleep(0)
+    done.set()
+    await holder
+    channel = await asyncio.wait_for(waiter, 1)
+
+    assert not channel.is_closed
+    assert len(connections[0].channels) == 2
+    await publisher.close()
+
+
+@pytest.mark.asyncio
+async def test_close_fails_waiters(connections):
+    publisher = EventPublisher("amqp://test/", "events", pool_size=1)
+    async with publisher.acquire():
+        waiter = asyncio.create_task(publisher.acquire().__aenter__())
+        await asyncio.sleep(0)
+        await publisher.close()
+        with pytest.raises(ConnectionError):
+            await asyncio.wait_for(waiter, 1)
@@ -0,0 +1,71 @@
+import json
+import uuid
+
+from fastapi.encoders import jsonable_encoder
+
+from app import to_event
+from event_store import EventStore, STATE_NEW
+from response_cache import ResponseCache, encode_event
+
+
+def test_encode_event_as_fastapi():
+    store = EventStore()
+    for cents in (1, 115, 120, 167, 100000):
+        record = store.put(uuid.uuid4(), cents, 1700000000, STATE_NEW)
+        assert json.loads(encode_event(record)) == jsonable_encoder(to_event(record))
+        assert list(json.loads(encode_event(record))) == list(
+            jsonable_encoder(to_event(record))
+        )
+
+
+def test_cache_is_invalidated_by_writes():
+    store = EventStore()
+    cache = ResponseCache(store)
+    first, second = uuid.uuid4(), uuid.uuid4()
+    store.put(first, 120, 100, STATE_NEW)
+    store.put(second, 150, 200, STATE_NEW)
+
+    all_events = cache.all()
+    event = cache.event(store.get(first))
+    assert cache.all() is all_events and cache.event(store.get(first)) is event
+    assert [e["event_id"] for e in json.loads(all_events.body)] == [
+        str(first),
+        str(second),
+    ]
+
+    store.put(second, 175, 200, 3)
+    assert cache.all().etag != all_events.etag
+    # other events keep their bytes
+    assert cache.event(store.get(first)) is event
+    assert json.loads(cache.event(store.get(second)).body)["coefficient"] == 1.75
+
+
+def test_active_list_expires_with_deadlines():
+    store = EventStore()
+    cache = ResponseCache(store)
+    first, second = uuid.uuid4(), uuid.uuid4()
+    store.put(first, 120, 100, STATE_NEW)
+    store.put(second, 150, 200, STATE_NEW)
+
+    active = cache.active(now=50)
+    assert cache.active(now=99) is active
+    assert [e["event_id"] for e in json.loads(cache.active(now=100).body)] == [
+        str(second)
+    ]
+    assert cache.active(now=200).body == b"[]"
+
+
+def test_event_bytes_are_bounded():
+    store = EventStore()
+    cache = ResponseCache(store, max_events=2)
+    records = [store.put(uuid.uuid4(), 120, 100, STATE_NEW) for _ in range(3)]
+    first = cache.event(records[0])
+    cache.event(records[1])
+    # the last read event is kept, the least recently read one is evicted
+    assert cache.event(records[0]) is first
+    cache.event(records[2])
+    assert len(cache) == 2
+    assert cache.event(records[0]) is first
+    assert [e["event_id"] for e in json.loads(cache.all().body)] == [
+        str(r.event_id) for r in records
+    ]
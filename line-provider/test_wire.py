@@ -0,0 +1,57 @@
+import decimal
+import json
+import time
+import uuid
+
+import pytest
+
+import wire
+from app import Event, EventState
+
+
+def make_event() -> Event:
+    return Event(
+        event_id=uuid.uuid4(),
+        coefficient=decimal.Decimal("12.34"),
+        deadline=int(time.time()) + 600,
+        state=EventState.FINISHED_LOSE,
+    )
+
+
+def test_binary_roundtrip():
+    event = make_event()
+    data = wire.encode(event, wire.BINARY_CONTENT_TYPE)
+
+    assert len(data) == 30
+    assert Event(**wire.decode_binary(data)) == event
+
+
+def test_json_stays_compatible():
+    event = make_event()
+    data = wire.encode(event, wire.JSON_CONTENT_TYPE)
+
+    assert json.loads(data) == {
+        "event_id": str(event.event_id),
+        "coefficient": 12.34,
+        "deadline": event.deadline,
+        "state": 3,
+    }
+
+
+def test_unknown_binary_version():
+    data = bytearray(wire.encode_binary(make_event()))
+    data[0] = 99
+    with pytest.raises(ValueError):
+        wire.decode_binary(bytes(data))
+
+
+def test_version_in_both_formats():
+    event = make_event()
+    binary = wire.encode(event, wire.BINARY_CONTENT_TYPE, version=2**40)
+
+    assert len(binary) == 38
+    assert wire.decode_binary(binary)["version"] == 2**40
+    assert (
+        json.loads(wire.encode(event, wire.JSON_CONTENT_TYPE, version=7))["version"]
+        == 7
+    )
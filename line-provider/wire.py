@@ -0,0 +1,63 @@
+import decimal
+import json
+import struct
+import uuid
+
+from fastapi.encoders import jsonable_encoder
+
+# keep in sync with bet-maker/app/services/wire.py
+
+JSON_CONTENT_TYPE = "application/json"
+# compact binary event, the first byte is the format version
+BINARY_CONTENT_TYPE = "application/x-betting-event"
+
+BINARY_V1 = 1
+# format version, event_id, coefficient in cents, deadline, state
+_binary_v1 = struct.Struct(">B16sIqB")
+BINARY_V2 = 2
+# v1 + event version: seq of the change, consumers drop older versions
+_binary_v2 = struct.Struct(">B16sIqBQ")
+
+
+def encode_json(event, version: int | None = None) -> bytes:
+    data = jsonable_encoder(event)
+    if version is not None:
+        data["version"] = version
+    return json.dumps(data).encode("utf-8")
+
+
+def encode_binary(event, version: int | None = None) -> bytes:
+    fields = (
+        event.event_id.bytes,
+        int(event.coefficient * 100),
+        event.deadline,
+        event.state.value,
+    )
+    if version is None:
+        return _binary_v1.pack(BINARY_V1, *fields)
+    return _binary_v2.pack(BINARY_V2, *fields, version)
+
+
+def decode_binary(data: bytes) -> dict:
+    if data[:1] == bytes([BINARY_V2]):
+        _, event_id, cents, deadline, state, version = _binary_v2.unpack(data)
+    elif data[:1] == bytes([BINARY_V1]):
+        _, event_id, cents, deadline, state = _binary_v1.unpack(data)
+        version = None
+    else:
+        raise ValueError(f"Unsupported event format version: {data[:1]!r}")
+    return {
+        "event_id": uuid.UUID(bytes=event_id),
+        "coefficient": decimal.Decimal(cents).scaleb(-2),
+        "deadline": deadline,
+        "state": state,
+        "version": version,
+    }
+
+
+def encode(event, content_type: str, version: int | None = None) -> bytes:
+    if content_type == BINARY_CONTENT_TYPE:
+        return encode_binary(event, version)
+    if content_type == JSON_CONTENT_TYPE:
+        return encode_json(event, version)
+    raise ValueError(f"Unsupported content type: {content_type}")
@@ -0,0 +1,163 @@
+"""
+In-memory stand-in for the part of aio_pika used by line-provider and
+bet-maker: robust connection, channels with qos, default exchange, queues
+with consumers and manual ack. Both services run in the same event loop.
+"""
+
+import asyncio
+import collections
+import time
+
+
+class IncomingMessage:
+    def __init__(self, queue: "Queue", message, published_at: float):
+        self._queue = queue
+        self._message = message
+        self.body = message.body
+        self.content_type = message.content_type
+        self.timestamp = message.timestamp
+        self.published_at = published_at
+        self.consumer = None
+        self.processed = False
+
+    async def ack(self, multiple: bool = False):
+        self._settle()
+        self._queue.broker.on_ack(self)
+
+    async def reject(self, requeue: bool = False):
+        self._settle()
+        if requeue:
+            self._queue.put(self._message, self.published_at)
+
+    async def nack(self, multiple: bool = False, requeue: bool = True):
+        await self.reject(requeue=requeue)
+
+    def _settle(self):
+        if self.processed:
+            raise RuntimeError("Message already processed")
+        self.processed = True
+        self.consumer.unacked -= 1
+        self._queue.dispatch()
+
+
+class Consumer:
+    def __init__(self, channel: "Channel", callback):
+        self.channel = channel
+        self.callback = callback
+        self.unacked = 0
+
+    @property
+    def ready(self) -> bool:
+        prefetch = self.channel.prefetch_count
+        return not prefetch or self.unacked < prefetch
+
+
+class Queue:
+    def __init__(self, broker: "InMemoryBroker", name: str):
+        self.broker = broker
+        self.name = name
+        self.messages = collections.deque()
+        self.consumers: list[Consumer] = []
+        self._next = 0
+
+    def put(self, message, published_at: float):
+        self.messages.append((message, published_at))
+        self.dispatch()
+
+    def dispatch(self):
+        # round-robin over consumers that have prefetch capacity left
+        while self.messages and self.consumers:
+            for _ in range(len(self.consumers)):
+                consumer = self.consumers[self._next % len(self.consumers)]
+                self._next += 1
+                if consumer.ready:
+                    break
+            else:
+                return
+            message, published_at = self.messages.popleft()
+            incoming = IncomingMessage(self, message, published_at)
+            incoming.consumer = consumer
+            consumer.unacked += 1
+            asyncio.get_running_loop().create_task(consumer.callback(incoming))
+
+
+class DeclaredQueue:
+    "Queue as seen through the channel that declared it"
+
+    def __init__(self, queue: Queue, channel: "Channel"):
+        self.queue = queue
+        self.channel = channel
+        self.name = queue.name
+
+    async def consume(self, callback, **kwargs):
+        self.queue.consumers.append(Consumer(self.channel, callback))
+        self.queue.dispatch()
+        return f"ctag{len(self.queue.consumers)}"
+
+
+class Exchange:
+    def __init__(self, broker: "InMemoryBroker"):
+        self.broker = broker
+
+    async def publish(self, message, routing_key: str, **kwargs):
+        self.broker.published += 1
+        self.broker.queue(routing_key).put(message, time.perf_counter())
+
+
+class Channel:
+    def __init__(self, broker: "InMemoryBroker"):
+        self.broker = broker
+        self.prefetch_count = 0
+        self.is_closed = False
+        self.default_exchange = Exchange(broker)
+
+    async def set_qos(self, prefetch_count: int = 0, **kwargs):
+        self.prefetch_count = prefetch_count
+
+    async def declare_queue(self, name: str, **kwargs) -> DeclaredQueue:
+        return DeclaredQueue(self.broker.queue(name), self)
+
+    async def queue_delete(self, name: str, **kwargs):
+        self.broker.queues.pop(name, None)
+
+    async def close(self):
+        self.is_closed = True
+
+
+class Connection:
+    def __init__(self, broker: "InMemoryBroker"):
+        self.broker = broker
+        self.is_closed = False
+
+    async def channel(self, **kwargs) -> Channel:
+        return Channel(self.broker)
+
+    async def close(self):
+        self.is_closed = True
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+
+class InMemoryBroker:
+    def __init__(self):
+        self.queues: dict[str, Queue] = {}
+        self.published = 0
+        self.acked = 0
+        # publish -> ack seconds, the consumer acks after the event is applied
+        self.lags: list[float] = []
+
+    def queue(self, name: str) -> Queue:
+        if name not in self.queues:
+            self.queues[name] = Queue(self, name)
+        return self.queues[name]
+
+    def on_ack(self, message: IncomingMessage):
+        self.acked += 1
+        self.lags.append(time.perf_counter() - message.published_at)
+
+    async def connect_robust(self, url: str = None, **kwargs) -> Connection:
+        return Connection(self)
@@ -0,0 +1,233 @@
+"""
+End-to-end load harness: runs line-provider and bet-maker in one process
+with an in-memory stand-in for RabbitMQ, drives event updates, bets and
+reads at fixed rates and writes latency/throughput results as JSON.
+
+Needs the bet-maker Postgres (DATABASE_URL), its schema is migrated with
+alembic first. Events and bets written by the run stay there, so run it
+against a scratch database:
+    python loadtest/harness.py --duration 30 --events 100 \\
+        --update-rate 200 --bet-rate 100 --read-rate 50 --output results.json
+"""
+
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import pathlib
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+import aio_pika
+from httpx import AsyncClient
+from loguru import logger
+
+from broker import InMemoryBroker
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+
+
+def migrate():
+    # what the bet-maker entrypoint runs before start, the app doesn't create
+    # the schema itself
+    subprocess.run(
+        [sys.executable, "-m", "alembic", "upgrade", "head"],
+        cwd=ROOT / "bet-maker",
+        check=True,
+    )
+
+
+def load_services(broker: InMemoryBroker):
+    # line-provider keeps its event log in a throwaway directory
+    os.environ.setdefault("EVENTS_DATA_DIR", tempfile.mkdtemp(prefix="line-provider-"))
+    # both services resolve aio_pika.connect_robust at call time
+    aio_pika.connect_robust = broker.connect_robust
+    # the bet-maker `app` package must win over line-provider/app.py
+    sys.path[:0] = [str(ROOT / "bet-maker"), str(ROOT / "line-provider")]
+    from app.main import app as bet_maker
+
+    spec = importlib.util.spec_from_file_location(
+        "line_provider_app", ROOT / "line-provider" / "app.py"
+    )
+    line_provider = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(line_provider)
+
+    # startup resync of bet-maker pulls from the in-process line-provider
+    from app import services
+
+    async def resync():
+        async with AsyncClient(app=line_provider.app, base_url="http://lp") as client:
+            await services.sync.sync_events(client)
+
+    services.sync.resync = resync
+    return line_provider.app, bet_maker
+
+
+def percentile(values: list[float], p: float) -> float | None:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def summary_ms(values: list[float]) -> dict:
+    return {
+        f"p{int(p * 100)}_ms": (
+            round(percentile(values, p) * 1000, 3) if values else None
+        )
+        for p in (0.5, 0.95, 0.99)
+    }
+
+
+class Stats:
+    def __init__(self):
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.errors: dict[str, int] = defaultdict(int)
+
+    async def timed(self, name: str, request):
+        started = time.perf_counter()
+        try:
+            response = await request
+            failed = response.status_code >= 400
+        except Exception:
+            failed = True
+        self.latencies[name].append(time.perf_counter() - started)
+        if failed:
+            self.errors[name] += 1
+
+    def report(self, duration: float) -> dict:
+        return {
+            name: {
+                "count": len(values),
+                "errors": self.errors[name],
+                "rps": round(len(values) / duration, 1),
+                **summary_ms(values),
+            }
+            for name, values in self.latencies.items()
+        }
+
+
+async def at_rate(rate: float, duration: float, make_request):
+    "Open loop: start requests on schedule, slow responses don't lower the load"
+    if rate <= 0:
+        return
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    tasks = []
+    for i in range(int(rate * duration)):
+        await asyncio.sleep(max(0, started + i / rate - loop.time()))
+        tasks.append(asyncio.create_task(make_request()))
+    await asyncio.gather(*tasks)
+
+
+async def wait_until(condition, timeout: float):
+    deadline = time.perf_counter() + timeout
+    while not await condition():
+        if time.perf_counter() > deadline:
+            raise TimeoutError("Load harness setup timed out")
+        await asyncio.sleep(0.05)
+
+
+async def run(args) -> dict:
+    migrate()
+    broker = InMemoryBroker()
+    line_provider, bet_maker = load_services(broker)
+    await line_provider.router.startup()
+    await bet_maker.router.startup()
+
+    lp = AsyncClient(app=line_provider, base_url="http://line-provider")
+    bm = AsyncClient(app=bet_maker, base_url="http://bet-maker")
+    deadline = int(time.time()) + 3600
+    event_ids = []
+    for _ in range(args.events):
+        response = await lp.post(
+            "/event", json={"coefficient": 1.5, "deadline": deadline, "state": 1}
+        )
+        event_ids.append(response.json()["event_id"])
+
+    async def all_events_applied():
+        response = await bm.get("/events")
+        known = {event["event_id"] for event in response.json()}
+        return known.issuperset(event_ids)
+
+    await wait_until(all_events_applied, timeout=30)
+
+    stats = Stats()
+    broker.lags.clear()
+    acked_before = broker.acked
+
+    def update_coeff():
+        event_id = random.choice(event_ids)
+        coefficient = random.randint(101, 999) / 100
+        return stats.timed(
+            "PATCH line-provider /events/{id}/coeff",
+            lp.patch(f"/events/{event_id}/coeff", json={"coefficient": coefficient}),
+        )
+
+    def place_bet():
+        bet = {"event_id": random.choice(event_ids), "amount": 10}
+        return stats.timed("POST bet-maker /bet", bm.post("/bet", json=bet))
+
+    def read_bet_maker():
+        return stats.timed("GET bet-maker /events", bm.get("/events"))
+
+    def read_line_provider():
+        return stats.timed("GET line-provider /events", lp.get("/events"))
+
+    started = time.perf_counter()
+    await asyncio.gather(
+        at_rate(args.update_rate, args.duration, update_coeff),
+        at_rate(args.bet_rate, args.duration, place_bet),
+        at_rate(args.read_rate, args.duration, read_bet_maker),
+        at_rate(args.read_rate, args.duration, read_line_provider),
+    )
+    load_time = time.perf_counter() - started
+
+    async def queue_drained():
+        return broker.acked >= broker.published
+
+    await wait_until(queue_drained, timeout=60)
+    drain_time = time.perf_counter() - started
+
+    await lp.aclose()
+    await bm.aclose()
+    await line_provider.router.shutdown()
+
+    return {
+        "config": vars(args),
+        "requests": stats.report(load_time),
+        "events": {
+            "published": broker.published,
+            "applied": broker.acked - acked_before,
+            "messages_per_sec": round((broker.acked - acked_before) / drain_time, 1),
+            "publish_to_applied": summary_ms(broker.lags),
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--events", type=int, default=100)
+    parser.add_argument("--update-rate", type=float, default=200)
+    parser.add_argument("--bet-rate", type=float, default=100)
+    parser.add_argument("--read-rate", type=float, default=50)
+    parser.add_argument("--output", default="loadtest_results.json")
+    args = parser.parse_args()
+
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+    results = asyncio.run(run(args))
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()